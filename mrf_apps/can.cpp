@@ -35,6 +35,10 @@
  * It is recommended to cache content within the bitmap, to reduce or eliminate the cost associated
  * with reading from the bitmap
  *
+ * An existing canned file can be updated in place after a few blocks of the index change.
+ * Only the changed data blocks are written, unless blocks appear or disappear, in which case
+ * the data blocks and the bitmap lines following the first such block are also rewritten
+ *
  */
 
 #if defined(_WIN32)
@@ -133,12 +137,14 @@ inline bool check(const char *src, size_t len = BSZ) {
 
 // Program options
 struct options {
-    options() : un(false), quiet(false) {}
+    options() : un(false), quiet(false), update(false) {}
     vector<string> file_names;
     string error; // Empty if parsing went fine
+    string blocks; // File with the changed block numbers, for update
     bool un;      // uncanning
     bool generic; // generic file, skip index structure checks
     bool quiet;   // Verbose by default
+    bool update;  // update an existing canned file
 };
 
 static options parse(int argc, char **argv) {
@@ -164,6 +170,17 @@ static options parse(int argc, char **argv) {
             else if (arg == "-g") {
                 opt.generic = true;
             }
+            else if (arg == "-i") {
+                opt.update = true;
+            }
+            else if (arg == "-b") {
+                if (++i == argc) {
+                    opt.error = "Option -b needs a file name";
+                    return opt;
+                }
+                opt.blocks = argv[i];
+                opt.update = true;
+            }
             else if (arg == "-") { // Could be stdin or stdout file name
                 opt.file_names.push_back(arg);
             }
@@ -189,8 +206,11 @@ static options parse(int argc, char **argv) {
 
 static int Usage(const string &error) {
     cerr << error << endl;
-    cerr << "can [-u] [-g] [-q] [-h] [--] input_file output_file" << endl;
+    cerr << "can [-u] [-i] [-b blocks_file] [-g] [-q] [-h] [--] input_file output_file" << endl;
     cerr << "\t-u : uncan" << endl;
+    cerr << "\t-i : update an existing canned output, only the blocks holding data are checked" << endl;
+    cerr << "\t-b : update an existing canned output, only the blocks listed in the file are checked" << endl;
+    cerr << "\t     The file holds 512 byte block numbers, one per line, - is stdin" << endl;
     cerr << "\t-g : generic input, not necessarily an mrf index file" << endl;
     cerr << "\t-h : help, print this message" << endl;
     cerr << "\t-- : end of options, only file names follow" << endl;
@@ -229,6 +249,108 @@ inline bool is_on(uint32_t *values, int bit) {
     return 0 != (values[1 + bit / 32] & (static_cast<uint32_t>(1) << bit % 32));
 }
 
+// Number of bits set
+inline int bit_count(uint32_t v) {
+    v = v - ((v >> 1) & 0x55555555);
+    v = (v & 0x33333333) + ((v >> 2) & 0x33333333);
+    return static_cast<int>((((v + (v >> 4)) & 0x0F0F0F0F) * 0x01010101) >> 24);
+}
+
+// Position of the bitmap line holding a block, within the header
+inline size_t line_of(uint64_t block) {
+    return static_cast<size_t>(4 * (1 + block / 96));
+}
+
+// Number of set bits in the bitmap before the start of a line, which is the
+// running count stored in the line. Lines marked with the signature start at 0
+inline uint64_t line_start(const vector<uint32_t> &header, size_t line) {
+    if (header[line] == *reinterpret_cast<const uint32_t *>(SIG))
+        return 0;
+    return header[line];
+}
+
+// Data block number of an input block which is present
+static uint64_t rank_of(const vector<uint32_t> &header, uint64_t line_start_count, uint64_t block) {
+    size_t line = line_of(block);
+    int bit = static_cast<int>(block % 96);
+    uint64_t rank = line_start_count;
+    for (int i = 0; i < bit / 32; i++)
+        rank += bit_count(header[line + 1 + i]);
+    if (bit % 32)
+        rank += bit_count(header[line + 1 + bit / 32] & ((static_cast<uint32_t>(1) << bit % 32) - 1));
+    return rank;
+}
+
+// Set the running counts for the lines starting at first, the same way can does.
+// Empty lines before the first data block are marked with the signature,
+// except for the last line
+static void set_counts(vector<uint32_t> &header, size_t first) {
+    uint64_t count = line_start(header, first);
+    for (size_t line = first; line < header.size(); line += 4) {
+        header[line] = static_cast<uint32_t>(count);
+        count += bit_count(header[line + 1]) + bit_count(header[line + 2]) + bit_count(header[line + 3]);
+        if (count == 0 && line + 4 < header.size())
+            header[line] = *reinterpret_cast<const uint32_t *>(SIG);
+    }
+}
+
+// Read a block from the input index, the last one may be partial
+// Returns the number of bytes in the block, 0 on error
+static size_t read_block(FILE *in_idx, uint64_t in_size, uint64_t block, char *buffer) {
+    uint64_t offset = block * BSZ;
+    size_t len = static_cast<size_t>(min(static_cast<uint64_t>(BSZ), in_size - offset));
+    memset(buffer, 0, BSZ);
+    FSEEK(in_idx, offset, SEEK_SET);
+    if (len != fread(buffer, 1, len, in_idx)) {
+        cerr << "Error reading block " << block << " from input file\n";
+        return 0;
+    }
+    return len;
+}
+
+// Block numbers read from a text file, one per line
+static bool read_block_list(const string &name, vector<uint64_t> &blocks) {
+    ifstream file;
+    if (name != "-")
+        file.open(name);
+    istream &in = (name == "-") ? cin : file;
+    if (!in) {
+        cerr << "Can't open " << name << endl;
+        return false;
+    }
+    uint64_t block;
+    while (in >> block)
+        blocks.push_back(block);
+    if (!in.eof()) {
+        cerr << "Error reading block numbers from " << name << endl;
+        return false;
+    }
+    return true;
+}
+
+// Blocks of the input which hold data, skipping the holes of a sparse file
+// Returns false if the system can't tell
+static bool data_blocks(FILE *in_idx, uint64_t in_size, vector<uint64_t> &blocks) {
+#if defined(SEEK_DATA)
+    int fd = fileno(in_idx);
+    off_t pos = 0;
+    while (static_cast<uint64_t>(pos) < in_size) {
+        off_t start = lseek(fd, pos, SEEK_DATA);
+        if (start < 0)
+            break; // No more data
+        off_t end = lseek(fd, start, SEEK_HOLE);
+        if (end < 0)
+            return false;
+        for (uint64_t block = start / BSZ; block * BSZ < static_cast<uint64_t>(end); block++)
+            blocks.push_back(block);
+        pos = end;
+    }
+    return true;
+#else
+    return false;
+#endif
+}
+
 int can(const options &opt) {
     if (opt.file_names.size() != 2)
         return Usage("Need an input and an output name");
@@ -374,6 +496,194 @@ int can(const options &opt) {
 }
 
 
+// Update an existing canned file after some blocks of the index changed
+// Data blocks which stay present are rewritten in place. If blocks appear or
+// disappear, the bitmap lines and the data blocks following the first such block
+// are rewritten, up to the last one. The result is the same as canning again
+int recan(const options &opt) {
+    if (opt.file_names.size() != 2)
+        return Usage("Need an input and an output name");
+
+    string in_idx_name(opt.file_names[0]);
+    string out_idx_name(opt.file_names[1]);
+
+    if (!opt.generic) {
+        if (!substr_equal(in_idx_name, ".idx", -4))
+            return Usage("Input file should have an .idx extension");
+
+        if (!substr_equal(out_idx_name, ".ix", -3))
+            return Usage("Output file should have an .ix extension");
+    }
+
+    FILE *in_idx = fopen(in_idx_name.c_str(), "rb");
+    FILE *out_idx = fopen(out_idx_name.c_str(), "r+b");
+
+    if (!in_idx || !out_idx) {
+        cerr << "Error opening " << (in_idx ? out_idx_name : in_idx_name) << endl;
+        return IO_ERR;
+    }
+
+    FSEEK(in_idx, 0, SEEK_END);
+    uint64_t in_size = static_cast<uint64_t>(FTELL(in_idx));
+
+    vector<uint32_t> header(4);
+    if (4 != fread(header.data(), sizeof(uint32_t), 4, out_idx)) {
+        cerr << "Error reading from output header\n";
+        return IO_ERR;
+    }
+    if (header[0] != *reinterpret_cast<const uint32_t *>(SIG))
+        return Usage("Output is not a canned file, wrong magic");
+
+    // The bitmap depends on the input size, can it again if that changed
+    if (be64toh(*reinterpret_cast<uint64_t *>(&header[2])) != in_size) {
+        if (!opt.quiet)
+            cout << "Input size changed, canning all of it" << endl;
+        fclose(in_idx);
+        fclose(out_idx);
+        return can(opt);
+    }
+
+    uint64_t header_size = hsize(in_size);
+    if (static_cast<uint64_t>(be32toh(header[1])) * 16 != header_size)
+        return Usage("Output header is corrupt");
+
+    header.resize(static_cast<size_t>(header_size / sizeof(uint32_t)));
+    if (header.size() - 4 != fread(&header[4], sizeof(uint32_t), header.size() - 4, out_idx)) {
+        cerr << "Error reading output bitmap\n";
+        return IO_ERR;
+    }
+    // Only the bitmap is used
+    for (size_t i = 4; i < header.size(); i++)
+        header[i] = be32toh(header[i]);
+
+    uint64_t in_block_count = (BSZ - 1 + in_size) / BSZ;
+    vector<uint64_t> blocks;
+    if (!opt.blocks.empty()) {
+        if (!read_block_list(opt.blocks, blocks))
+            return IO_ERR;
+    }
+    else {
+        if (!data_blocks(in_idx, in_size, blocks)) {
+            if (!opt.quiet)
+                cout << "Can't find the data blocks, canning all of it" << endl;
+            fclose(in_idx);
+            fclose(out_idx);
+            return can(opt);
+        }
+        // Blocks which used to hold data might be holes now
+        for (uint64_t block = 0; block < in_block_count; block++)
+            if (is_on(&header[line_of(block)], block % 96))
+                blocks.push_back(block);
+    }
+    sort(blocks.begin(), blocks.end());
+    blocks.erase(unique(blocks.begin(), blocks.end()), blocks.end());
+    if (!blocks.empty() && blocks.back() >= in_block_count) {
+        cerr << "Block " << blocks.back() << " is past the end of the input\n";
+        return USAGE_ERR;
+    }
+
+    // Find the blocks which appear or disappear, and update the bitmap.
+    // The running counts of the lines up to the first flip stay valid
+    const vector<uint32_t> old_header(header);
+    vector<uint64_t> flipped;
+    for (auto block : blocks) {
+        char buffer[BSZ];
+        if (!read_block(in_idx, in_size, block, buffer))
+            return IO_ERR;
+        bool present = !check(buffer);
+        uint32_t &word = header[line_of(block) + 1 + (block % 96) / 32];
+        uint32_t mask = static_cast<uint32_t>(1) << (block % 96) % 32;
+        if (present != (0 != (word & mask))) {
+            word ^= mask;
+            flipped.push_back(block);
+        }
+    }
+
+    // Data blocks with the same rank before and after are rewritten in place,
+    // only when the content changed. That is every block before the first flip
+    // and after the last, if the same number of blocks appeared and disappeared.
+    // The data blocks in between are all written again
+    uint64_t first = flipped.empty() ? in_block_count : flipped.front();
+    uint64_t last = flipped.empty() ? in_block_count : flipped.back();
+    int64_t shift = 0;
+    for (auto block : flipped)
+        shift += is_on(&header[line_of(block)], block % 96) ? 1 : -1;
+    // Past this block the data blocks are written again only if the ranks changed
+    uint64_t stop = (shift == 0) ? last + 1 : in_block_count;
+
+    size_t rewritten = 0;
+    char buffer[BSZ], old_buffer[BSZ];
+    for (auto block : blocks) {
+        if (block >= first && block < stop)
+            continue;
+        if (!is_on(&header[line_of(block)], block % 96))
+            continue;
+        size_t len = read_block(in_idx, in_size, block, buffer);
+        if (!len)
+            return IO_ERR;
+        uint64_t offset = header_size
+            + BSZ * rank_of(old_header, line_start(old_header, line_of(block)), block);
+        FSEEK(out_idx, offset, SEEK_SET);
+        if (len != fread(old_buffer, 1, len, out_idx)) {
+            cerr << "Error reading from output file\n";
+            return IO_ERR;
+        }
+        if (!memcmp(buffer, old_buffer, len))
+            continue;
+        FSEEK(out_idx, offset, SEEK_SET);
+        if (len != fwrite(buffer, 1, len, out_idx)) {
+            cerr << "Error writing to output file\n";
+            return IO_ERR;
+        }
+        rewritten++;
+    }
+
+    size_t lines = 0;
+    if (!flipped.empty()) {
+        // Data blocks from the first flip on, read from the input
+        size_t first_line = line_of(first);
+        uint64_t line_count = line_start(header, first_line);
+        FSEEK(out_idx, header_size + BSZ * rank_of(header, line_count, first), SEEK_SET);
+        for (uint64_t block = first; block < stop; block++) {
+            if (!is_on(&header[line_of(block)], block % 96))
+                continue;
+            size_t len = read_block(in_idx, in_size, block, buffer);
+            if (!len)
+                return IO_ERR;
+            if (len != fwrite(buffer, 1, len, out_idx)) {
+                cerr << "Error writing to output file\n";
+                return IO_ERR;
+            }
+            rewritten++;
+        }
+        if (stop == in_block_count && !MARK_END(out_idx)) {
+            cerr << "Error truncating the output file\n";
+            return IO_ERR;
+        }
+
+        // Bitmap lines from the first flip on, the running counts after the
+        // last flip stay the same if there is no shift
+        set_counts(header, first_line);
+        size_t end_line = (shift == 0) ? line_of(last) + 4 : header.size();
+        lines = (end_line - first_line) / 4;
+        for (size_t i = first_line; i < end_line; i++)
+            header[i] = htobe32(header[i]);
+        FSEEK(out_idx, first_line * sizeof(uint32_t), SEEK_SET);
+        if (end_line - first_line != fwrite(&header[first_line], sizeof(uint32_t), end_line - first_line, out_idx)) {
+            cerr << "Error writing output header\n";
+            return IO_ERR;
+        }
+    }
+
+    if (!opt.quiet)
+        cout << "Checked " << blocks.size() << " blocks, rewrote " << rewritten
+            << " data blocks and " << lines << " bitmap lines" << endl;
+
+    fclose(in_idx);
+    fclose(out_idx);
+    return NO_ERR;
+}
+
 int uncan(const options &opt) {
     if (opt.file_names.size() != 2)
         return Usage("Need an input and an output name, use - to use stdin or stdout");
@@ -513,5 +823,7 @@ int main(int argc, char **argv)
 
     if (opt.un)
         return uncan(opt);
+    if (opt.update)
+        return recan(opt);
     return can(opt);
 }
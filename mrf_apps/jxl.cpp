@@ -6,11 +6,16 @@
 #include <algorithm>
 #include <cassert>
 #include <cstdio>
+#include <cstring>
 #include <sys/stat.h>
 #include <cstdlib>
 #include <fcntl.h>
 #include <sys/mman.h>
 #include <unistd.h>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <functional>
 
 // For Linux
 #include <endian.h>
@@ -20,13 +25,15 @@ using namespace std;
 const static int BSZ(128);
 const static int BSZ2(BSZ*BSZ);
 const static int BUFSZ(1024*1024); // 1MB, kinda small
+const static int BATCH(64); // Tiles per batch, per thread
 
 int Usage(const string &s) {
     cerr << s << endl << endl
     << "Synopsis: jxl [OPTIONS] <source-file>\n"
     << "\t-r\tReverse, convert JXL input to JFIF\n"
     << "\t-b\tBundle (esri v2) input, default is MRF\n"
-    << "\t-s\tSingle image, input is a JFIF or JXL (with -r)\n";
+    << "\t-s\tSingle image, input is a JFIF or JXL (with -r)\n"
+    << "\t-t N\tTranscode tiles with N threads, 0 for all cores, default is 1\n";
     return 1;
 }
 
@@ -58,6 +65,73 @@ static size_t out_fun(vector<uint8_t> *output, const uint8_t *data, size_t size)
     return size;
 }
 
+// Convert one tile, returns false on failure
+static bool convert(const uint8_t *data, size_t size, vector<uint8_t> &output, bool reverse) {
+    output.clear();
+    return reverse ?
+        DecodeBrunsli(size, data, &output, (DecodeBrunsliSink)out_fun)
+        : EncodeBrunsli(size, data, &output, (DecodeBrunsliSink)out_fun);
+}
+
+// Worker threads which live for the whole file
+// start() hands out fn(i) for every i in [0, n) and returns right away,
+// wait() returns once all of them are done
+class Pool {
+public:
+    Pool(int nthreads) {
+        for (int t = 0; t < max(nthreads, 1); t++)
+            workers.emplace_back([this]() { work(); });
+    }
+
+    ~Pool() {
+        {
+            lock_guard<mutex> lock(m);
+            stop = true;
+        }
+        todo.notify_all();
+        for (auto &worker : workers)
+            worker.join();
+    }
+
+    void start(size_t n, function<void(size_t)> fn) {
+        {
+            lock_guard<mutex> lock(m);
+            job = fn;
+            next = 0;
+            count = pending = n;
+        }
+        todo.notify_all();
+    }
+
+    void wait() {
+        unique_lock<mutex> lock(m);
+        done.wait(lock, [this]() { return pending == 0; });
+    }
+
+private:
+    void work() {
+        unique_lock<mutex> lock(m);
+        for (;;) {
+            todo.wait(lock, [this]() { return stop || next < count; });
+            if (stop)
+                return;
+            size_t i = next++;
+            lock.unlock();
+            job(i);
+            lock.lock();
+            if (--pending == 0)
+                done.notify_all();
+        }
+    }
+
+    vector<thread> workers;
+    mutex m;
+    condition_variable todo, done;
+    function<void(size_t)> job;
+    size_t next = 0, count = 0, pending = 0;
+    bool stop = false;
+};
+
 // Big Endian native
 struct tinfo {
     uint64_t offset;
@@ -99,7 +173,7 @@ int single_to_jxl(const string &inname, bool reverse = false) {
 }
 
 // From MRF, separate files, inname is the data file
-int mrf_to_jxl(const string &inname, const string &outname, bool reverse = false) {
+int mrf_to_jxl(const string &inname, const string &outname, bool reverse = false, int nthreads = 1) {
     // Assume three letter data file extension
     if ('.' != inname[inname.size() - 4])
         return Usage("Expect mrf data file with three letter file name extension");
@@ -123,46 +197,82 @@ int mrf_to_jxl(const string &inname, const string &outname, bool reverse = false
     // cout << "Opening " << outname << " and " << outidxname << endl;
     auto fout = fopen(outname.c_str(), "wb");
     auto foutidx = fopen(outidxname.c_str(), "wb");
-    tinfo tile;
-    vector<uint8_t> input;
-    vector<uint8_t> tilebuf;
     uint64_t ooff = 0;
 
     // Stats, saving ratio
     double min_rat = 1;
     double max_rat = -100;
-    while (fread(&tile, sizeof(tile), 1, finidx)) {
-        tile.toh();
-        if (tile.size) {
+
+    // Tiles are read and written in index order, by this thread
+    // A batch is transcoded by the pool while the next one is read
+    size_t batch = size_t(BATCH) * max(nthreads, 1);
+    struct Batch {
+        vector<tinfo> tiles;
+        vector<vector<uint8_t>> inputs, outputs;
+        vector<char> ok;
+        size_t n;
+    } batches[2];
+    for (auto &b : batches) {
+        b.tiles.resize(batch);
+        b.inputs.resize(batch);
+        b.outputs.resize(batch);
+        b.ok.resize(batch);
+        b.n = 0;
+    }
+
+    // Reads the next batch of tiles, returns false on error
+    auto read_batch = [&](Batch &b) {
+        b.n = fread(b.tiles.data(), sizeof(tinfo), batch, finidx);
+        for (size_t i = 0; i < b.n; i++) {
+            auto &tile = b.tiles[i];
+            tile.toh();
+            if (!tile.size) continue;
             fseek(fin, tile.offset, SEEK_SET);
-            input.resize(tile.size);
-            if (!fread(input.data(), tile.size, 1, fin)) {
+            b.inputs[i].resize(tile.size);
+            if (!fread(b.inputs[i].data(), tile.size, 1, fin)) {
                 cerr << "Location " << hex << tile.offset << " size " << tile.size << endl;
-                return Usage("Failed to read input tile");
+                return false;
             }
-            tilebuf.clear();
-
-            int result = reverse ?
-                DecodeBrunsli(tile.size, input.data(), &tilebuf, (DecodeBrunsliSink)out_fun)
-                : EncodeBrunsli(tile.size, input.data(), &tilebuf, (DecodeBrunsliSink)out_fun);
-            if (!result) {
-                cerr << "Location " << hex << tile.offset << " size " << tile.size << endl;
-                return Usage(reverse ? "Error decoding JXL" : "Error encoding JXL");
+        }
+        return true;
+    };
+
+    Pool pool(nthreads);
+    if (!read_batch(batches[0]))
+        return Usage("Failed to read input tile");
+    for (int cur = 0; batches[cur].n; cur = 1 - cur) {
+        auto &b = batches[cur];
+        pool.start(b.n, [&b, reverse](size_t i) {
+            b.ok[i] = !b.tiles[i].size || convert(b.inputs[i].data(), b.tiles[i].size, b.outputs[i], reverse);
+        });
+        bool read_ok = read_batch(batches[1 - cur]);
+        pool.wait();
+        if (!read_ok)
+            return Usage("Failed to read input tile");
+
+        for (size_t i = 0; i < b.n; i++) {
+            auto &tile = b.tiles[i];
+            auto &tilebuf = b.outputs[i];
+            if (tile.size) {
+                if (!b.ok[i]) {
+                    cerr << "Location " << hex << tile.offset << " size " << tile.size << endl;
+                    return Usage(reverse ? "Error decoding JXL" : "Error encoding JXL");
+                }
+
+                double rat = 1 - double(tilebuf.size()) / tile.size;
+                min_rat = min(rat, min_rat);
+                max_rat = max(rat, max_rat);
+
+                // Prepare the output tinfo
+                tile.offset = ooff;
+                tile.size = tilebuf.size();
+                ooff += tile.size;
+                if (!fwrite(tilebuf.data(), tilebuf.size(), 1, fout))
+                    return Usage("Error writing data");
             }
-
-            double rat = 1 - double(tilebuf.size()) / tile.size;
-            min_rat = min(rat, min_rat);
-            max_rat = max(rat, max_rat);
-
-            // Prepare the output tinfo
-            tile.offset = ooff;
-            tile.size = tilebuf.size();
-            ooff += tile.size;
-            if (!fwrite(tilebuf.data(), tilebuf.size(), 1, fout))
-                return Usage("Error writing data");
+            tile.ton();
         }
-        tile.ton();
-        fwrite(&tile, sizeof(tile), 1, foutidx);
+        fwrite(b.tiles.data(), sizeof(tinfo), b.n, foutidx);
     }
     fclose(fin);
     fclose(finidx);
@@ -175,7 +285,7 @@ int mrf_to_jxl(const string &inname, const string &outname, bool reverse = false
     return 0;
 }
 
-int bundle_to_jxl(const string &inname, const string &outname, bool reverse = false) {
+int bundle_to_jxl(const string &inname, const string &outname, bool reverse = false, int nthreads = 1) {
 
     struct stat statb;
     if (stat(inname.c_str(), &statb)) 
@@ -217,44 +327,68 @@ int bundle_to_jxl(const string &inname, const string &outname, bool reverse = fa
     fwrite(input, ooff, 1, out);
 
     // Convert, writing output as we go, reusing the index
-    vector<uint8_t> tilebuf; // output holder
     size_t maxsz = 0;
     // Stats, saving ratio
     double min_rat = 1;
     double max_rat = -100;
 
-    for (auto &v : idx) {
-        if (!v.size) continue;
-        tilebuf.clear();
-        int result = reverse ?
-            DecodeBrunsli(v.size, &input[v.offset], &tilebuf, (DecodeBrunsliSink)out_fun)
-            : EncodeBrunsli(v.size, &input[v.offset], &tilebuf, (DecodeBrunsliSink)out_fun);
-        if (!result) {
-            cerr << "Location " << hex << v.offset << " size " << v.size << endl;
-            return Usage(reverse ? "Error decoding JXL" : "Error encoding JXL");
+    // Transcode in batches, in parallel, then write in index order
+    // The input of the next batch is paged in while a batch is transcoded
+    size_t batch = size_t(BATCH) * max(nthreads, 1);
+    vector<vector<uint8_t>> outputs(batch);
+    vector<char> ok(batch);
+    auto prefetch = [&](size_t first) {
+        const uintptr_t page = sysconf(_SC_PAGESIZE);
+        for (size_t i = first; i < min(first + batch, idx.size()); i++) {
+            auto &v = idx[i];
+            if (!v.size) continue;
+            uintptr_t start = reinterpret_cast<uintptr_t>(input + v.offset) & ~(page - 1);
+            madvise(reinterpret_cast<void *>(start),
+                reinterpret_cast<uintptr_t>(input + v.offset + v.size) - start, MADV_WILLNEED);
         }
+    };
+    Pool pool(nthreads);
+    prefetch(0);
+    for (size_t first = 0; first < idx.size(); first += batch) {
+        size_t n = min(batch, idx.size() - first);
+        pool.start(n, [&, first](size_t i) {
+            auto &v = idx[first + i];
+            ok[i] = !v.size || convert(&input[v.offset], v.size, outputs[i], reverse);
+        });
+        prefetch(first + batch);
+        pool.wait();
+
+        for (size_t i = 0; i < n; i++) {
+            auto &v = idx[first + i];
+            if (!v.size) continue;
+            if (!ok[i]) {
+                cerr << "Location " << hex << v.offset << " size " << v.size << endl;
+                return Usage(reverse ? "Error decoding JXL" : "Error encoding JXL");
+            }
+            auto &tilebuf = outputs[i];
+
+            // This has to be 3 bytes or smaller, check anyhow
+            uint32_t tilesz = tilebuf.size();
+            if (tilesz >= (1 << 24) || static_cast<size_t>(tilesz) != tilebuf.size()) {
+                cerr << "Location " << hex << v.offset << " size " << v.size << 
+                    " converted to " << tilebuf.size() << endl;
+                return Usage("Output tile size too big");
+            }
+            // Looks good, write the output tile, prefixed by size
+            fwrite(&tilesz, 4, 1, out);
+            fwrite(tilebuf.data(), tilesz, 1, out);
 
-        // This has to be 3 bytes or smaller, check anyhow
-        uint32_t tilesz = tilebuf.size();
-        if (tilesz >= (1 << 24) || static_cast<size_t>(tilesz) != tilebuf.size()) {
-            cerr << "Location " << hex << v.offset << " size " << v.size << 
-                " converted to " << tilebuf.size() << endl;
-            return Usage("Output tile size too big");
+            // Collect stats
+            maxsz = max(maxsz, static_cast<size_t>(tilesz));
+            double rat = 1 - double(tilesz) / v.size;
+            min_rat = min(rat, min_rat);
+            max_rat = max(rat, max_rat);
+
+            // Modify the index in place
+            v.offset = ooff + 4; // Points to first byte of tile data, not the size prefix
+            v.size = tilesz;
+            ooff += 4 + tilesz;
         }
-        // Looks good, write the output tile, prefixed by size
-        fwrite(&tilesz, 4, 1, out);
-        fwrite(tilebuf.data(), tilesz, 1, out);
-
-        // Collect stats
-        maxsz = max(maxsz, static_cast<size_t>(tilesz));
-        double rat = 1 - double(tilesz) / v.size;
-        min_rat = min(rat, min_rat);
-        max_rat = max(rat, max_rat);
-
-        // Modify the index in place
-        v.offset = ooff + 4; // Points to first byte of tile data, not the size prefix
-        v.size = tilesz;
-        ooff += 4 + tilesz;
     }
     // Done with the input
     munmap((void *)input, insize);
@@ -281,16 +415,23 @@ int main(int argc, char **argv)
     bool reverse = false; // default to JPEG -> JXL
     bool bundle = false;  // default to MRF
     bool single = false;  // single jpeg
+    int nthreads = 1;
     string input_name;
-    while(--argc) {
-        string this_arg(argv[argc]);
+    for (int i = 1; i < argc; i++) {
+        string this_arg(argv[i]);
         if (this_arg == "-r") {
             reverse = true;
         } else if (this_arg == "-b") {
             bundle = true;
         } else if (this_arg == "-s") {
             single = true;
-        } else {
+        } else if (this_arg == "-t") {
+            if (++i == argc)
+                return Usage("-t needs the number of threads");
+            nthreads = atoi(argv[i]);
+            if (nthreads <= 0)
+                nthreads = max(1u, thread::hardware_concurrency());
+        } else if (input_name.empty()) {
             input_name = this_arg;
         }
     }
@@ -301,6 +442,6 @@ int main(int argc, char **argv)
     if (single)
         return single_to_jxl(input_name, reverse);
     if (bundle)
-        return bundle_to_jxl(input_name, input_name + ".jxl", reverse);
-    return mrf_to_jxl(input_name, input_name + ".jxl", reverse);
-}
\ No newline at end of file
+        return bundle_to_jxl(input_name, input_name + ".jxl", reverse, nthreads);
+    return mrf_to_jxl(input_name, input_name + ".jxl", reverse, nthreads);
+}
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# Name: jxl_batch
+# Purpose:
+
+'''Runs the jxl tile converter over every MRF or esri bundle in a directory tree
+
+ The conversions run in a pool of worker processes, each one runs jxl on one
+ file at a time. A file is skipped when its output is newer than the input and
+ has the same tiles, so an interrupted run can be restarted. After each
+ conversion the non-empty tile counts of the input and output indexes are
+ compared, the outputs of a failed conversion are removed.
+
+ jxl writes the output next to the input, with .jxl added. For an MRF data
+ file name.pjg, the output index is name.pjg.idx. With -r, name.pjg.jxl is
+ converted back to name.pjg.jxl.jxl and name.pjg.jxl.idx.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import array
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+
+# Esri v2 bundle, 64 byte header followed by 128x128 8 byte index entries
+BUNDLE_HEADER = 64
+BUNDLE_TILES = 128 * 128
+# Index bytes counted at a time, a multiple of the 16 byte record
+CHUNK = 1024 * 1024
+
+def mrf_index(data):
+    'Index file name jxl uses for an MRF data file, the extension is replaced'
+    return data[:-3] + 'idx'
+
+def job(data, bundle = False):
+    '''Input and output file names for one conversion. The index names are
+    None for bundles, which hold their own index'''
+    output = data + '.jxl'
+    if bundle:
+        return {'input': data, 'index': None, 'output': output, 'output_index': None}
+    return {'input': data, 'index': mrf_index(data), 'output': output,
+            'output_index': output[:-4] + '.idx'}
+
+def find_jobs(root, reverse = False, bundle = False):
+    'Conversions for the files in a directory tree, in name order'
+    jobs = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            if bundle:
+                if name.endswith('.bundle.jxl' if reverse else '.bundle'):
+                    jobs.append(job(path, True))
+            elif reverse:
+                if name.endswith('.jxl') and not name.endswith('.jxl.jxl') \
+                        and os.path.isfile(mrf_index(path)):
+                    jobs.append(job(path))
+            elif name.endswith('.mrf'):
+                try:
+                    meta = mrf_meta.load(path)
+                except Exception:
+                    continue
+                if meta.compression == 'JPEG' and os.path.isfile(meta.datafile) \
+                        and meta.datafile[-4] == '.' and os.path.isfile(mrf_index(meta.datafile)):
+                    jobs.append(job(meta.datafile))
+    return jobs
+
+def tile_count(fname, bundle = False):
+    '''Number of non-empty tiles in an MRF index or an esri bundle
+    Raises ValueError for an MRF index which is not a whole number of records'''
+    idx = array.array('Q')
+    with open(fname, 'rb') as f:
+        if bundle:
+            f.seek(BUNDLE_HEADER)
+            idx.fromfile(f, BUNDLE_TILES)
+            if sys.byteorder != 'little':
+                idx.byteswap()
+            return sum(1 for v in idx if v >> 40)
+        size = os.fstat(f.fileno()).st_size
+        if size % 16:
+            raise ValueError("Index {} size {} is not a multiple of 16".format(fname, size))
+        count = 0
+        for chunk in iter(lambda : f.read(CHUNK), b""):
+            idx = array.array('Q', chunk)
+            # Sizes are the odd values, zero in either byte order
+            count += len(idx) // 2 - idx[1::2].count(0)
+    return count
+
+def tiles(j):
+    'Tile count of the input of a job'
+    bundle = j['index'] is None
+    return tile_count(j['input'] if bundle else j['index'], bundle)
+
+def output_tiles(j):
+    bundle = j['index'] is None
+    return tile_count(j['output'] if bundle else j['output_index'], bundle)
+
+def up_to_date(j):
+    'Outputs exist, are newer than the inputs and have the same tiles'
+    inputs = [f for f in (j['input'], j['index']) if f]
+    outputs = [f for f in (j['output'], j['output_index']) if f]
+    if not all(os.path.isfile(f) for f in outputs):
+        return False
+    if min(os.path.getmtime(f) for f in outputs) < max(os.path.getmtime(f) for f in inputs):
+        return False
+    try:
+        return output_tiles(j) == tiles(j)
+    except (OSError, EOFError, ValueError):
+        return False
+
+def remove_outputs(j):
+    for f in (j['output'], j['output_index']):
+        if f and os.path.isfile(f):
+            os.remove(f)
+
+def convert(j, jxl = 'jxl', reverse = False, threads = 1):
+    '''Runs jxl for one job, checks the tile count of the output.
+    Returns the job record, with the sizes, tiles, time and error'''
+    cmd = [jxl]
+    if reverse:
+        cmd.append('-r')
+    if j['index'] is None:
+        cmd.append('-b')
+    if threads != 1:
+        cmd += ['-t', str(threads)]
+    cmd.append(j['input'])
+
+    record = dict(j, input_bytes = 0, output_bytes = 0, tiles = 0, seconds = 0.0, error = None)
+    start = time.time()
+    try:
+        record['input_bytes'] = os.path.getsize(j['input'])
+        record['tiles'] = tiles(j)
+        result = subprocess.run(cmd, capture_output = True, text = True)
+        if result.returncode != 0:
+            raise RuntimeError("jxl failed with code {}: {}".format(result.returncode, result.stderr.strip()))
+        converted = output_tiles(j)
+        if converted != record['tiles']:
+            raise RuntimeError("Output has {} tiles, input has {}".format(converted, record['tiles']))
+        record['output_bytes'] = os.path.getsize(j['output'])
+    except (OSError, EOFError, ValueError, RuntimeError) as e:
+        record['error'] = str(e)
+        remove_outputs(j)
+    record['seconds'] = time.time() - start
+    return record
+
+def run(jobs, jxl = 'jxl', reverse = False, workers = None, threads = 1, force = False, verbose = False):
+    '''Converts the jobs which are not up to date, in parallel.
+    Returns the list of records for the converted, skipped and failed files'''
+    records = []
+    pending = []
+    for j in jobs:
+        if not force and up_to_date(j):
+            records.append(dict(j, skipped = True))
+        else:
+            pending.append(j)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(convert, j, jxl, reverse, threads) for j in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            record['skipped'] = False
+            if verbose or record['error']:
+                print("{}: {}".format(record['input'], record['error'] or "{} tiles, {:.1f} tiles/s".format(
+                    record['tiles'], record['tiles'] / record['seconds'] if record['seconds'] else 0)))
+            records.append(record)
+    return records
+
+def summarize(records, elapsed):
+    'Totals for the converted files'
+    done = [r for r in records if not r['skipped'] and not r['error']]
+    input_bytes = sum(r['input_bytes'] for r in done)
+    output_bytes = sum(r['output_bytes'] for r in done)
+    tiles = sum(r['tiles'] for r in done)
+    return {
+        'files': len(records),
+        'converted': len(done),
+        'skipped': sum(1 for r in records if r['skipped']),
+        'failed': sum(1 for r in records if not r['skipped'] and r['error']),
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'bytes_saved': input_bytes - output_bytes,
+        'tiles': tiles,
+        'elapsed': elapsed,
+        'tiles_per_second': tiles / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Convert all the MRFs or bundles in a directory tree with jxl')
+    parser.add_argument('root', help='Top of the directory tree')
+    parser.add_argument('-r', '--reverse', action = 'store_true',
+                        help='Convert JPEG-XL back to JPEG, the inputs are the .jxl files')
+    parser.add_argument('-b', '--bundle', action = 'store_true',
+                        help='Convert esri v2 bundles instead of MRFs')
+    parser.add_argument('-w', '--workers', type = int,
+                        help='Number of files converted in parallel, defaults to the number of CPUs')
+    parser.add_argument('-t', '--threads', type = int, default = 1,
+                        help='Threads used by each jxl process')
+    parser.add_argument('-f', '--force', action = 'store_true',
+                        help='Convert even if the output is up to date')
+    parser.add_argument('--jxl', default = 'jxl', help='The jxl executable')
+    parser.add_argument('--report', help='Write a JSON report with per file sizes, tiles and times to this file')
+    parser.add_argument('-v', '--verbose', action = 'store_true', help='Report every converted file')
+    args = parser.parse_args()
+
+    start = time.time()
+    jobs = find_jobs(args.root, args.reverse, args.bundle)
+    records = run(jobs, args.jxl, args.reverse, args.workers, args.threads, args.force, args.verbose)
+    summary = summarize(records, time.time() - start)
+    print("Converted {converted} of {files} files, {skipped} up to date, {failed} failed".format(**summary))
+    print("Used to be {input_bytes} bytes, now {output_bytes}, saved {bytes_saved}, {tiles_per_second:.1f} tiles/s".format(**summary))
+    if args.report:
+        for r in records:
+            r['tiles_per_second'] = r['tiles'] / r['seconds'] if r.get('seconds') else 0.0
+        with open(args.report, 'w') as f:
+            json.dump({'summary': summary, 'files': records}, f, indent = 2)
+        print("Report written to {}".format(args.report))
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_check
+# Purpose:
+
+'''Checks the structure of an MRF, the index against the metadata and the data file
+
+ The checks are
+   layout:  the index size matches the pyramid in the metadata, with one copy
+            per version for versioned MRFs and two for cloning MRFs
+   bounds:  every tile is within the data file
+   overlap: no two tiles overlap, unless they are identical, shared tiles
+   size:    tile sizes are plausible for the compression and tile size
+ The index is memory mapped and checked in chunks, by multiple processes when
+ there is more than one chunk. Each chunk writes its tiles sorted by offset to
+ a temporary file, the overlap check merges the sorted chunks a block at a time,
+ so the whole index is never held in memory. The report is JSON, the exit code
+ is 0 when all checks pass, 1 otherwise.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+
+# Index records per chunk, 256MB of index
+CHUNK = 16 * 1024 * 1024
+# Records read from each sorted chunk at a time, by the overlap check
+MERGE = 1024 * 1024
+# Problem records listed in the report, per check
+SAMPLES = 10
+
+DATATYPE_SIZE = {
+    'Byte': 1, 'Int8': 1, 'UInt16': 2, 'Int16': 2, 'UInt32': 4, 'Int32': 4,
+    'Float32': 4, 'UInt64': 8, 'Int64': 8, 'Float64': 8,
+}
+
+# Smallest valid tile, PNG is the signature, IHDR, one IDAT and IEND chunks
+MIN_SIZE = {'PNG': 57, 'JPEG': 20, 'JPNG': 20}
+
+# Raster compressions, lossless or not, with tiles no larger than the raw tile
+# plus this fraction and a fixed overhead. Vector tiles and unknown compressions
+# are not bounded
+BOUNDED = ('PNG', 'JPEG', 'JPNG', 'JXL', 'DEFLATE', 'ZSTD', 'LERC', 'QB3', 'TIF', 'WEBP')
+OVERHEAD = 4096
+
+def size_limits(meta):
+    '(smallest, largest) plausible tile size, largest is None when unbounded'
+    raw = (meta.pagesize.x * meta.pagesize.y * meta.pagesize.c
+           * DATATYPE_SIZE.get(meta.datatype, 1))
+    if meta.compression == 'NONE':
+        return raw, raw
+    if meta.compression in BOUNDED:
+        return MIN_SIZE.get(meta.compression, 1), raw + raw // 8 + OVERHEAD
+    return MIN_SIZE.get(meta.compression, 1), None
+
+def expected_records(meta, actual):
+    'List of acceptable index sizes in records'
+    if meta.clone:
+        return [2 * meta.records]
+    if meta.versioned and actual > meta.records and actual % meta.records == 0:
+        return [actual]
+    return [meta.records]
+
+def samples(records, offsets, sizes, mask):
+    return [[int(r), int(o), int(s)] for r, o, s in
+            zip(records[mask][:SAMPLES], offsets[mask][:SAMPLES], sizes[mask][:SAMPLES])]
+
+def check_chunk(indexfile, base, first, count, data_size, limits, spill = None):
+    '''Checks count records starting at record first, returns the problem
+    counts and samples and the unique tiles sorted by offset and size.
+    With a spill folder, the sorted tiles are saved there and their file
+    names are returned instead'''
+    idx = np.memmap(indexfile, dtype = '>u8', mode = 'r',
+                    offset = base + 16 * first, shape = (count, 2))
+    offsets = idx[:, 0].astype(np.uint64)
+    sizes = idx[:, 1].astype(np.uint64)
+    del idx
+    tiles = np.flatnonzero(sizes)
+    offsets, sizes = offsets[tiles], sizes[tiles]
+    records = tiles.astype(np.uint64) + np.uint64(first)
+    result = {'tiles': len(tiles)}
+
+    bad = (offsets > np.uint64(data_size)) | (sizes > np.uint64(data_size) - np.minimum(offsets, np.uint64(data_size)))
+    result['bounds'] = (int(bad.sum()), samples(records, offsets, sizes, bad))
+
+    smallest, largest = limits
+    bad = sizes < np.uint64(smallest)
+    if largest is not None:
+        bad |= sizes > np.uint64(largest)
+    result['size'] = (int(bad.sum()), samples(records, offsets, sizes, bad))
+
+    order = np.lexsort((sizes, offsets))
+    offsets, sizes, records = offsets[order], sizes[order], records[order]
+    keep = unique_mask(offsets, sizes)
+    result['shared'] = len(keep) - int(keep.sum())
+    result['sorted'] = (offsets[keep], sizes[keep], records[keep])
+    if spill is not None:
+        names = []
+        for name, values in zip(('offsets', 'sizes', 'records'), result['sorted']):
+            names.append(os.path.join(spill, "{}.{}.npy".format(first, name)))
+            np.save(names[-1], values)
+        result['sorted'] = names
+    return result
+
+def unique_mask(offsets, sizes):
+    'Mask of the tiles which are not a repeat of the previous one, for tiles sorted by offset'
+    keep = np.ones(len(offsets), dtype = bool)
+    keep[1:] = (offsets[1:] != offsets[:-1]) | (sizes[1:] != sizes[:-1])
+    return keep
+
+def merge_runs(runs, block = MERGE):
+    '''K-way merge of runs of tiles sorted by offset and size, each one an
+    (offsets, sizes, records) tuple of arrays. Yields the merged tiles in
+    sorted blocks, reading up to block records from each run at a time'''
+    runs = [run for run in runs if len(run[0])]
+    pos = [0] * len(runs)
+    while runs:
+        parts = [tuple(a[p:p + block] for a in run) for run, p in zip(runs, pos)]
+        # Every tile up to the smallest last tile of the parts is in the parts
+        last = min((int(o[-1]), int(s[-1])) for o, s, _ in parts)
+        taken = []
+        for i, (o, s, r) in enumerate(parts):
+            n = int(np.count_nonzero((o < np.uint64(last[0])) | ((o == np.uint64(last[0])) & (s <= np.uint64(last[1])))))
+            taken.append((o[:n], s[:n], r[:n]))
+            pos[i] += n
+        offsets, sizes, records = (np.concatenate(a) for a in zip(*taken))
+        order = np.lexsort((sizes, offsets))
+        yield offsets[order], sizes[order], records[order]
+        done = [i for i, run in enumerate(runs) if pos[i] == len(run[0])]
+        runs = [run for i, run in enumerate(runs) if i not in done]
+        pos = [p for i, p in enumerate(pos) if i not in done]
+
+def check_overlap(runs, block = MERGE):
+    '''Merges the sorted runs and checks that no two tiles overlap, unless they are identical.
+    Returns the overlap check, the number of repeated tiles and the bytes used by unique tiles'''
+    count = shared = used = 0
+    found = []
+    previous = None  # Last tile of the previous block
+    end = 0  # Largest end of a tile so far
+    for offsets, sizes, records in merge_runs(runs, block):
+        keep = unique_mask(offsets, sizes)
+        if previous is not None and (int(offsets[0]), int(sizes[0])) == previous:
+            keep[0] = False
+        previous = (int(offsets[-1]), int(sizes[-1]))
+        shared += len(keep) - int(keep.sum())
+        offsets, sizes, records = offsets[keep], sizes[keep], records[keep]
+        if not len(offsets):
+            continue
+        ends = np.maximum.accumulate(offsets + sizes)
+        before = np.empty(len(offsets), dtype = np.uint64)
+        before[0] = end
+        before[1:] = np.maximum(ends[:-1], np.uint64(end))
+        bad = offsets < before
+        count += int(bad.sum())
+        found += samples(records, offsets, sizes, bad)[:SAMPLES - len(found)]
+        end = max(end, int(ends[-1]))
+        used += int(sizes.sum())
+    return {'ok': count == 0, 'count': count, 'samples': found}, shared, used
+
+def check(mrf, workers = None, chunk = CHUNK):
+    'Checks an MRF, returns the report dictionary'
+    start = time.time()
+    meta = mrf_meta.load(mrf)
+    index_size = os.path.getsize(meta.indexfile) - meta.indexoffset
+    data_size = os.path.getsize(meta.datafile) if os.path.exists(meta.datafile) else 0
+    nrecords = max(0, index_size) // 16
+    expected = expected_records(meta, nrecords)
+
+    report = {
+        'mrf': mrf,
+        'index': meta.indexfile,
+        'data': meta.datafile,
+        'index_records': nrecords,
+        'data_size': data_size,
+        'checks': {},
+    }
+    checks = report['checks']
+    problems = []
+    if index_size % 16:
+        problems.append("Index size {} is not a multiple of 16".format(index_size))
+    if nrecords not in expected:
+        problems.append("Index has {} records, the metadata needs {}".format(nrecords, expected[0]))
+    checks['layout'] = {'ok': not problems, 'expected_records': expected[0], 'problems': problems}
+
+    # The source index copy in a cloning MRF points into the source data file
+    checked = min(nrecords, meta.records) if meta.clone else nrecords
+    limits = size_limits(meta)
+    ranges = [(first, min(chunk, checked - first)) for first in range(0, checked, chunk)]
+    with tempfile.TemporaryDirectory(prefix = 'mrf_check') as spill:
+        args = [(meta.indexfile, meta.indexoffset, first, count, data_size, limits, spill)
+                for first, count in ranges]
+        if len(ranges) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                results = list(executor.map(check_chunk, *zip(*args)))
+        else:
+            results = [check_chunk(*a[:-1]) for a in args]
+        runs = [tuple(a if isinstance(a, np.ndarray) else np.load(a, mmap_mode = 'r') for a in r['sorted'])
+                for r in results]
+        checks['overlap'], shared, used = check_overlap(runs)
+        del runs
+
+    for name in ('bounds', 'size'):
+        count = sum(r[name][0] for r in results)
+        found = [s for r in results for s in r[name][1]][:SAMPLES]
+        checks[name] = {'ok': count == 0, 'count': count, 'samples': found}
+    checks['size']['limits'] = list(limits)
+
+    report['tiles'] = sum(r['tiles'] for r in results)
+    report['shared_tiles'] = shared + sum(r['shared'] for r in results)
+    report['used_bytes'] = used
+    report['ok'] = all(c['ok'] for c in checks.values())
+    report['elapsed'] = round(time.time() - start, 3)
+    return report
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Check the structure of an MRF index and data file')
+    parser.add_argument('mrf', nargs = '+', help='MRF metadata files')
+    parser.add_argument('-j', '--workers', type = int,
+                        help='Worker processes, defaults to the number of CPUs')
+    parser.add_argument('-c', '--chunk', type = int, default = CHUNK,
+                        help='Index records checked by one worker at a time')
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    reports = [check(mrf, args.workers, args.chunk) for mrf in args.mrf]
+    text = json.dumps(reports[0] if len(reports) == 1 else reports, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0 if all(r['ok'] for r in reports) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -36,6 +36,14 @@ import os.path
 import sys
 import argparse
 from array import array
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+    from . import mrf_versions
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+    import mrf_versions
 
 # Get the 64 bit unsigned integer type 
 try:
@@ -70,8 +78,8 @@ def mrf_trim(args):
     for i in range(0, len(full_idx), 2):
         idx_list.append((full_idx[i], full_idx[i + 1], i // 2))
     offset = int(args.empty_file) if args.empty_file else 0
-    # See if the file has any slack space
-    full_size = sum(size for _, size, _ in idx_list) + offset
+    # See if the file has any slack space, tiles can be shared by index versions
+    full_size = sum(size for _, size in set((o, s) for o, s, _ in idx_list)) + offset
     old_size = os.path.getsize(args.source)
     if full_size == old_size:
         print("No unused space in the MRF, nothing to do")
@@ -83,11 +91,16 @@ def mrf_trim(args):
     # Sort by offset
     idx_list.sort(key=lambda x: x[0])
 
+    moved = {}  # New offset of tiles already moved
     with open(args.source, "r+b") as mrf_file:
         for tile in idx_list:
             o, s, i = tile
             if s == 0:
                 continue
+            if (o, s) in moved: # Shared tile
+                full_idx[i * 2] = moved[o, s]
+                continue
+            moved[o, s] = offset
             if o < offset: # Borken MRF
                 raise ValueError("MRF is corrupted, tile offset {} is under the current offset {}".format(o, offset))
             if o == offset: # Tile is already at the current offset
@@ -125,6 +138,17 @@ def mrf_trim(args):
 def mrf_clean(source, destination, empty_file = None):
     '''Copies the active tile from a source to a destination MRF'''
 
+    # Versioned MRFs share tiles between index versions, copy them only once
+    mrf_name = os.path.splitext(source)[0] + os.extsep + "mrf"
+    if os.path.isfile(mrf_name):
+        meta = mrf_meta.load(mrf_name)
+        if meta.versioned:
+            records = meta.records
+            versions = range(mrf_versions.version_count(mrf_versions.read_index(index_name(source)), records))
+            mrf_versions.compact_files(source, index_name(source), records, list(versions),
+                                       destination, index_name(destination), empty_file)
+            return
+
     with open(index_name(source), "rb") as sidx:
         with open(source, "rb") as sfile:
             with open(index_name(destination), "wb") as didx:
@@ -161,6 +185,7 @@ def mrf_clean(source, destination, empty_file = None):
 
 
 def main():
+    mrf_profile.start()
     # Get the arguments, add copy if first argument is not copy or trim
     cmdargs = sys.argv[1:]
         
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_export
+# Purpose:
+
+'''Exports the tiles of an MRF to a {z}/{x}/{y} tile tree, a tar file or an MBTiles file
+
+ The compressed tiles are copied as they are, without decoding. The index is
+ scanned first, then the tiles are read in data file order, with nearby tiles
+ read together, by a pool of threads. Empty records are skipped, unless a
+ blank tile is given, which is then written for every empty tile. In a tar or
+ an MBTiles file, tiles with the same content in the MRF and the blank tiles
+ are stored once, as hard links or as shared images.
+
+ Zoom level 0 is the lowest resolution, as for tiles2mrf.py and the mrf_read.py
+ --tilematrix option, x is the column and y the row from the top. MBTiles rows
+ count from the bottom, as the format requires.
+
+ In-process use:
+   summary = export(mrf_file, output)
+ The output is a path template using {z}, {x}, {y} and optionally {ext}, a
+ .tar file or - for a tar stream to stdout, or a .mbtiles file.
+ Only 2D MRFs with pixel interleaved bands are supported.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import os
+import sys
+import time
+import sqlite3
+import tarfile
+import argparse
+from collections import deque
+from concurrent.futures import wait
+import numpy as np
+try:
+    from . import mrf_profile
+    from . import mrf_reader
+except ImportError:
+    import mrf_profile
+    import mrf_reader
+
+# Index records scanned at once, 16MB of index
+INDEX_CHUNK = 1024 * 1024
+# Largest data file read
+READ_CHUNK = 16 * 1024 * 1024
+# Tile names in a tar file
+TEMPLATE = '{z}/{x}/{y}.{ext}'
+# Key of the blank tile, other tiles are keyed by their data file offset and size
+BLANK = 'blank'
+
+# Tile format for each compression, the file extension and the MBTiles format
+FORMATS = {
+    'PNG': 'png', 'PPNG': 'png', 'JPEG': 'jpg', 'JPNG': 'jpg', 'PBF': 'pbf',
+    'WEBP': 'webp', 'LERC': 'lerc', 'QB3': 'qb3', 'TIF': 'tif', 'ZSTD': 'zst',
+    'DEFLATE': 'zz', 'NONE': 'raw',
+}
+
+def tile_format(meta):
+    return FORMATS.get(meta.compression, meta.compression.lower())
+
+def scan(reader):
+    '''Non-empty tiles of the current version, sorted by data file offset.
+    Returns numpy arrays of offsets, sizes, zoom levels, columns and rows'''
+    meta = reader.meta
+    if meta.size.z != 1 or meta.bandpages != 1:
+        raise ValueError("Only 2D MRFs with pixel interleaved bands can be exported")
+    records = meta.totalpages
+    numbers, offsets, sizes = [], [], []
+    for start in range(0, records, INDEX_CHUNK):
+        count = min(INDEX_CHUNK, records - start)
+        raw = reader.index.read(16 * start, 16 * count)
+        chunk = np.frombuffer(raw[:len(raw) // 16 * 16], dtype='>u8').reshape(-1, 2)
+        present = np.flatnonzero(chunk[:, 1])
+        numbers.append(present + start)
+        offsets.append(chunk[present, 0].astype(np.int64))
+        sizes.append(chunk[present, 1].astype(np.int64))
+    numbers, offsets, sizes = (np.concatenate(a) if a else np.zeros(0, np.int64) for a in (numbers, offsets, sizes))
+
+    starts = np.cumsum([0] + meta.pages)
+    cols = np.array([c for c, _ in meta.levels()])
+    levels = np.searchsorted(starts, numbers, side = 'right') - 1
+    rows, columns = np.divmod(numbers - starts[levels], cols[levels])
+    order = np.lexsort((numbers, offsets))
+    zooms = len(meta.pages) - 1 - levels
+    return offsets[order], sizes[order], zooms[order], columns[order], rows[order]
+
+def batches(offsets, sizes, gap = mrf_reader.GAP, chunk = READ_CHUNK):
+    '''Groups tiles sorted by offset into reads, returns a list of
+    (first tile, end tile, start offset, end offset)'''
+    result = []
+    offsets, sizes = offsets.tolist(), sizes.tolist()
+    for i, (offset, size) in enumerate(zip(offsets, sizes)):
+        if result and offset <= result[-1][3] + gap and max(result[-1][3], offset + size) - result[-1][2] <= chunk:
+            result[-1][1] = i + 1
+            result[-1][3] = max(result[-1][3], offset + size)
+        else:
+            result.append([i, i + 1, offset, offset + size])
+    return result
+
+def blanks(meta, zooms, columns, rows):
+    'Generates the (zoom, column, row) of the empty tiles'
+    levels = meta.levels()
+    for level, (cols, nrows) in enumerate(levels):
+        zoom = len(levels) - 1 - level
+        empty = np.ones(cols * nrows, dtype = bool)
+        mask = zooms == zoom
+        empty[rows[mask] * cols + columns[mask]] = False
+        for number in np.flatnonzero(empty).tolist():
+            row, col = divmod(number, cols)
+            yield zoom, col, row
+
+class PathWriter(object):
+    'Writes each tile to a file named by a path template, from multiple threads'
+    parallel = True
+
+    def __init__(self, template, ext):
+        for field in ('{z}', '{x}', '{y}'):
+            if field not in template:
+                raise ValueError("The path template has to include {z}, {x} and {y}")
+        self.template = template
+        self.ext = ext
+        self.blank = None
+        self.folders = set()
+
+    def name(self, zoom, col, row):
+        return self.template.format(z = zoom, x = col, y = row, ext = self.ext)
+
+    def write(self, tiles):
+        for zoom, col, row, key, data in tiles:
+            name = self.name(zoom, col, row)
+            folder = os.path.dirname(name)
+            if folder and folder not in self.folders:
+                os.makedirs(folder, exist_ok = True)
+                self.folders.add(folder)
+            if key == BLANK and self.blank:
+                try:
+                    if os.path.lexists(name):
+                        os.remove(name)
+                    os.link(self.blank, name)
+                    continue
+                except OSError:
+                    pass
+            with open(name, 'wb') as f:
+                f.write(data)
+            if key == BLANK:
+                self.blank = name
+
+    def close(self):
+        pass
+
+class TarWriter(object):
+    '''Writes the tiles to a tar file or stream, in the order they are read.
+    Tiles with the same key after the first are hard links'''
+    parallel = False
+
+    def __init__(self, output, template, ext):
+        self.names = PathWriter(template, ext).name
+        if output == '-':
+            self.tar = tarfile.open(fileobj = sys.stdout.buffer, mode = 'w|', copybufsize = READ_CHUNK)
+        else:
+            self.tar = tarfile.open(output, 'w', copybufsize = READ_CHUNK)
+        self.first = {}
+        self.mtime = int(time.time())
+
+    def write(self, tiles):
+        for zoom, col, row, key, data in tiles:
+            info = tarfile.TarInfo(self.names(zoom, col, row))
+            info.mtime = self.mtime
+            if key in self.first:
+                info.type = tarfile.LNKTYPE
+                info.linkname = self.first[key]
+                self.tar.addfile(info)
+                continue
+            self.first[key] = info.name
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+
+class MBTilesWriter(object):
+    '''Writes the tiles to an MBTiles file, each distinct tile is stored once.
+    rows is the number of rows for each zoom level'''
+    parallel = False
+
+    def __init__(self, output, name, tile_format, rows):
+        if os.path.exists(output):
+            os.remove(output)
+        self.rows = rows
+        self.db = sqlite3.connect(output)
+        self.db.executescript('''
+            PRAGMA synchronous = OFF;
+            PRAGMA journal_mode = OFF;
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+            CREATE TABLE images (tile_data BLOB, tile_id TEXT);
+            CREATE VIEW tiles AS SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+        ''')
+        self.db.executemany('INSERT INTO metadata VALUES (?, ?)', [
+            ('name', name), ('format', tile_format), ('type', 'overlay'),
+            ('minzoom', '0'), ('maxzoom', str(len(rows) - 1))])
+        self.stored = set()
+
+    def write(self, tiles):
+        images, entries = [], []
+        for zoom, col, row, key, data in tiles:
+            tile_id = key if key == BLANK else '{}:{}'.format(*key)
+            if tile_id not in self.stored:
+                self.stored.add(tile_id)
+                images.append((bytes(data), tile_id))
+            entries.append((zoom, col, self.rows[zoom] - 1 - row, tile_id))
+        with self.db:
+            self.db.executemany('INSERT INTO images VALUES (?, ?)', images)
+            self.db.executemany('INSERT INTO map VALUES (?, ?, ?, ?)', entries)
+
+    def close(self):
+        with self.db:
+            self.db.execute('CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row)')
+            self.db.execute('CREATE UNIQUE INDEX images_id ON images (tile_id)')
+        self.db.close()
+
+def open_writer(output, meta, template = TEMPLATE):
+    'Writer for the kind of output, by its name'
+    ext = tile_format(meta)
+    if output.endswith('.mbtiles'):
+        rows = [r for _, r in reversed(meta.levels())]
+        name = os.path.splitext(os.path.basename(meta.name))[0]
+        return MBTilesWriter(output, name, ext, rows)
+    if output == '-' or output.endswith('.tar'):
+        return TarWriter(output, template, ext)
+    return PathWriter(output, ext)
+
+def export(mrf, output, index = None, template = TEMPLATE, blank = None, workers = mrf_reader.WORKERS,
+           gap = mrf_reader.GAP, chunk = READ_CHUNK):
+    '''Exports the tiles of an MRF, returns a summary dictionary.
+    blank is the content of the tile written for the empty tiles'''
+    started = time.time()
+    with mrf_reader.MRFReader(mrf, index = index, tile_cache = 0, workers = workers) as reader:
+        offsets, sizes, zooms, columns, rows = scan(reader)
+        writer = open_writer(output, reader.meta, template)
+
+        def read(first, end, start, stop):
+            buffer = reader.read_range(start, stop)
+            tiles = []
+            for i in range(first, end):
+                offset, size = int(offsets[i]), int(sizes[i])
+                tiles.append((int(zooms[i]), int(columns[i]), int(rows[i]), (offset, size),
+                              buffer[offset - start: offset - start + size]))
+            if writer.parallel:
+                writer.write(tiles)
+            return tiles
+
+        # Reads are issued in data file order, at most two per thread are pending
+        pending = deque()
+        try:
+            for batch in batches(offsets, sizes, gap, chunk):
+                pending.append(reader.executor().submit(read, *batch))
+                while len(pending) > 2 * workers or (pending and pending[0].done()):
+                    tiles = pending.popleft().result()
+                    if not writer.parallel:
+                        writer.write(tiles)
+            while pending:
+                tiles = pending.popleft().result()
+                if not writer.parallel:
+                    writer.write(tiles)
+
+            blank_count = 0
+            if blank is not None:
+                tiles = []
+                for zoom, col, row in blanks(reader.meta, zooms, columns, rows):
+                    tiles.append((zoom, col, row, BLANK, blank))
+                    if len(tiles) == INDEX_CHUNK:
+                        writer.write(tiles)
+                        blank_count += len(tiles)
+                        tiles = []
+                writer.write(tiles)
+                blank_count += len(tiles)
+        finally:
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            writer.close()
+
+    elapsed = time.time() - started
+    return {
+        'tiles': len(offsets),
+        'bytes': int(sizes.sum()),
+        'blank': blank_count,
+        'seconds': elapsed,
+        'mb_per_second': float(sizes.sum()) / 1e6 / elapsed if elapsed else 0.0,
+    }
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Export the tiles of an MRF to a tile tree, a tar or an MBTiles file')
+    parser.add_argument('source', help='MRF metadata file, MRF tar file or http(s) URL')
+    parser.add_argument('output',
+                        help='Path template with {z}, {x}, {y} and optionally {ext}, a .tar file, - for a tar stream, or a .mbtiles file')
+    parser.add_argument('-n', '--index', help='Index file to use instead of the one in the metadata, such as a canned .ix')
+    parser.add_argument('-t', '--template', default = TEMPLATE, help='Tile names in the tar output, default ' + TEMPLATE)
+    parser.add_argument('-b', '--blank', help='Tile file written for the empty tiles')
+    parser.add_argument('-w', '--workers', type = int, default = mrf_reader.WORKERS, help='Read and write threads')
+    parser.add_argument('-g', '--gap', type = int, default = mrf_reader.GAP,
+                        help='Largest space between tiles read together, in bytes')
+    args = parser.parse_args()
+
+    blank = None
+    if args.blank:
+        with open(args.blank, 'rb') as f:
+            blank = f.read()
+    summary = export(args.source, args.output, args.index, args.template, blank, args.workers, args.gap)
+    # Keep stdout for the tar stream
+    out = sys.stderr if args.output == '-' else sys.stdout
+    print("Exported {} tiles, {} bytes, {} blank tiles in {:.1f}s, {:.1f} MB/s".format(
+        summary['tiles'], summary['bytes'], summary['blank'], summary['seconds'], summary['mb_per_second']),
+        file = out)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
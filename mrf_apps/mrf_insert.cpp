@@ -115,6 +115,353 @@ CPLErr ClippedRasterIO(GDALRasterBand *band, GDALRWFlag eRWFlag,
                           pcData, nXSize, nYSize, eBufType, nPixelSpace, nLineSpace, NULL);
 }
 
+// Cover a set of tiles with rectangles, one per run of columns in a row.
+// Runs over the same columns in consecutive rows are merged
+static vector<TileRange> tile_ranges(const set<Tile> &tiles)
+{
+    vector<TileRange> ranges;
+    vector<TileRange> open; // Ranges which end on the previous row
+    auto it = tiles.begin();
+    while (it != tiles.end())
+    {
+        int row = it->first;
+        vector<TileRange> current;
+        while (it != tiles.end() && it->first == row)
+        {
+            TileRange r = {it->second, row, 1, 1};
+            for (++it; it != tiles.end() && it->first == row && it->second == r.x + r.w; ++it)
+                r.w++;
+
+            for (auto o = open.begin(); o != open.end(); ++o)
+            {
+                if (o->x == r.x && o->w == r.w && o->y + o->h == row)
+                {
+                    r.y = o->y;
+                    r.h = o->h + 1;
+                    open.erase(o);
+                    break;
+                }
+            }
+            current.push_back(r);
+        }
+        ranges.insert(ranges.end(), open.begin(), open.end());
+        open.swap(current);
+    }
+    ranges.insert(ranges.end(), open.begin(), open.end());
+    return ranges;
+}
+
+// Fill a buffer with a value, of the buffer data type
+template <typename T>
+static void fill(void *buffer, size_t count, double value)
+{
+    T *p = reinterpret_cast<T *>(buffer);
+    std::fill(p, p + count, static_cast<T>(value));
+}
+
+// Resample 2x2 tiles to one tile, by averaging four pixels or by picking the top left one
+// Pixels matching the no data value are not averaged, four of them are no data
+template <typename T, typename Acc>
+static void by_four(const void *input, void *output, int xsz, int ysz,
+                    bool average, bool has_ndv, double ndv)
+{
+    const T *in = reinterpret_cast<const T *>(input);
+    T *out = reinterpret_cast<T *>(output);
+    const T nodata = static_cast<T>(ndv);
+    const bool integer = std::numeric_limits<T>::is_integer;
+    for (int y = 0; y < ysz; y++)
+    {
+        const T *even = in + 2 * y * 2 * xsz;
+        const T *odd = even + 2 * xsz;
+        for (int x = 0; x < xsz; x++, even += 2, odd += 2)
+        {
+            if (!average)
+            {
+                *out++ = even[0];
+                continue;
+            }
+            const T v[4] = {even[0], even[1], odd[0], odd[1]};
+            Acc sum = 0;
+            int count = 0;
+            for (int i = 0; i < 4; i++)
+            {
+                if (has_ndv && v[i] == nodata)
+                    continue;
+                sum += v[i];
+                count++;
+            }
+            if (count == 0)
+                *out++ = nodata;
+            else if (integer)
+                *out++ = static_cast<T>((sum + count / 2) / count);
+            else
+                *out++ = static_cast<T>(sum / count);
+        }
+    }
+}
+
+// Data types resampled by the overview threads, others use PatchOverview
+static bool resample_supported(GDALDataType dt)
+{
+    switch (dt)
+    {
+    case GDT_Byte:
+    case GDT_UInt16:
+    case GDT_Int16:
+    case GDT_UInt32:
+    case GDT_Int32:
+    case GDT_Float32:
+    case GDT_Float64:
+        return true;
+    default:
+        return false;
+    }
+}
+
+// Dispatch on the data type, returns false if the type is not supported
+static bool resample(GDALDataType dt, const void *input, void *output, int xsz, int ysz,
+                     bool average, bool has_ndv, double ndv)
+{
+    switch (dt)
+    {
+    case GDT_Byte:
+        by_four<GByte, GIntBig>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_UInt16:
+        by_four<GUInt16, GIntBig>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_Int16:
+        by_four<GInt16, GIntBig>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_UInt32:
+        by_four<GUInt32, GIntBig>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_Int32:
+        by_four<GInt32, GIntBig>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_Float32:
+        by_four<float, double>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    case GDT_Float64:
+        by_four<double, double>(input, output, xsz, ysz, average, has_ndv, ndv);
+        break;
+    default:
+        return false;
+    }
+    return true;
+}
+
+static bool fill_value(GDALDataType dt, void *buffer, size_t count, double value)
+{
+    switch (dt)
+    {
+    case GDT_Byte:
+        fill<GByte>(buffer, count, value);
+        break;
+    case GDT_UInt16:
+        fill<GUInt16>(buffer, count, value);
+        break;
+    case GDT_Int16:
+        fill<GInt16>(buffer, count, value);
+        break;
+    case GDT_UInt32:
+        fill<GUInt32>(buffer, count, value);
+        break;
+    case GDT_Int32:
+        fill<GInt32>(buffer, count, value);
+        break;
+    case GDT_Float32:
+        fill<float>(buffer, count, value);
+        break;
+    case GDT_Float64:
+        fill<double>(buffer, count, value);
+        break;
+    default:
+        return false;
+    }
+    return true;
+}
+
+// An overview tile for one band, ready to be written
+struct tile_buffer
+{
+    Tile tile;
+    int band;
+    int xsz, ysz; // Valid size, smaller than the tile at the edges
+    std::vector<char> data;
+};
+
+// Generate the overview tiles of level sl + 1 from level sl, in parallel.
+// Each thread reads from its own read only handle and resamples whole tiles.
+// The tiles are written in this thread, through the only update handle,
+// since the MRF driver supports a single writer. Returns when the level is done
+bool state::overview_threads(GDALDataset *pTDS, int sl, const set<Tile> &parents)
+{
+    vector<Tile> tiles(parents.begin(), parents.end());
+    GDALRasterBand *b0 = pTDS->GetRasterBand(1);
+    int bands = pTDS->GetRasterCount();
+    int tsz_x, tsz_y;
+    b0->GetBlockSize(&tsz_x, &tsz_y);
+    GDALDataType eDataType = b0->GetRasterDataType();
+    int pixel_size = GDALGetDataTypeSizeBytes(eDataType);
+    int has_ndv = 0;
+    double ndv = b0->GetNoDataValue(&has_ndv);
+    if (!has_ndv)
+        ndv = 0;
+
+    mutex mtx;
+    condition_variable ready, space;
+    deque<tile_buffer> queue;
+    const size_t capacity = 4 * nthreads;
+    atomic<size_t> next(0);
+    atomic<bool> failed(false);
+    int running = nthreads;
+
+    auto worker = [&]()
+    {
+        GDALDataset *pRDS = static_cast<GDALDataset *>(GDALOpen(TargetName.c_str(), GA_ReadOnly));
+        if (pRDS == NULL)
+            failed = true;
+
+        // Input is 2x2 tiles
+        vector<char> input(4 * size_t(tsz_x) * tsz_y * pixel_size);
+        for (size_t i = next++; !failed && i < tiles.size(); i = next++)
+        {
+            const Tile &t = tiles[i];
+            for (int band = 1; band <= bands && !failed; band++)
+            {
+                GDALRasterBand *src = pRDS->GetRasterBand(band);
+                GDALRasterBand *dst = src->GetOverview(sl);
+                if (sl > 0)
+                    src = src->GetOverview(sl - 1);
+
+                int x = 2 * t.second * tsz_x;
+                int y = 2 * t.first * tsz_y;
+                int sx = std::min(2 * tsz_x, src->GetXSize() - x);
+                int sy = std::min(2 * tsz_y, src->GetYSize() - y);
+
+                tile_buffer out;
+                out.tile = t;
+                out.band = band;
+                out.xsz = std::min(tsz_x, dst->GetXSize() - t.second * tsz_x);
+                out.ysz = std::min(tsz_y, dst->GetYSize() - t.first * tsz_y);
+                out.data.resize(size_t(tsz_x) * tsz_y * pixel_size);
+
+                if (sx <= 0 || sy <= 0 || out.xsz <= 0 || out.ysz <= 0)
+                    continue;
+
+                // Outside of the input is no data
+                if (!fill_value(eDataType, input.data(), 4 * size_t(tsz_x) * tsz_y, ndv) ||
+                    CE_None != src->RasterIO(GF_Read, x, y, sx, sy,
+                                             input.data(), sx, sy, eDataType,
+                                             pixel_size, 2 * tsz_x * pixel_size, NULL))
+                {
+                    failed = true;
+                    break;
+                }
+
+                if (!resample(eDataType, input.data(), out.data.data(), tsz_x, tsz_y,
+                              Resampling == GDAL_MRF::SAMPLING_Avg, has_ndv != 0, ndv))
+                {
+                    failed = true;
+                    break;
+                }
+
+                unique_lock<mutex> lock(mtx);
+                space.wait(lock, [&]() { return queue.size() < capacity || failed; });
+                queue.push_back(std::move(out));
+                ready.notify_one();
+            }
+        }
+
+        if (pRDS != NULL)
+            GDALClose(pRDS);
+        lock_guard<mutex> lock(mtx);
+        running--;
+        ready.notify_one();
+    };
+
+    vector<thread> pool;
+    for (int i = 0; i < nthreads; i++)
+        pool.emplace_back(worker);
+
+    // Write the tiles as they become ready, in any order
+    for (;;)
+    {
+        unique_lock<mutex> lock(mtx);
+        ready.wait(lock, [&]() { return !queue.empty() || running == 0; });
+        if (queue.empty())
+            break;
+        tile_buffer tb(std::move(queue.front()));
+        queue.pop_front();
+        space.notify_one();
+        lock.unlock();
+
+        if (failed)
+            continue;
+        GDALRasterBand *dst = pTDS->GetRasterBand(tb.band)->GetOverview(sl);
+        if (CE_None != dst->RasterIO(GF_Write, tb.tile.second * tsz_x, tb.tile.first * tsz_y,
+                                     tb.xsz, tb.ysz, tb.data.data(), tb.xsz, tb.ysz, eDataType,
+                                     pixel_size, tsz_x * pixel_size, NULL))
+        {
+            failed = true;
+            space.notify_all();
+        }
+    }
+
+    for (auto &t : pool)
+        t.join();
+
+    if (failed)
+        CPLError(CE_Failure, CPLE_AppDefined, "Error generating overview level %d", sl + 1);
+    return !failed;
+}
+
+// Location of the source in target pixels
+// Checks that the source is inside the target and has the same resolution
+static bool source_pixels(const img_info &in_img, const img_info &out_img, Bounds &pix_bbox)
+{
+    // Tolerance of 1/2 of an output pixel
+    XY tolerance;
+    tolerance.x = fabs(out_img.res.x / 2);
+    tolerance.y = fabs(out_img.res.y / 2);
+
+    if (!CPLIsEqual(in_img.res.x / out_img.res.x, in_img.res.y / out_img.res.y))
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Scaling factor for X and Y are not the same");
+        return false;
+    }
+
+    if (outside_bounds(in_img.bbox, out_img.bbox, tolerance))
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Input patch outside of target");
+        return false;
+    }
+
+    // tolerance of 1/1000 of the resolution
+    if ((fabs(in_img.res.x - out_img.res.x) * 1000 > fabs(out_img.res.x)) ||
+        (fabs(in_img.res.y - out_img.res.y) * 1000 > fabs(out_img.res.y)))
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Source and target resolutions don't match");
+        return false;
+    }
+
+    pix_bbox.lx = int((in_img.bbox.lx - out_img.bbox.lx) / in_img.res.x + 0.5);
+    pix_bbox.ux = int((in_img.bbox.ux - out_img.bbox.lx) / in_img.res.x + 0.5);
+    // note that uy < ly
+    pix_bbox.uy = int((in_img.bbox.uy - out_img.bbox.uy) / in_img.res.y + 0.5);
+    pix_bbox.ly = int((in_img.bbox.ly - out_img.bbox.uy) / in_img.res.y + 0.5);
+    return true;
+}
+
+// Level 0 tiles covered by a source
+static void covered_tiles(const Bounds &pix_bbox, int tsz_x, int tsz_y, set<Tile> &tiles)
+{
+    for (int y = int(pix_bbox.uy) / tsz_y; y <= (int(pix_bbox.ly) - 1) / tsz_y; y++)
+        for (int x = int(pix_bbox.lx) / tsz_x; x <= (int(pix_bbox.ux) - 1) / tsz_x; x++)
+            tiles.insert(Tile(y, x));
+}
+
 // Insert the target in the base level
 bool state::patch()
 {
@@ -175,7 +522,6 @@ bool state::patch()
 
     Bounds blocks_bbox;
     Bounds pix_bbox;
-    int overview_count = 0;
     void *buffer = NULL;
 
     try
@@ -190,31 +536,14 @@ bool state::patch()
                  << "In " << in_img.bbox << endl;
         }
 
-        // Tolerance of 1/2 of an output pixel
-        XY tolerance;
-        tolerance.x = fabs(out_img.res.x / 2);
-        tolerance.y = fabs(out_img.res.y / 2);
         XY factor;
         factor.x = in_img.res.x / out_img.res.x;
         factor.y = in_img.res.y / out_img.res.y;
 
-        if (!CPLIsEqual(factor.x, factor.y))
-        {
-            CPLError(CE_Failure, CPLE_AppDefined, "Scaling factor for X and Y are not the same");
-            throw 2;
-        }
-
-        if (outside_bounds(in_img.bbox, out_img.bbox, tolerance))
-        {
-            CPLError(CE_Failure, CPLE_AppDefined, "Input patch outside of target");
-            throw 2;
-        }
-
-        // tolerance of 1/1000 of the resolution
-        if ((fabs(in_img.res.x - out_img.res.x) * 1000 > fabs(out_img.res.x)) ||
-            (fabs(in_img.res.y - out_img.res.y) * 1000 > fabs(out_img.res.y)))
+        //
+        // Location in target (output MRF) pixels
+        if (!source_pixels(in_img, out_img, pix_bbox))
         {
-            CPLError(CE_Failure, CPLE_AppDefined, "Source and target resolutions don't match");
             throw 2;
         }
 
@@ -226,20 +555,11 @@ bool state::patch()
         b0->GetBlockSize(&tsz_x, &tsz_y);
 
         GDALDataType eDataType = b0->GetRasterDataType();
-        overview_count = b0->GetOverviewCount();
 
         int pixel_size = GDALGetDataTypeSizeBytes(eDataType);
         int line_size = tsz_x * pixel_size;                  // A line has this many bytes
         int buffer_size = line_size * tsz_y;                 // A block size in bytes
 
-        //
-        // Location in target (output MRF) pixels
-        pix_bbox.lx = int((in_img.bbox.lx - out_img.bbox.lx) / in_img.res.x + 0.5);
-        pix_bbox.ux = int((in_img.bbox.ux - out_img.bbox.lx) / in_img.res.x + 0.5);
-        // note that uy < ly
-        pix_bbox.uy = int((in_img.bbox.uy - out_img.bbox.uy) / in_img.res.y + 0.5);
-        pix_bbox.ly = int((in_img.bbox.ly - out_img.bbox.uy) / in_img.res.y + 0.5);
-
         if (verbose != 0)
         {
             cerr << "Pixel location " << pix_bbox << endl
@@ -259,6 +579,9 @@ bool state::patch()
             cerr << "Blocks location " << blocks_bbox << endl;
         }
 
+        // Level 0 tiles covered by the source, the overviews are built from these
+        covered_tiles(pix_bbox, tsz_x, tsz_y, dirty);
+
         // Build a vector of output bands
         vector<GDALRasterBand *> src_b;
         vector<GDALRasterBand *> dst_b;
@@ -365,62 +688,319 @@ bool state::patch()
         return false;
     }
 
-    // Close input, flush output, then worry about overviews
+    // Close input, flush output, overviews are built after all the patches
     GDALClose(hPatch);
     GDALFlushCache(hDataset);
+    GDALClose(hDataset);
+    return true;
+}
 
-    // Call the PatchOverview for the MRF
-    if (overlays)
+// Rebuild the overviews from the tiles written by all the patches
+// Each overview tile is generated only once, even if several sources touched it
+bool state::overviews()
+{
+    if (!overlays || dirty.empty())
     {
-        // Initialize BlockX, BlockY, Width, and Height based on the bounding box
-        auto BlockX = static_cast<int>(blocks_bbox.lx);
-        auto BlockY = static_cast<int>(blocks_bbox.uy);
-        auto Width = static_cast<int>(blocks_bbox.ux - blocks_bbox.lx);
-        auto Height = static_cast<int>(blocks_bbox.ly - blocks_bbox.uy);
+        return true;
+    }
 
-        // If stop_level is not set, process all levels
-        if (stop_level == -1)
-            stop_level = overview_count;
+    union
+    {
+        GDALDatasetH hDataset;
+        GDALDataset *pTDS;
+        MRFDataset *pTarg;
+    };
 
-        // Convert level limits to source levels
-        start_level--;
+    CPLPushErrorHandler(CPLQuietErrorHandler);
+    hDataset = GDALOpen(TargetName.c_str(), GA_Update);
+    CPLPopErrorHandler();
+
+    if (hDataset == NULL)
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Can't open file %s for update", TargetName.c_str());
+        return false;
+    }
+
+    int overview_count = pTDS->GetRasterBand(1)->GetOverviewCount();
+
+    bool threaded = nthreads > 1;
+    GDALDataType eDataType = pTDS->GetRasterBand(1)->GetRasterDataType();
+    if (threaded && !resample_supported(eDataType))
+    {
+        CPLError(CE_Warning, CPLE_AppDefined,
+                 "Overviews of %s data are generated by a single thread",
+                 GDALGetDataTypeName(eDataType));
+        threaded = false;
+    }
+
+    // Convert level limits to source levels
+    // If stop_level is not set, process all levels
+    int first = start_level - 1;
+    int last = (stop_level == -1) ? overview_count : stop_level;
+
+    set<Tile> tiles(dirty);
+    for (int sl = 0; sl < overview_count; sl++)
+    {
+        // Tiles of the next level, generated from the dirty tiles of this one
+        set<Tile> parents;
+        for (auto &t : tiles)
+            parents.insert(Tile(t.first / 2, t.second / 2));
 
-        for (int sl = 0; sl < overview_count; sl++)
+        if (sl >= first && sl < last)
         {
-            if (sl >= start_level && sl < stop_level)
+            if (threaded)
             {
-                pTarg->PatchOverview(BlockX, BlockY, Width, Height,
-                                     sl, false, Resampling);
-                GDALFlushCache(hDataset);
-
-                if (verbose != 0)
+                if (!overview_threads(pTDS, sl, parents))
                 {
-                    cerr << "Overview Level: " << sl << endl;
-                    cerr << "WidthOut = " << Width << " HeightOut = " << Height << endl;
+                    GDALClose(hDataset);
+                    return false;
+                }
+            }
+            else
+            {
+                for (auto &r : tile_ranges(parents))
+                {
+                    if (CE_None != pTarg->PatchOverview(2 * r.x, 2 * r.y, 2 * r.w, 2 * r.h,
+                                                        sl, false, Resampling))
+                    {
+                        GDALClose(hDataset);
+                        return false;
+                    }
                 }
             }
+            // The next level reads this one
+            GDALFlushCache(hDataset);
+
+            if (verbose != 0)
+            {
+                cerr << "Overview Level: " << sl << endl;
+                cerr << "Tiles = " << parents.size() << endl;
+            }
+        }
+
+        tiles.swap(parents);
+    }
+
+    GDALFlushCache(hDataset);
+    GDALClose(hDataset);
+    return true;
+}
+
+// String as a JSON value
+static string quoted(const string &value)
+{
+    string result("\"");
+    for (char c : value)
+    {
+        if (c == '"' || c == '\\')
+            result += '\\';
+        result += c;
+    }
+    return result + "\"";
+}
+
+// Current size of a tile, summed over the band pages, from the big endian index
+// Records past the end of the index are empty
+static GIntBig tile_size(VSILFILE *idx, GIntBig record, int pages)
+{
+    GIntBig size = 0;
+    for (int p = 0; idx != NULL && p < pages; p++)
+    {
+        GByte rec[16];
+        if (VSIFSeekL(idx, static_cast<vsi_l_offset>(record + p) * 16, SEEK_SET) != 0 ||
+            VSIFReadL(rec, 16, 1, idx) != 1)
+            return size;
+        GIntBig v = 0;
+        for (int i = 8; i < 16; i++)
+            v = (v << 8) | rec[i];
+        size += v;
+    }
+    return size;
+}
 
-            // Update BlockX and BlockY for the next level (round down)
-            int BlockXOut = BlockX / 2;
-            int BlockYOut = BlockY / 2;
+// Prints what inserting the sources would do as JSON, without modifying the target.
+// For each level, the tiles and ranges of tiles which would be written, how many
+// of them need the content of tiles which are not written, and an estimate of
+// the bytes appended to the data file, based on the current size of those tiles
+bool state::plan(const vector<string> &sources)
+{
+    CPLPushErrorHandler(CPLQuietErrorHandler);
+    GDALDatasetH hDataset = GDALOpen(TargetName.c_str(), GA_ReadOnly);
+    CPLPopErrorHandler();
 
-            Width += (BlockX & 1);  // Increment width if BlockX was rounded down
-            Height += (BlockY & 1); // Increment height if BlockY was rounded down
+    if (hDataset == NULL)
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Can't open file %s", TargetName.c_str());
+        return false;
+    }
 
-            // Compute WidthOut and HeightOut for the next level (round up)
-            int WidthOut = Width / 2 + (Width & 1);
-            int HeightOut = Height / 2 + (Height & 1);
+    GDALDataset *pTDS = static_cast<GDALDataset *>(hDataset);
+    if (!EQUAL(pTDS->GetDriver()->GetDescription(), "MRF"))
+    {
+        CPLError(CE_Failure, CPLE_AppDefined, "Target file is not an MRF");
+        GDALClose(hDataset);
+        return false;
+    }
 
-            // Prepare for the next iteration
-            BlockX = BlockXOut;
-            BlockY = BlockYOut;
-            Width = WidthOut;
-            Height = HeightOut;
+    img_info out_img(hDataset);
+    GDALRasterBand *b0 = pTDS->GetRasterBand(1);
+    int tsz_x, tsz_y;
+    b0->GetBlockSize(&tsz_x, &tsz_y);
+    int overview_count = b0->GetOverviewCount();
+    // Band interleaved MRFs have one index record per band for each tile
+    const char *interleave = pTDS->GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE");
+    int pages = (interleave != NULL && EQUAL(interleave, "BAND")) ? pTDS->GetRasterCount() : 1;
+
+    cout << "{\n  \"target\": " << quoted(TargetName) << ",\n"
+         << "  \"tile_size\": [" << tsz_x << ", " << tsz_y << "],\n"
+         << "  \"sources\": [";
+
+    set<Tile> tiles;   // Written on the current level
+    set<Tile> partial; // Level 0 tiles not fully covered by a source
+    for (size_t i = 0; i < sources.size(); i++)
+    {
+        CPLPushErrorHandler(CPLQuietErrorHandler);
+        GDALDatasetH hPatch = GDALOpen(sources[i].c_str(), GA_ReadOnly);
+        CPLPopErrorHandler();
+
+        Bounds pix_bbox;
+        if (hPatch == NULL || !source_pixels(img_info(hPatch), out_img, pix_bbox))
+        {
+            if (hPatch == NULL)
+                CPLError(CE_Failure, CPLE_AppDefined, "Can't open file %s", sources[i].c_str());
+            else
+                GDALClose(hPatch);
+            GDALClose(hDataset);
+            return false;
         }
+        GDALClose(hPatch);
+
+        int lx = int(pix_bbox.lx), ux = int(pix_bbox.ux), uy = int(pix_bbox.uy), ly = int(pix_bbox.ly);
+        set<Tile> covered;
+        covered_tiles(pix_bbox, tsz_x, tsz_y, covered);
+
+        // Edges which are not on a tile boundary or on the target edge
+        vector<string> edges;
+        bool left = lx % tsz_x != 0;
+        bool right = ux % tsz_x != 0 && ux != int(out_img.size.x);
+        bool top = uy % tsz_y != 0;
+        bool bottom = ly % tsz_y != 0 && ly != int(out_img.size.y);
+        if (left)
+            edges.push_back("left");
+        if (right)
+            edges.push_back("right");
+        if (top)
+            edges.push_back("top");
+        if (bottom)
+            edges.push_back("bottom");
+
+        size_t partial_tiles = 0;
+        for (auto &t : covered)
+        {
+            if ((left && t.second == lx / tsz_x) || (right && t.second == (ux - 1) / tsz_x) ||
+                (top && t.first == uy / tsz_y) || (bottom && t.first == (ly - 1) / tsz_y))
+            {
+                partial.insert(t);
+                partial_tiles++;
+            }
+        }
+        tiles.insert(covered.begin(), covered.end());
+
+        cout << (i ? "," : "") << "\n    {\"name\": " << quoted(sources[i])
+             << ", \"pixels\": [" << lx << ", " << uy << ", " << ux << ", " << ly << "]"
+             << ", \"tiles\": " << covered.size()
+             << ", \"partial_tiles\": " << partial_tiles << ", \"partial_edges\": [";
+        for (size_t e = 0; e < edges.size(); e++)
+            cout << (e ? ", " : "") << quoted(edges[e]);
+        cout << "]}";
     }
+    cout << "\n  ],\n  \"levels\": [";
 
-    // Now for the upper levels
-    GDALFlushCache(hDataset);
+    // The index, to find the current size of the tiles
+    string idxname;
+    char **files = pTDS->GetFileList();
+    for (int i = 0; files != NULL && files[i] != NULL; i++)
+    {
+        string name(files[i]);
+        if (name.size() > 4 && name.substr(name.size() - 4) == ".idx")
+            idxname = name;
+    }
+    CSLDestroy(files);
+    VSILFILE *idx = idxname.empty() ? NULL : VSIFOpenL(idxname.c_str(), "rb");
+
+    // Overview levels written, as source levels
+    int first = start_level - 1;
+    int last = (stop_level == -1) ? overview_count : stop_level;
+    GIntBig level_start = 0;
+    GIntBig total = 0, present_total = 0, present_bytes = 0;
+    int cols = 0, rows = 0;
+    bool comma = false;
+    for (int level = 0; level <= overview_count; level++)
+    {
+        GDALRasterBand *band = level ? b0->GetOverview(level - 1) : b0;
+        int lower_cols = cols, lower_rows = rows;
+        cols = (band->GetXSize() + tsz_x - 1) / tsz_x;
+        rows = (band->GetYSize() + tsz_y - 1) / tsz_y;
+
+        size_t partial_tiles = partial.size();
+        if (level > 0)
+        {
+            // Generated from four tiles of the level below, the ones not written are read
+            set<Tile> parents;
+            for (auto &t : tiles)
+                parents.insert(Tile(t.first / 2, t.second / 2));
+            partial_tiles = 0;
+            for (auto &t : parents)
+            {
+                for (int c = 0; c < 4; c++)
+                {
+                    Tile child(2 * t.first + c / 2, 2 * t.second + c % 2);
+                    if (child.first < lower_rows && child.second < lower_cols && !tiles.count(child))
+                    {
+                        partial_tiles++;
+                        break;
+                    }
+                }
+            }
+            tiles.swap(parents);
+        }
+
+        bool written = (level == 0) ? (start_level == 0)
+                                    : (overlays && level - 1 >= first && level - 1 < last);
+        if (written)
+        {
+            GIntBig present = 0, bytes = 0;
+            for (auto &t : tiles)
+            {
+                GIntBig size = tile_size(idx, level_start + (GIntBig(t.first) * cols + t.second) * pages, pages);
+                present += (size != 0);
+                bytes += size;
+            }
+            present_total += present;
+            present_bytes += bytes;
+            // Tiles which don't exist yet are as large as the average
+            if (present_total)
+                bytes += (GIntBig(tiles.size()) - present) * present_bytes / present_total;
+            total += bytes;
+
+            cout << (comma ? "," : "") << "\n    {\"level\": " << level
+                 << ", \"tiles\": " << tiles.size()
+                 << ", \"partial_tiles\": " << partial_tiles
+                 << ", \"present_tiles\": " << present
+                 << ", \"bytes\": " << bytes << ", \"ranges\": [";
+            vector<TileRange> ranges(tile_ranges(tiles));
+            for (size_t r = 0; r < ranges.size(); r++)
+                cout << (r ? ", " : "") << "[" << ranges[r].x << ", " << ranges[r].y
+                     << ", " << ranges[r].w << ", " << ranges[r].h << "]";
+            cout << "]}";
+            comma = true;
+        }
+        level_start += GIntBig(cols) * rows * pages;
+    }
+    cout << "\n  ],\n  \"bytes\": " << total << "\n}" << endl;
+
+    if (idx != NULL)
+        VSIFCloseL(idx);
     GDALClose(hDataset);
     return true;
 }
@@ -439,6 +1019,8 @@ static int Usage()
         "\t-start_level <N> : first level to insert into (0)\n"
         "\t-end_level <N> : last level to insert into (last)\n"
         "\t-r : choice of resampling method (default: average)\n"
+        "\t-threads <N> : threads used to generate the overviews, 0 for all cores (1)\n"
+        "\t--plan : print the tiles which would be written as JSON, don't modify the target\n"
         "\t-q : turn off progress display\n");
 
     return 1;
@@ -450,6 +1032,7 @@ int main(int nArgc, char **papszArgv)
     int ret = 0;
 
     std::vector<std::string> fnames;
+    bool plan = false;
 
     /* Check that we are running against at least GDAL 3.x */
     /* Note to developers : if using newer API, please change the requirement */
@@ -498,6 +1081,14 @@ int main(int nArgc, char **papszArgv)
         {
             State.setStop(strtol(papszArgv[++iArg], 0, 0));
         }
+        else if (EQUAL(papszArgv[iArg], "--plan") || EQUAL(papszArgv[iArg], "-plan"))
+        {
+            plan = true;
+        }
+        else if (EQUAL(papszArgv[iArg], "-threads") && iArg < nArgc - 1)
+        {
+            State.setThreads(strtol(papszArgv[++iArg], 0, 0));
+        }
         else if (EQUAL(papszArgv[iArg], "-r") && iArg < nArgc - 1)
         {
             // R is required for building overviews
@@ -530,6 +1121,14 @@ int main(int nArgc, char **papszArgv)
         return Usage();
     }
 
+    if (plan)
+    {
+        ret = State.plan(fnames) ? 0 : 2;
+        CSLDestroy(papszArgv);
+        GDALDestroyDriverManager();
+        return ret;
+    }
+
     try
     {
         // Each input file in sequence, as they were passed as arguments
@@ -543,6 +1142,12 @@ int main(int nArgc, char **papszArgv)
                 throw 2;
             }
         }
+
+        // All the sources are in, build the overviews once
+        if (!State.overviews())
+        {
+            throw 2;
+        }
     } // Try, all execution
     catch (int err_ret)
     {
@@ -37,6 +37,7 @@
 
 #include <gdal.h>
 #include <cpl_string.h>
+#include <cpl_vsi.h>
 
 // For C++ interface
 #include <gdal_priv.h>
@@ -47,6 +48,15 @@
 
 #include <vector>
 #include <string>
+#include <set>
+#include <limits>
+#include <algorithm>
+#include <deque>
+#include <utility>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <atomic>
 
 // generic bounds
 struct Bounds {
@@ -65,6 +75,14 @@ struct XY {
     double x,y;
 };
 
+// A tile, as row and column
+typedef std::pair<int, int> Tile;
+
+// A rectangle of tiles
+struct TileRange {
+    int x, y, w, h;
+};
+
 struct img_info {
     img_info(GDALDatasetH hDS);
     Bounds bbox;
@@ -80,16 +98,28 @@ public:
         verbose(false),
         overlays(false),
     start_level(0), // From begining
-    stop_level(-1)  // To end
+    stop_level(-1),  // To end
+    nthreads(1)
     {};
 
     // Insert the target in the source, based on internal coordinates
     bool patch(void);
 
+    // Rebuild the overview tiles affected by all the patches, once
+    bool overviews(void);
+
+    // Print the tiles which would be written by inserting the sources, as JSON
+    bool plan(const std::vector<std::string> &sources);
+
+    // Generate the overview tiles of a level from the level below, using threads
+    bool overview_threads(GDALDataset *pTDS, int sl, const std::set<Tile> &tiles);
+
     void setStart(int level) { start_level = level; }
 
     void setStop(int level) { stop_level = level; }
 
+    void setThreads(int n) { nthreads = (n > 0) ? n : std::max(1u, std::thread::hardware_concurrency()); }
+
     void setTarget(const std::string &Target) {TargetName=Target;}
 
     void setSource(const std::string &Source) {SourceName=Source;}
@@ -112,8 +142,11 @@ private:
     int overlays;
     int start_level;
     int stop_level;
+    int nthreads;
     std::string TargetName;
     std::string SourceName;
+    // Level 0 tiles written by all the patches
+    std::set<Tile> dirty;
     int Resampling;
     GDALProgressFunc Progress;
 };
@@ -27,9 +27,18 @@
 import os
 import io
 import sys
+import json
+import zlib
 import array
+import bisect
 import argparse
 import glob
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
 
 # hexversion >> 16 >= 0x306 (for 3.6 or later)
 assert sys.hexversion >> 24 >= 0x3, "Python 3 required"
@@ -129,6 +138,186 @@ def mrf_join(argv, forceoffset = None):
                     ofile.seek(- len(outidx) * outidx.itemsize, io.SEEK_CUR)
                     outidx.tofile(ofile)
 
+# Index records rebuilt at a time by the incremental join
+RUNCHUNK = 32768
+
+def scan_index(idxname):
+    '''Returns the runs of non-empty records in an index, as [first, end] pairs,
+    and the crc32 of the index content'''
+    runs = []
+    crc = 0
+    record = 0
+    with open(idxname, 'rb') as f:
+        for block in iter(lambda : f.read(1024 * 1024), b""):
+            crc = zlib.crc32(block, crc)
+            idx = array.array('Q', block)
+            if idx.count(0) == len(idx):
+                record += len(idx) // 2
+                continue
+            for i in range(1, len(idx), 2):
+                if idx[i] != 0: # Zero is the same in both byte orders
+                    if runs and runs[-1][1] == record:
+                        runs[-1][1] += 1
+                    else:
+                        runs.append([record, record + 1])
+                record += 1
+    return runs, crc
+
+def file_identity(fname):
+    st = os.stat(fname)
+    return st.st_size, st.st_mtime_ns
+
+def merge_runs(runs):
+    'Sorted, non-overlapping runs covering all the given [first, end] runs'
+    result = []
+    for first, end in sorted(runs):
+        if result and first <= result[-1][1]:
+            result[-1][1] = max(result[-1][1], end)
+        else:
+            result.append([first, end])
+    return result
+
+def unchanged(entry, fname):
+    '''True if the input matches its manifest entry. A data file with a new
+    modification time is changed, since its tiles can be rewritten in place with
+    the same size. When only the index time differs, the index checksum decides,
+    and the entry is updated'''
+    dsize, dtime = file_identity(fname)
+    isize, itime = file_identity(os.path.splitext(fname)[0] + '.idx')
+    if (dsize, isize, dtime) != (entry['data_size'], entry['index_size'], entry['data_mtime']):
+        return False
+    if itime == entry['index_mtime']:
+        return True
+    if scan_index(os.path.splitext(fname)[0] + '.idx')[1] != entry['index_crc']:
+        return False
+    entry['index_mtime'] = itime
+    return True
+
+def rebuild_records(ofname, entries, runs):
+    '''Rewrites the output index records in the runs, the last input with a
+    tile wins. Only the inputs which have tiles in a run are read'''
+    with open(ofname + '.idx', 'r+b') as ofile:
+        for first, end in runs:
+            for start in range(first, end, RUNCHUNK):
+                stop = min(end, start + RUNCHUNK)
+                outidx = array.array('Q', bytes(16 * (stop - start)))
+                for entry in entries:
+                    ranges = entry['ranges']
+                    i = max(0, bisect.bisect_right(ranges, [start, float('inf')]) - 1)
+                    parts = []
+                    for rfirst, rend in ranges[i:]:
+                        if rfirst >= stop:
+                            break
+                        if max(rfirst, start) < min(rend, stop):
+                            parts.append((max(rfirst, start), min(rend, stop)))
+                    if not parts:
+                        continue
+                    with open(os.path.splitext(entry['name'])[0] + '.idx', 'rb') as ifile:
+                        for lo, hi in parts:
+                            ifile.seek(16 * lo)
+                            inidx = array.array('Q')
+                            inidx.fromfile(ifile, 2 * (hi - lo))
+                            if sys.byteorder != 'big':
+                                inidx.byteswap()
+                            for j in range(0, len(inidx), 2):
+                                if inidx[j + 1] != 0:
+                                    k = 2 * (lo - start) + j
+                                    outidx[k] = inidx[j] + entry['base']
+                                    outidx[k + 1] = inidx[j + 1]
+                if sys.byteorder != 'big':
+                    outidx.byteswap()
+                ofile.seek(16 * start)
+                outidx.tofile(ofile)
+
+def mrf_join_incremental(argv):
+    '''Same as mrf_join, keeping a manifest of the inputs in <output>.join.json
+ The manifest holds the size, modification time and index checksum of every
+ input, where its data starts in the output and the runs of records where it
+ has tiles. On later runs, only the data of new and changed inputs is appended
+ and only the index records covered by them, by the changed or removed inputs
+ are rebuilt. The data of changed or removed inputs stays in the output data
+ file, mrf_clean.py can reclaim it.
+    '''
+    assert len(argv) >= 2,\
+       "Takes a list of input mrf data files to be concatenated, the last is the output, which will be created if needed"
+    ofname, ext = os.path.splitext(argv[-1])
+    assert ext not in ('.mrf', '.idx'),\
+       "Takes data file names as input, not the .mrf or .idx"
+    input_list = argv[:-1]
+    for f in input_list:
+        assert os.path.splitext(f)[1] == ext,\
+            "All input files should have the same extension"
+
+    manifest_name = ofname + '.join.json'
+    if os.path.isfile(manifest_name):
+        with open(manifest_name) as f:
+            manifest = json.load(f)
+    else:
+        assert not os.path.isfile(ofname + ext),\
+            "Output {} exists without a join manifest".format(ofname + ext)
+        manifest = {'inputs': []}
+        ffname = os.path.splitext(input_list[0])[0]
+        with open(ffname + '.mrf', "rb") as mrf_file:
+            with open(ofname + '.mrf', "wb") as omrf_file:
+                omrf_file.write(mrf_file.read())
+        with open(ofname + '.idx', "wb") as idx_file:
+            idx_file.truncate(os.path.getsize(ffname + '.idx'))
+        with open(ofname + ext, "wb") as data_file:
+            pass
+
+    idxsize = os.path.getsize(ofname + '.idx')
+    for f in input_list:
+        assert os.path.getsize(os.path.splitext(f)[0] + '.idx') == idxsize,\
+            "All input index files should have the same size {}, {} does not".format(idxsize, f)
+
+    old = {entry['name'] : entry for entry in manifest['inputs']}
+    names = [os.path.abspath(f) for f in input_list]
+    assert len(set(names)) == len(names), "Inputs can only be used once"
+    # If the order of the inputs changes, all the records have to be rebuilt
+    kept = [e['name'] for e in manifest['inputs'] if e['name'] in names]
+    reordered = kept != [n for n in names if n in old]
+
+    entries = []
+    runs = []
+    for input_file, name in zip(input_list, names):
+        entry = old.pop(name, None)
+        if entry is not None and unchanged(entry, input_file):
+            print("Skipping {}, unchanged".format(input_file))
+            if reordered:
+                runs += entry['ranges']
+            entries.append(entry)
+            continue
+        print("Processing {}".format(input_file))
+        if entry is not None:
+            runs += entry['ranges']
+        ranges, crc = scan_index(os.path.splitext(input_file)[0] + '.idx')
+        dsize, dtime = file_identity(input_file)
+        isize, itime = file_identity(os.path.splitext(input_file)[0] + '.idx')
+        entry = {
+            'name' : name,
+            'data_size' : dsize,
+            'data_mtime' : dtime,
+            'index_size' : isize,
+            'index_mtime' : itime,
+            'index_crc' : crc,
+            'base' : os.path.getsize(ofname + ext),
+            'ranges' : ranges,
+        }
+        appendfile(input_file, ofname + ext)
+        runs += ranges
+        entries.append(entry)
+
+    # Inputs no longer present
+    for entry in old.values():
+        print("Removing {}".format(entry['name']))
+        runs += entry['ranges']
+
+    rebuild_records(ofname, entries, merge_runs(runs))
+    manifest['inputs'] = entries
+    with open(manifest_name + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_name + '.tmp', manifest_name)
+
 # Integer division of x/y, rounded up
 def rupdiv(x, y):
     return 1 + (x - 1) // y
@@ -139,46 +328,26 @@ def getpcount(size, pagesize):
          * rupdiv(size['c'], pagesize['c'])
 
 def getmrfinfo(fname):
+    import copy
     import xml.etree.ElementTree as ET
-    tree = ET.parse(fname)
-    root = tree.getroot()
-    assert root.tag == "MRF_META", "{} is not an MRF".format(fname)
+    meta = mrf_meta.load(fname)
     info = {}
-    info['size'] = { key : int(val) for (key, val) in 
-                    root.find("./Raster/Size").attrib.items() }
-
-    if root.find("./Raster/PageSize"):
-        info['pagesize'] = { key : int(val) for (key, val) in 
-                        root.find("./Raster/PageSize").attrib.items() }
-    else:
-        info['pagesize'] = {
-            'x' : 512,
-            'y' : 512,
-            'c' : info['size']['c'] if 'c' in info['size'] else 1
-        }
-
-    if root.find("./Rsets") is not None:
-        assert root.find("./Rsets").get('model') == 'uniform', "Only uniform model rsets are supported"
-        try:
-            info['scale'] = int(root.find("./Rsets").get('scale'))
-        except:
-            info['scale'] = 2
-
-    # compute the pagecount per level, level 0 always exists
-    sz = info['size']
-    info['pages'] = [getpcount(sz, info['pagesize'])]
-
-    if 'scale' in info:
-        scale = info['scale']
-        # This is either 1 or the number of bands
-        bandpages = rupdiv(info['size']['c'], info['pagesize']['c'])
-        while info['pages'][-1] != bandpages:
-            sz['x'] = rupdiv(sz['x'], scale)
-            sz['y'] = rupdiv(sz['y'], scale)
-            info['pages'].append(getpcount(sz, info['pagesize']))
-    info['totalpages'] = sum(info['pages'])
-
-    return info, tree
+    info['size'] = { key : int(val) for (key, val) in
+                    meta.root.find("./Raster/Size").attrib.items() }
+    info['pagesize'] = {
+        'x' : meta.pagesize.x,
+        'y' : meta.pagesize.y,
+        'c' : meta.pagesize.c
+    }
+    if meta.scale is not None:
+        info['scale'] = meta.scale
+
+    # pagecount per level, level 0 always exists
+    info['pages'] = list(meta.pages)
+    info['totalpages'] = meta.totalpages
+
+    # The tree is a copy, the caller may modify it
+    return info, ET.ElementTree(copy.deepcopy(meta.root))
 
 # Creates the file if it doesn't exist, then truncates it to the given size
 def ftruncate(fname, size = 0):
@@ -197,7 +366,89 @@ def write_mrf(tree, zsz, fname):
     size.set('z', str(zsz))
     tree.write(fname)
 
-def mrf_append(inputs, output, outsize, startidx = 0):
+def copy_at(srcname, dst_fd, offset):
+    'Copies a whole file into an open file at the given offset, in the kernel if possible'
+    size = os.path.getsize(srcname)
+    src_fd = os.open(srcname, os.O_RDONLY)
+    try:
+        done = 0
+        while done < size:
+            n = 0
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    n = os.copy_file_range(src_fd, dst_fd, size - done, done, offset + done)
+                except OSError:
+                    pass
+            if n == 0:  # Not supported, or source is shorter than expected
+                chunk = os.pread(src_fd, min(size - done, 1024 * 1024), done)
+                assert chunk, "Error reading from {}".format(srcname)
+                n = os.pwrite(dst_fd, chunk, offset + done)
+            done += n
+    finally:
+        os.close(src_fd)
+
+def append_slice(fn, dataoffset, idx_fd, data_fd, mrfinfo, outsize, zslice):
+    '''Copies the data of one input to its reserved range in the output,
+    then writes the index records of each level which are not all zeros, as runs'''
+    assert 0 <= zslice < outsize, \
+        "Slice {} is outside of the output, which has {} slices".format(zslice, outsize)
+    copy_at(fn, data_fd, dataoffset)
+    with open(os.path.splitext(fn)[0] + ".idx", "rb") as inidx:
+        for level in range(len(mrfinfo['pages'])):
+            outidxoffset = zslice * mrfinfo['pages'][level]
+            if level > 0:
+                outidxoffset += sum(mrfinfo['pages'][0:level]) * outsize
+            tinfo = array.array('Q')
+            tinfo.fromfile(inidx, 2 * mrfinfo['pages'][level])
+            if tinfo.count(0) == len(tinfo):
+                continue
+            if sys.byteorder != 'big':
+                tinfo.byteswap()
+            run = None
+            for tnum in range(mrfinfo['pages'][level] + 1):
+                # Same as the sequential append, records with a size or an offset are copied
+                if tnum < mrfinfo['pages'][level] and (tinfo[2 * tnum] != 0 or tinfo[2 * tnum + 1] != 0):
+                    tinfo[2 * tnum] += dataoffset
+                    if run is None:
+                        run = tnum
+                    continue
+                if run is not None: # Write the run of non-empty tiles
+                    chunk = tinfo[2 * run : 2 * tnum]
+                    if sys.byteorder != 'big':
+                        chunk.byteswap()
+                    os.pwrite(idx_fd, chunk.tobytes(), 16 * (outidxoffset + run))
+                    run = None
+
+def append_parallel(inputs, output, outsize, startidx, mrfinfo, workers):
+    '''Reserves the data range of every input at the end of the output, then
+    copies the data and writes the index records of the slices concurrently'''
+    from concurrent.futures import ThreadPoolExecutor
+    ofname = os.path.splitext(output)[0]
+    inidxsize = 16 * mrfinfo['totalpages']
+    offsets = []
+    end = os.path.getsize(output)
+    for fn in inputs:
+        assert os.path.getsize(os.path.splitext(fn)[0] + ".idx") == inidxsize, \
+            "Index for file {} has invalid size, expected {}".format(fn, inidxsize)
+        offsets.append(end)
+        end += os.path.getsize(fn)
+    with open(output, "r+b") as o:
+        o.truncate(end)
+
+    data_fd = os.open(output, os.O_WRONLY)
+    idx_fd = os.open(ofname + ".idx", os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            futures = [executor.submit(append_slice, fn, offset, idx_fd, data_fd,
+                                       mrfinfo, outsize, startidx + i)
+                       for i, (fn, offset) in enumerate(zip(inputs, offsets))]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(data_fd)
+        os.close(idx_fd)
+
+def mrf_append(inputs, output, outsize, startidx = 0, workers = 1):
     ofname, ext = os.path.splitext(output)
     assert ext not in ('.mrf', '.idx'),\
        "Takes data file names as arguments"
@@ -207,6 +458,9 @@ def mrf_append(inputs, output, outsize, startidx = 0):
     # Get the template mrf information from the first input
     # Use the first input file (inputs[0]) as template for the output MRF
     mrfinfo, tree = getmrfinfo(os.path.splitext(inputs[0])[0] + ".mrf")
+    assert 0 <= startidx and startidx + len(inputs) <= outsize, \
+        "Slices {} to {} are outside of the output, which has {} slices".format(
+            startidx, startidx + len(inputs) - 1, outsize)
 
     # Create the output .mrf if it doesn't exist
     if not os.path.isfile(ofname + ".mrf"):
@@ -220,6 +474,8 @@ def mrf_append(inputs, output, outsize, startidx = 0):
         # Try to create it
         with open(output, "wb") as o:
             pass
+    if workers > 1:
+        return append_parallel(inputs, output, outsize, startidx, mrfinfo, workers)
 
     for fn in inputs:
         # Create the output file if not there and get its current size
@@ -256,6 +512,7 @@ def mrf_append(inputs, output, outsize, startidx = 0):
         startidx += 1
 
 def main():
+    mrf_profile.start()
     def auto_int(x):
         return int(x, 0)
 
@@ -268,6 +525,10 @@ def main():
                         help = "Used only with -z, which is the first target slice, defaults to 0")
     parser.add_argument("-f", "--forceoffset", type = auto_int,
                         help = "Provide an offset to be used when adding one input index to the output. Data files are ignored")
+    parser.add_argument("-j", "--workers", type = auto_int, default = 1,
+                        help = "Used only with -z, number of slices inserted in parallel")
+    parser.add_argument("-i", "--incremental", action = "store_true",
+                        help = "Keep a manifest of the inputs next to the output, on later runs only new or changed inputs are joined")
 
     parser.add_argument("fnames", nargs='+')
     args = parser.parse_args()
@@ -279,12 +540,16 @@ def main():
     if args.zsize is not None:
         assert args.output is not None, "-z option requires an explicit output file name"
         assert args.forceoffset is None, "-z option can't use a forced offset"
+        assert not args.incremental, "-z option can't be incremental"
         slice = args.slice if args.slice is not None else 0
-        return mrf_append(fnames, args.output, args.zsize, slice)
+        return mrf_append(fnames, args.output, args.zsize, slice, args.workers)
 
     # Default action is mrf_join, takes the output as the last argument
     if args.output is not None:
         fnames.append(args.output)
+    if args.incremental:
+        assert args.forceoffset is None, "Incremental join can't use a forced offset"
+        return mrf_join_incremental(fnames)
     if args.forceoffset is not None:
         assert len(fnames) == 2, "Forced offset works only with one input"
     mrf_join(fnames, forceoffset = args.forceoffset)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_meta
+# Purpose:
+
+'''MRF metadata model, shared by the MRF tools
+
+ load(name) parses an .mrf file and returns an MRFMeta. Results are kept in a
+ process wide cache, keyed by the file path, modification time and size, so
+ the same metadata file is parsed only once, until it changes.
+ The returned objects are shared, they should not be modified.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import xml.etree.ElementTree as ET
+
+# Default data file extension for each compression
+EXTENSIONS = {
+    'JPEG': '.pjg', 'PNG': '.ppg', 'PPNG': '.ppg', 'JPNG': '.pjp',
+    'NONE': '.til', 'DEFLATE': '.pzp', 'TIF': '.ptf', 'LERC': '.lrc',
+    'ZSTD': '.pzs', 'QB3': '.pq3', 'PBF': '.pvt', 'MVT': '.pvt',
+}
+
+# Cached models, at most MAX_CACHE of them
+MAX_CACHE = 4096
+_cache = {}
+
+def rupdiv(x, y):
+    return 1 + (x - 1) // y
+
+def attr(node, key, default):
+    return default if node is None or node.get(key) is None else node.get(key)
+
+def text(node, default = None):
+    return default if node is None or node.text is None else node.text.strip()
+
+def is_true(value):
+    return value is not None and value.lower() in ('on', 'true', 'yes', '1')
+
+class PointXYZC(object):
+    __slots__ = ('x', 'y', 'z', 'c')
+
+    def __init__(self, node, defaults = (-1, -1, 1, 1)):
+        key = 'x','y','z','c'
+        self.x, self.y, self.z, self.c = (
+            int(attr(node, key[i], defaults[i])) for i in range(4))
+
+    def __str__(self):
+        f = "PointXYZC ({p.x}, {p.y}, {p.z}, {p.c})"
+        return f.format(p = self)
+
+class BBOX(object):
+    __slots__ = ('minx', 'miny', 'maxx', 'maxy')
+
+    def __init__(self, node, defaults):
+        key = 'minx', 'miny', 'maxx', 'maxy'
+        self.minx, self.miny, self.maxx, self.maxy = (
+            float(attr(node, key[i], defaults[i])) for i in range(4))
+
+    def __str__(self):
+        f = "BBOX ({p.minx}, {p.miny}, {p.maxx}, {p.maxy})"
+        return f.format(p = self)
+
+class MRFMeta(object):
+    '''Parsed MRF metadata
+    size and pagesize are PointXYZC, size.z is the number of z slices
+    pages is the number of index records per level, for one z slice
+    datafile and indexfile are file names, relative to the current folder
+    dataoffset and indexoffset are where the data and the index start in those files
+    source is the cached or cloned MRF name, clone is set for a cloning MRF
+    '''
+    __slots__ = ('name', 'root', 'size', 'pagesize', 'compression', 'datatype',
+                 'scale', 'datafile', 'dataoffset', 'indexfile', 'indexoffset',
+                 'versioned', 'source', 'clone', 'projection', 'bbox', 'pages')
+
+    def __init__(self, name, root):
+        if root.tag != 'MRF_META':
+            raise ValueError(name + ' is not an MRF metadata file')
+        raster = root.find('Raster')
+        if raster is None:
+            raise ValueError('Missing Raster element in ' + name)
+
+        self.name = name
+        self.root = root
+        self.size = PointXYZC(raster.find('Size'))
+        self.pagesize = PointXYZC(raster.find('PageSize'), (512, 512, 1, self.size.c))
+        self.compression = text(raster.find('Compression'), 'PNG')
+        self.datatype = text(raster.find('DataType'), 'Byte')
+        self.versioned = is_true(raster.get('versioned'))
+
+        self.scale = None
+        rsets = root.find('Rsets')
+        if rsets is not None:
+            if rsets.get('model', 'uniform') != 'uniform':
+                raise ValueError('Only uniform model rsets are supported')
+            try:
+                self.scale = int(rsets.get('scale'))
+            except (TypeError, ValueError):
+                self.scale = 2
+
+        folder = os.path.dirname(name)
+        base = os.path.splitext(name)[0]
+        node = raster.find('DataFile')
+        self.datafile = self.resolve(folder, text(node, None)) \
+            or base + EXTENSIONS.get(self.compression, '.dat')
+        self.dataoffset = int(attr(node, 'offset', 0))
+        node = raster.find('IndexFile')
+        self.indexfile = self.resolve(folder, text(node, None)) or base + '.idx'
+        self.indexoffset = int(attr(node, 'offset', 0))
+
+        self.source = None
+        self.clone = False
+        node = root.find('CachedSource/Source')
+        if node is None:
+            node = raster.find('CachedSource/Source')
+        if node is not None:
+            self.source = self.resolve(folder, text(node, None))
+            self.clone = is_true(node.get('clone'))
+
+        self.projection = text(root.find('GeoTags/Projection'), None)
+        self.bbox = BBOX(root.find('GeoTags/BoundingBox'), (0, 0, self.size.x, self.size.y))
+
+        # Records per level, level 0 always exists
+        bandpages = rupdiv(self.size.c, self.pagesize.c)
+        x, y = self.size.x, self.size.y
+        self.pages = [rupdiv(x, self.pagesize.x) * rupdiv(y, self.pagesize.y) * bandpages]
+        if self.scale is not None:
+            while self.pages[-1] != bandpages:
+                x, y = rupdiv(x, self.scale), rupdiv(y, self.scale)
+                self.pages.append(rupdiv(x, self.pagesize.x) * rupdiv(y, self.pagesize.y) * bandpages)
+
+    @staticmethod
+    def resolve(folder, fname):
+        'File names in the metadata are relative to the metadata file'
+        if not fname:
+            return None
+        return fname if os.path.isabs(fname) else os.path.join(folder, fname)
+
+    @property
+    def totalpages(self):
+        'Index records for one z slice'
+        return sum(self.pages)
+
+    @property
+    def records(self):
+        'Index records in one version of the index'
+        return self.size.z * self.totalpages
+
+    @property
+    def bandpages(self):
+        return rupdiv(self.size.c, self.pagesize.c)
+
+    @property
+    def zsize(self):
+        'Number of z slices, None when the size has no z'
+        return self.size.z if self.root.find('Raster/Size').get('z') is not None else None
+
+    def levels(self):
+        'List of (columns, rows) for each level, level 0 is the full resolution'
+        result = []
+        x, y = self.size.x, self.size.y
+        for _ in self.pages:
+            result.append((rupdiv(x, self.pagesize.x), rupdiv(y, self.pagesize.y)))
+            x, y = rupdiv(x, self.scale or 2), rupdiv(y, self.scale or 2)
+        return result
+
+    def level_start(self, level):
+        'First record of a level, all z slices of a level are consecutive'
+        return self.size.z * sum(self.pages[:level])
+
+    def record(self, level, row, col, z = 0, band = 0):
+        'Index record number of a tile, counting from 0'
+        cols = self.levels()[level][0]
+        return (self.level_start(level) + z * self.pages[level]
+                + (row * cols + col) * self.bandpages + band)
+
+    def geotransform(self):
+        'gdal style affine geotransform as a list'
+        return [
+            self.bbox.minx, (self.bbox.maxx - self.bbox.minx)/self.size.x, 0,
+            self.bbox.maxy, 0, (self.bbox.miny - self.bbox.maxy)/self.size.y]
+
+def load(name):
+    'Returns the MRFMeta for an .mrf file, from the cache if the file has not changed'
+    st = os.stat(name)
+    key = (os.path.abspath(name), st.st_mtime_ns, st.st_size)
+    meta = _cache.get(key)
+    if meta is None:
+        meta = MRFMeta(name, ET.parse(name).getroot())
+        if len(_cache) >= MAX_CACHE:
+            del _cache[next(iter(_cache))]
+        _cache[key] = meta
+    return meta
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_place
+# Purpose:
+
+'''Places a smaller MRF into a larger one on the same tile grid, without decoding tiles
+
+ The source tiles are copied by appending the source data file to the
+ destination data file, then the source index records are remapped into the
+ destination index, offset by the tile origin of the source in the
+ destination. Empty source tiles leave the destination tiles unchanged.
+ A level can be placed only if the origin falls on a tile boundary at that
+ level and the source covers whole destination tiles, or reaches the right
+ and bottom edges of the destination. The other levels, including the
+ destination levels the source doesn't have, are reported as needing
+ resampling, mrf_insert can rebuild them.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import array
+import argparse
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+    from . import mrf_join
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+    import mrf_join
+
+def check_compatible(src, dst):
+    'Raises ValueError if the source tiles can not be used in the destination'
+    for name in ('compression', 'datatype'):
+        if getattr(src, name) != getattr(dst, name):
+            raise ValueError("Source and destination {} differ".format(name))
+    if (src.pagesize.x, src.pagesize.y, src.pagesize.c) != (dst.pagesize.x, dst.pagesize.y, dst.pagesize.c):
+        raise ValueError("Source and destination page sizes differ")
+    if (src.size.c, src.size.z) != (dst.size.c, dst.size.z):
+        raise ValueError("Source and destination bands or z size differ")
+    if src.scale is not None and src.scale != (dst.scale or 2):
+        raise ValueError("Source and destination overview scales differ")
+
+def placeable(src, dst, origin, level):
+    'True if the source tiles of a level replace whole destination tiles'
+    factor = (dst.scale or 2) ** level
+    for o, ssize, dsize, page in ((origin[0], src.size.x, dst.size.x, src.pagesize.x),
+                                  (origin[1], src.size.y, dst.size.y, src.pagesize.y)):
+        if o % factor:
+            return False
+        # The last source tile has to be complete, or at the destination edge
+        if ssize % (factor * page) and o * page + ssize != dsize:
+            return False
+    return True
+
+def plan(src, dst, origin):
+    '''Returns the list of levels which can be placed and the list of
+    destination levels which need resampling'''
+    check_compatible(src, dst)
+    col, row = origin
+    if col < 0 or row < 0 or col * src.pagesize.x + src.size.x > dst.size.x \
+            or row * src.pagesize.y + src.size.y > dst.size.y:
+        raise ValueError("Source doesn't fit in the destination at tile {},{}".format(col, row))
+    placed = [l for l in range(min(len(src.pages), len(dst.pages))) if placeable(src, dst, origin, l)]
+    if 0 not in placed:
+        raise ValueError("Source doesn't cover whole destination tiles, use mrf_insert")
+    resample = [l for l in range(len(dst.pages)) if l not in placed]
+    return placed, resample
+
+def place(source, destination, origin):
+    '''Places the source MRF into the destination with its top left tile at
+    the level 0 (col, row) origin. Returns a dictionary with the placed
+    levels, the levels which need resampling, the number of tiles and the
+    bytes appended'''
+    src = mrf_meta.load(source)
+    dst = mrf_meta.load(destination)
+    placed, resample = plan(src, dst, origin)
+
+    # Destination index has to be full size
+    mrf_join.ftruncate(dst.indexfile, max(16 * dst.records, os.path.getsize(dst.indexfile)))
+    if not os.path.isfile(dst.datafile):
+        open(dst.datafile, "wb").close()
+    base = os.path.getsize(dst.datafile)
+    mrf_join.appendfile(src.datafile, dst.datafile)
+
+    tiles = 0
+    sfd = os.open(src.indexfile, os.O_RDONLY)
+    dfd = os.open(dst.indexfile, os.O_RDWR)
+    try:
+        for level in placed:
+            factor = (dst.scale or 2) ** level
+            cols, rows = src.levels()[level]
+            dcol, drow = origin[0] // factor, origin[1] // factor
+            length = 16 * cols * src.bandpages
+            for z in range(src.size.z):
+                for row in range(rows):
+                    inidx = array.array('Q', os.pread(sfd, length, 16 * src.record(level, row, 0, z)).ljust(length, b'\0'))
+                    if inidx.count(0) == len(inidx):
+                        continue
+                    where = 16 * dst.record(level, row + drow, dcol, z)
+                    outidx = array.array('Q', os.pread(dfd, length, where).ljust(length, b'\0'))
+                    if sys.byteorder != 'big':
+                        inidx.byteswap()
+                        outidx.byteswap()
+                    for i in range(0, len(inidx), 2):
+                        if inidx[i + 1] != 0:
+                            outidx[i] = inidx[i] + base
+                            outidx[i + 1] = inidx[i + 1]
+                            tiles += 1
+                    if sys.byteorder != 'big':
+                        outidx.byteswap()
+                    os.pwrite(dfd, outidx.tobytes(), where)
+    finally:
+        os.close(sfd)
+        os.close(dfd)
+    return {'placed': placed, 'resample': resample, 'tiles': tiles,
+            'bytes': os.path.getsize(dst.datafile) - base}
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Place a smaller MRF into a larger one on the same tile grid')
+    parser.add_argument('source', help='Source MRF metadata file')
+    parser.add_argument('destination', help='Destination MRF metadata file')
+    parser.add_argument('-o', '--origin', required = True,
+                        help='Level 0 column,row of the destination tile where the source top left tile goes')
+    parser.add_argument('-n', '--dry-run', action = 'store_true',
+                        help='Only report the levels which can be placed and the ones which need resampling')
+    args = parser.parse_args()
+    origin = tuple(int(v) for v in args.origin.split(','))
+    if len(origin) != 2:
+        parser.error('Origin has to be column,row')
+
+    try:
+        if args.dry_run:
+            placed, resample = plan(mrf_meta.load(args.source), mrf_meta.load(args.destination), origin)
+            result = {'placed': placed, 'resample': resample}
+        else:
+            result = place(args.source, args.destination, origin)
+    except ValueError as e:
+        print("Error: " + str(e))
+        return 1
+    print("Placed levels: " + ",".join(str(l) for l in result['placed']))
+    if 'tiles' in result:
+        print("Copied {} tiles, {} bytes".format(result['tiles'], result['bytes']))
+    if result['resample']:
+        print("Levels which need resampling: " + ",".join(str(l) for l in result['resample']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
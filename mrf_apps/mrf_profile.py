@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_profile
+# Purpose:
+
+'''Profiling and I/O accounting for the MRF python tools
+
+ Enabled by the --profile[=name] command line flag or by the MRF_PROFILE
+ environment variable, which holds the name or 1. The name defaults to
+ <tool>.<pid>.prof, in the current folder.
+ On exit, the cProfile statistics are written to the name, the I/O
+ accounting to name.io.json and an I/O summary is printed to stderr.
+
+ The I/O accounting counts the calls, bytes, seeks and time spent in the
+ files opened with the builtin open, per file and per file kind: index,
+ data or metadata. The os.open, os.pread, os.preadv, os.pwrite,
+ os.copy_file_range and os.sendfile calls are counted too, for the file
+ a descriptor refers to. A copy counts as a read of the source and a write
+ of the destination, the time goes to the destination. Access through
+ memory maps is not counted. The process read and write system call
+ counts are taken from /proc/self/io, when available.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import atexit
+import builtins
+
+FLAG = '--profile'
+ENV = 'MRF_PROFILE'
+
+INDEX_EXT = ('.idx', '.ix')
+META_EXT = ('.mrf', '.xml', '.vrt', '.json', '.csv')
+
+def file_kind(fname):
+    'index, meta or data, based on the file extension'
+    ext = os.path.splitext(str(fname))[1].lower()
+    if ext in INDEX_EXT:
+        return 'index'
+    if ext in META_EXT:
+        return 'meta'
+    return 'data'
+
+def proc_io():
+    'Process I/O counters from /proc/self/io, empty if not available'
+    try:
+        with _open('/proc/self/io') as f:
+            return {k: int(v) for k, v in (line.split(':') for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+_open = builtins.open
+_active = None
+# The os functions which are wrapped while profiling, where available
+_os_calls = {name: getattr(os, name) for name in
+             ('open', 'pread', 'preadv', 'pwrite', 'copy_file_range', 'sendfile')
+             if hasattr(os, name)}
+
+
+class FileStats(object):
+    __slots__ = ('kind', 'opens', 'reads', 'read_bytes', 'writes', 'write_bytes',
+                 'seeks', 'truncates', 'seconds')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.opens = self.reads = self.read_bytes = 0
+        self.writes = self.write_bytes = self.seeks = self.truncates = 0
+        self.seconds = 0.0
+
+    def add(self, other):
+        for name in self.__slots__[1:]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class CountingFile(object):
+    'File object proxy, accounts for the calls that do I/O'
+
+    def __init__(self, f, stats):
+        self._f = f
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+    def _read(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        self._stats.seconds += time.perf_counter() - start
+        self._stats.reads += 1
+        return result
+
+    def read(self, *args):
+        data = self._read(self._f.read, *args)
+        self._stats.read_bytes += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._read(self._f.readline, *args)
+        self._stats.read_bytes += len(data)
+        return data
+
+    def readlines(self, *args):
+        lines = self._read(self._f.readlines, *args)
+        self._stats.read_bytes += sum(len(line) for line in lines)
+        return lines
+
+    def readinto(self, b):
+        count = self._read(self._f.readinto, b)
+        self._stats.read_bytes += count or 0
+        return count
+
+    def write(self, data):
+        start = time.perf_counter()
+        count = self._f.write(data)
+        self._stats.seconds += time.perf_counter() - start
+        self._stats.writes += 1
+        self._stats.write_bytes += count if count is not None else len(data)
+        return count
+
+    def seek(self, *args):
+        start = time.perf_counter()
+        result = self._f.seek(*args)
+        self._stats.seconds += time.perf_counter() - start
+        self._stats.seeks += 1
+        return result
+
+    def truncate(self, *args):
+        start = time.perf_counter()
+        result = self._f.truncate(*args)
+        self._stats.seconds += time.perf_counter() - start
+        self._stats.truncates += 1
+        return result
+
+
+class Profiler(object):
+    'cProfile and I/O accounting, from start() until stop()'
+
+    def __init__(self, name, tool):
+        import cProfile
+        self.name = name
+        self.tool = tool
+        self.files = {}
+        self.fds = {}  # File name of the descriptors opened while profiling
+        self.profile = cProfile.Profile()
+        self.io_start = proc_io()
+        self.wall_start = time.perf_counter()
+        builtins.open = self.open
+        for name in _os_calls:
+            setattr(os, name, getattr(self, 'os_' + name))
+        self.profile.enable()
+
+    def stats(self, key):
+        if key not in self.files:
+            self.files[key] = FileStats(file_kind(key))
+        return self.files[key]
+
+    def fd_stats(self, fd):
+        'Stats of the file a descriptor refers to'
+        key = self.fds.get(fd)
+        if key is None:
+            try:
+                key = os.readlink('/proc/self/fd/{}'.format(fd))
+            except OSError:
+                key = 'fd {}'.format(fd)
+        return self.stats(key)
+
+    def open(self, file, *args, **kwargs):
+        f = _open(file, *args, **kwargs)
+        if not isinstance(file, (str, bytes, os.PathLike)):
+            return f  # File descriptor
+        key = os.fsdecode(file)
+        self.stats(key).opens += 1
+        try:
+            self.fds[f.fileno()] = key
+        except (AttributeError, OSError, ValueError):
+            pass
+        return CountingFile(f, self.files[key])
+
+    def os_open(self, path, *args, **kwargs):
+        fd = _os_calls['open'](path, *args, **kwargs)
+        key = os.fsdecode(path)
+        self.stats(key).opens += 1
+        self.fds[fd] = key
+        return fd
+
+    def _timed(self, stats, call, *args):
+        start = time.perf_counter()
+        result = call(*args)
+        stats.seconds += time.perf_counter() - start
+        return result
+
+    def os_pread(self, fd, *args):
+        stats = self.fd_stats(fd)
+        data = self._timed(stats, _os_calls['pread'], fd, *args)
+        stats.reads += 1
+        stats.read_bytes += len(data)
+        return data
+
+    def os_preadv(self, fd, *args):
+        stats = self.fd_stats(fd)
+        count = self._timed(stats, _os_calls['preadv'], fd, *args)
+        stats.reads += 1
+        stats.read_bytes += count
+        return count
+
+    def os_pwrite(self, fd, *args):
+        stats = self.fd_stats(fd)
+        count = self._timed(stats, _os_calls['pwrite'], fd, *args)
+        stats.writes += 1
+        stats.write_bytes += count
+        return count
+
+    def _copy(self, call, src, dst, *args):
+        source, stats = self.fd_stats(src), self.fd_stats(dst)
+        count = self._timed(stats, call, *args)
+        source.reads += 1
+        source.read_bytes += count
+        stats.writes += 1
+        stats.write_bytes += count
+        return count
+
+    def os_copy_file_range(self, src, dst, *args):
+        return self._copy(_os_calls['copy_file_range'], src, dst, src, dst, *args)
+
+    def os_sendfile(self, out_fd, in_fd, *args):
+        return self._copy(_os_calls['sendfile'], in_fd, out_fd, out_fd, in_fd, *args)
+
+    def report(self):
+        'I/O accounting as a dictionary'
+        kinds = {}
+        for stats in self.files.values():
+            kinds.setdefault(stats.kind, FileStats(stats.kind)).add(stats)
+        io_end = proc_io()
+        return {
+            'tool': self.tool,
+            'wall_seconds': time.perf_counter() - self.wall_start,
+            'syscalls': {k: io_end[k] - self.io_start.get(k, 0) for k in io_end},
+            'kinds': {kind: stats.asdict() for kind, stats in kinds.items()},
+            'files': {name: stats.asdict() for name, stats in self.files.items()},
+        }
+
+    def stop(self):
+        'Stops profiling, writes the results, returns the I/O report'
+        global _active
+        self.profile.disable()
+        builtins.open = _open
+        for name, call in _os_calls.items():
+            setattr(os, name, call)
+        if _active is self:
+            _active = None
+        report = self.report()
+        self.profile.dump_stats(self.name)
+        with _open(self.name + '.io.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        print_summary(report, sys.stderr)
+        print('Profile written to {}'.format(self.name), file=sys.stderr)
+        return report
+
+
+def print_summary(report, out):
+    print('{} I/O in {:.3f}s'.format(report['tool'], report['wall_seconds']), file=out)
+    print('{:<6}{:>8}{:>8}{:>14}{:>8}{:>14}{:>8}{:>10}'.format(
+        'kind', 'opens', 'reads', 'bytes read', 'writes', 'bytes written', 'seeks', 'seconds'), file=out)
+    for kind, s in sorted(report['kinds'].items()):
+        print('{:<6}{:>8}{:>8}{:>14}{:>8}{:>14}{:>8}{:>10.3f}'.format(
+            kind, s['opens'], s['reads'], s['read_bytes'], s['writes'], s['write_bytes'],
+            s['seeks'], s['seconds']), file=out)
+    sc = report['syscalls']
+    if sc:
+        print('syscalls: {} read, {} write, storage bytes: {} read, {} written'.format(
+            sc.get('syscr', 0), sc.get('syscw', 0), sc.get('read_bytes', 0), sc.get('write_bytes', 0)),
+            file=out)
+
+
+def start(argv=None, tool=None):
+    '''Starts profiling if requested, returns the Profiler or None
+    The --profile flag is removed from argv, sys.argv by default.
+    Results are written when the process exits, or by calling stop()
+    '''
+    global _active
+    if argv is None:
+        argv = sys.argv
+    if tool is None:
+        tool = os.path.splitext(os.path.basename(argv[0] if argv else 'mrf'))[0]
+
+    name = os.environ.get(ENV) or None
+    for arg in list(argv[1:]):
+        if arg == FLAG or arg.startswith(FLAG + '='):
+            argv.remove(arg)
+            name = arg[len(FLAG) + 1:] or '1'
+    if name is None or _active is not None:
+        return _active
+    if name == '1':
+        name = '{}.{}.prof'.format(tool, os.getpid())
+
+    _active = Profiler(name, tool)
+    atexit.register(lambda p=_active: _active is p and p.stop())
+    return _active
@@ -34,266 +34,211 @@
 # NASA Jet Propulsion Laboratory
 # 2015
 
-from optparse import OptionParser
-from xml.dom import minidom
-import os
-import sys
-import struct
-import math
-
-versionNumber = '1.0'
-    
-#-------------------------------------------------------------------------------   
-
-print('mrf_read.py v' + versionNumber)
-
-usageText = 'mrf_read.py --input [mrf_file] --output [output_file] (--tilematrix INT --tilecol INT --tilerow INT) OR (--offset INT --size INT) OR (--tile INT)'
-
-# Define command line options and args.
-parser=OptionParser(usage=usageText, version=versionNumber)
-parser.add_option('-i', '--input',
-                  action='store', type='string', dest='input',
-                  help='Full path of the MRF data file')
-parser.add_option('-f', '--offset',
-                  action='store', type='int', dest='offset',
-                  help='data offset')
-parser.add_option("-l", "--little_endian", action="store_true", dest="endian", 
-                  default=False, help="Use little endian instead of big endian (default)")
-parser.add_option('-o', '--output',
-                  action='store', type='string', dest='output',
-                  help='Full path of output image file')
-parser.add_option('-s', '--size',
-                  action='store', type='int', dest='size',
-                  help='data size')
-parser.add_option('-t', '--tile',
-                  action='store', type='int', dest='tile',
-                  help='tile within index file')
-parser.add_option("-v", "--verbose", action="store_true", dest="verbose", 
-                  default=False, help="Verbose mode")
-parser.add_option('-w', '--tilematrix',
-                  action='store', type='int', dest='tilematrix',
-                  help='Tilematrix (zoom level) of tile')
-parser.add_option('-x', '--tilecol',
-                  action='store', type='int', dest='tilecol',
-                  help='The column of tile')
-parser.add_option('-y', '--tilerow',
-                  action='store', type='int', dest='tilerow',
-                  help='The row of tile')
-parser.add_option('-z', '--zlevel',
-                  action='store', type='int', dest='zlevel',
-                  help='the z-level of the data')
-
-
-# Read command line args.
-(options, args) = parser.parse_args()
-
-if not options.input:
-    parser.error('input filename not provided. --input must be specified.')
-else:
-    input = options.input
-if not options.output:
-    parser.error('output filename not provided. --output must be specified.')
-else:
-    output = options.output
-    
-mrfDoc = minidom.parse(input)
-mrf_x  = None
-mrf_y  = None
-mrf_z  = None
-mrf_type = "PNG"
-
-if len(mrfDoc.getElementsByTagName('Raster')) > 0:
-    rasterElem = mrfDoc.getElementsByTagName('Raster')[0]
-
-    if len(rasterElem.getElementsByTagName('Size')):
-        sizeElem  = rasterElem.getElementsByTagName('Size')[0]
-        sizeAttrs = dict(sizeElem.attributes.items())
-
-        mrf_x = float(sizeAttrs['x'])
-        mrf_y = float(sizeAttrs['y'])
-
-        if 'z' in sizeAttrs:
-            mrf_z = float(sizeAttrs['z'])
-
-    if len(rasterElem.getElementsByTagName('Compression')):
-        compressionElem = rasterElem.getElementsByTagName('Compression')[0]
-        mrf_type = str(compressionElem.firstChild.nodeValue).strip()
-
-        if mrf_type == "PBF":
-            mrf_type = "MVT"
-
-else:
-    print("\nMissing Raster element in MRF, exiting.")
-    exit(-1)
 
+'''Reads a tile from an MRF
 
-if options.verbose:
-    print("\nMRF type: " + mrf_type)
+ In-process use:
+   data = read_tile(mrf_file, level, row, col, z=None, band=0)
+ Level 0 is the full resolution, while the command line --tilematrix 0 is the
+ lowest resolution level.
+ The MRF can also be a tar file written by mrf_tar.py, tiles are read from the
+ index and data members directly, or an http(s) URL, read with Range requests.
+'''
 
-size = None
-
-if options.verbose:
-    print("MRF x: " + str(mrf_x) + " y: " + str(mrf_y))
-    print("Ratio " + str(mrf_x/mrf_y))
-    
-index = input.replace(".mrf",".idx")
-if mrf_type == "JPEG":
-    datafile = input.replace(".mrf",".pjg")
-elif mrf_type == "MVT":
-    datafile = input.replace(".mrf",".pvt")
-elif mrf_type == "JPNG":
-    datafile = input.replace(".mrf",".pjp")
-else:
-    datafile = input.replace(".mrf",".ppg")
-
-if not options.tile:
-    tile = None
-else:
-    tile = options.tile-1
-  
-if tile == None and str(options.tilematrix) == "None":    
-    if not options.offset:
-        parser.error('offset not provided. --offset must be specified.')
-    else:
-        offset = options.offset
-    if not options.size:
-        parser.error('size not provided. --size must be specified.')
-    else:
-        size = options.size
-    
-if options.endian == True:
-    data_type = '<q'
-else:
-    data_type = '>q'
-  
-if str(options.zlevel) == "None":
-    z = -1
-    z_size = None
-    if mrf_z:
-        print("Error: z-level must be specified for this input")
-        exit(1)
-else:
-    z = options.zlevel
-    z_size = mrf_z
-    if options.verbose:
-        print("Using z-level:" + str(z) + " and MRF z-size:" + str(z_size))
-    if z >= z_size:
-        print("Error: Specified z-level is greater than the maximum size")
-        exit(1)
-    
-w = int(math.ceil(float(mrf_x)/512))
-h = int(math.ceil(float(mrf_y)/512))
-if z >= 0:
-    len_base = w * h * z_size
-    low = z_size
-else:
-    len_base = w * h
-    low = 1
-idx_size = os.path.getsize(index)
-len_tiles = idx_size/16
-
-if options.verbose:
-    print("Number of tiles " + str(len_tiles))
-    print("\n--Pyramid structure--")
-
-levels = []
-rows = []
-cols = []
+import sys
+try:
+    from . import mrf_profile
+    from . import mrf_read_data
+    from . import mrf_source
+    from . import mrf_tar
+except ImportError:
+    import mrf_profile
+    import mrf_read_data
+    import mrf_source
+    import mrf_tar
 
-levels.append(0)
-rows.append(h)
-cols.append(w)
+versionNumber = '1.0'
 
-while len_base > low:
-    levels.append(len_base)
-    w = int(math.ceil(w / 2.0))
-    h = int(math.ceil(h / 2.0))
-    if z >= 0:
-        len_base = w * h * z_size
+#-------------------------------------------------------------------------------
+
+def mrf_info(mrf, index=None):
+    '''Reads the MRF metadata, returns a dictionary with the MRFMeta, the size,
+    z size, page size, compression, index and data file names and offsets.
+    index replaces the index file named in the metadata, such as a canned .ix index.
+    The offsets include the IndexFile and DataFile offsets of the metadata'''
+    if mrf_tar.is_tar(mrf) and not mrf_source.is_url(mrf):
+        meta, (index_offset, _), (data_offset, _) = mrf_tar.open_mrf(mrf)
+        index = data = mrf
+        index_offset += meta.indexoffset
+        data_offset += meta.dataoffset
     else:
-        len_base = w * h
-    rows.append(h)
-    cols.append(w)
-    
-if z >= 0:
-    levels.append(1*z_size)
-else:
-    levels.append(1)
+        meta = mrf_source.load_meta(mrf)
+        index_offset = 0 if index else meta.indexoffset
+        index, data = index or meta.indexfile, meta.datafile
+        data_offset = meta.dataoffset
+    return {
+        'meta': meta,
+        'x': meta.size.x,
+        'y': meta.size.y,
+        'z': meta.zsize,
+        'pagesize': meta.pagesize.x,
+        'type': "MVT" if meta.compression == "PBF" else meta.compression,
+        'index': index,
+        'index_offset': index_offset,
+        'data': data,
+        'data_offset': data_offset,
+        'records': meta.records,
+    }
+
+def tile_record(info, level, row, col, z=None, band=0):
+    '''Record number of a tile in the index, counting from 0'''
+    if z is None:
+        if info['z']:
+            raise ValueError("z-level must be specified for this input")
+        z = 0
+    elif z >= (info['z'] or 1):
+        raise ValueError("Specified z-level is greater than the maximum size")
+
+    meta = info['meta']
+    levels = meta.levels()
+    if level < 0 or level >= len(levels):
+        raise ValueError("Level " + str(level) + " is not in this MRF")
+    cols, rows = levels[level]
+    if row > rows - 1:
+        raise ValueError("Tile row exceeds the maximum (" + str(rows - 1) + ") for this level")
+    if col > cols - 1:
+        raise ValueError("Tile col exceeds the maximum (" + str(cols - 1) + ") for this level")
+    if band < 0 or band >= meta.bandpages:
+        raise ValueError("Band " + str(band) + " is not in this MRF")
+    return meta.record(level, row, col, z, band)
+
+def read_tile(mrf, level, row, col, z=None, little_endian=False, version=0, band=0):
+    '''Returns the content of a tile, level 0 is the full resolution
+    For versioned MRFs, version 0 is the current one, 1 is the oldest.
+    band is the band page, for band interleaved MRFs'''
+    info = mrf if isinstance(mrf, dict) else mrf_info(mrf)
+    tile = tile_record(info, level, row, col, z, band) + version * info['records']
+    offset, size = mrf_read_data.read_record(info['index'], tile, little_endian, info['index_offset'])
+    return mrf_read_data.read_data(info['data'], offset, size, info['data_offset'])
+
+def main():
+    from optparse import OptionParser
+
+    print('mrf_read.py v' + versionNumber)
+
+    usageText = 'mrf_read.py --input [mrf_file] --output [output_file] (--tilematrix INT --tilecol INT --tilerow INT) OR (--offset INT --size INT) OR (--tile INT)'
+
+    mrf_profile.start()
+
+    # Define command line options and args.
+    parser=OptionParser(usage=usageText, version=versionNumber)
+    parser.add_option('-i', '--input',
+                      action='store', type='string', dest='input',
+                      help='Full path or http(s) URL of the MRF metadata file, or an MRF tar file')
+    parser.add_option('-n', '--index',
+                      action='store', type='string', dest='index',
+                      help='Index file to use instead of the one in the metadata, such as a canned .ix index')
+    parser.add_option('-f', '--offset',
+                      action='store', type='int', dest='offset',
+                      help='data offset')
+    parser.add_option("-l", "--little_endian", action="store_true", dest="endian",
+                      default=False, help="Use little endian instead of big endian (default)")
+    parser.add_option('-o', '--output',
+                      action='store', type='string', dest='output',
+                      help='Full path of output image file')
+    parser.add_option('-s', '--size',
+                      action='store', type='int', dest='size',
+                      help='data size')
+    parser.add_option('-t', '--tile',
+                      action='store', type='int', dest='tile',
+                      help='tile within index file')
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                      default=False, help="Verbose mode")
+    parser.add_option('-V', '--index_version',
+                      action='store', type='int', dest='index_version', default=0,
+                      help='Version of a versioned MRF, 0 is the current one, 1 the oldest')
+    parser.add_option('-w', '--tilematrix',
+                      action='store', type='int', dest='tilematrix',
+                      help='Tilematrix (zoom level) of tile')
+    parser.add_option('-x', '--tilecol',
+                      action='store', type='int', dest='tilecol',
+                      help='The column of tile')
+    parser.add_option('-y', '--tilerow',
+                      action='store', type='int', dest='tilerow',
+                      help='The row of tile')
+    parser.add_option('-z', '--zlevel',
+                      action='store', type='int', dest='zlevel',
+                      help='the z-level of the data')
+
+    # Read command line args.
+    (options, args) = parser.parse_args()
+
+    if not options.input:
+        parser.error('input filename not provided. --input must be specified.')
+    if not options.output:
+        parser.error('output filename not provided. --output must be specified.')
+
+    try:
+        info = mrf_info(options.input, options.index)
+    except ValueError as e:
+        print("\n" + str(e) + ", exiting.")
+        sys.exit(-1)
 
-if options.verbose:   
-    for idx, val in enumerate(levels):
-        if idx > 0: 
-            print("Level " + str(len(levels)-idx-1) + ": " + str(levels[idx]) + " tiles, " + str(rows[idx-1]) + " rows, " + str(cols[idx-1]) + " columns")
-    print("\n")
-
-if options.tilematrix != None:
-    if options.tilerow == None or options.tilecol == None:
-        parser.error('tilerow and tilecol not provided. --tilecol INT and --tilerow INT must be specified when using MRF file.')
-    tilematrix = options.tilematrix + 2
-    level = levels[len(levels)-tilematrix]
-    row = rows[len(levels)-tilematrix]
-    col = cols[len(levels)-tilematrix]
-    
-    if options.verbose:
-        message = "Looking up tilematrix level:" + str(options.tilematrix) + ", tile row:" + str(options.tilerow) + ", tile col:" + str(options.tilecol)
-        if z >= 0:
-            message = message + ", z-level:" + str(z)
-        print(message)
-        print("Level contains " + str(row) + " rows, " + str(col) + " columns")
-    
-    if (options.tilerow) > row-1:
-        print("Tile row exceeds the maximum (" + str(row-1) + ") for this level")
-        exit(1)
-    if (options.tilecol) > col-1:
-        print("Tile col exceeds the maximum (" + str(col-1) + ") for this level")
-        exit(1)
-      
-    level_start = 0
-    for idx, val in enumerate(levels):
-        if levels[idx-1]==level:
-            break
-        level_start+=val
-    tile = ((options.tilerow) * col) + options.tilecol + level_start
-    if z >= 0:
-        level_size = (levels[len(levels)-tilematrix+1]/z_size)
-        tile = tile + (z * level_size) 
-    
     if options.verbose:
-        print("Tiles for level begin at: " + str(level_start+1))
-        print("Using tile: " + str(tile+1))
-    
-if index != None and tile != None:
-    if options.verbose:
-        print("\nReading " + index)
-    idx = open(index, 'rb')
-    
-    idx.seek(16*tile)
-    byte = idx.read(16)
-    offset = struct.unpack(data_type, byte[0:8])[0]
-    size = struct.unpack(data_type, byte[8:16])[0]
-    idx.close() 
-    
-    if options.verbose: 
-        print("Read from index at offset " + str(16*tile) + " for 16 bytes")
-        print("Got data file offset " + str(offset) + ", size " + str(size))
-   
+        print("\nMRF type: " + info['type'])
+        print("MRF x: " + str(info['x']) + " y: " + str(info['y']))
+        print("Ratio " + str(float(info['x']) / info['y']))
 
-if options.verbose:
-    print("\nReading " + datafile)   
+    if options.zlevel is None and info['z']:
+        print("Error: z-level must be specified for this input")
+        sys.exit(1)
+
+    tile = options.tile - 1 if options.tile else None
+    offset = size = None
+    if tile is None and options.tilematrix is None:
+        if not options.offset:
+            parser.error('offset not provided. --offset must be specified.')
+        if not options.size:
+            parser.error('size not provided. --size must be specified.')
+        offset, size = options.offset, options.size
+
+    try:
+        if options.tilematrix is not None:
+            if options.tilerow is None or options.tilecol is None:
+                parser.error('tilerow and tilecol not provided. --tilecol INT and --tilerow INT must be specified when using MRF file.')
+            levels = info['meta'].levels()
+            if options.verbose:
+                print("\n--Pyramid structure--")
+                for level, (cols, rows) in reversed(list(enumerate(levels))):
+                    print("Level " + str(len(levels) - level - 1) + ": " + str(cols * rows * (info['z'] or 1))
+                          + " tiles, " + str(rows) + " rows, " + str(cols) + " columns")
+                print("\n")
+            # Tilematrix 0 is the lowest resolution
+            level = len(levels) - 1 - options.tilematrix
+            tile = tile_record(info, level, options.tilerow, options.tilecol, options.zlevel)
+            tile += options.index_version * info['records']
+            if options.verbose:
+                print("Using tile: " + str(tile + 1))
+
+        if tile is not None:
+            if options.verbose:
+                print("\nReading " + info['index'])
+            offset, size = mrf_read_data.read_record(info['index'], tile, options.endian, info['index_offset'])
+            if options.verbose:
+                print("Read from index at offset " + str(info['index_offset'] + 16*tile) + " for 16 bytes")
+                print("Got data file offset " + str(offset) + ", size " + str(size))
+    except ValueError as e:
+        print("Error: " + str(e))
+        sys.exit(1)
 
-if size != None and offset !=None:
     if options.verbose:
+        print("\nReading " + info['data'])
         print("Read from data file at offset " + str(offset) + " for " + str(size) + " bytes")
-        
-    out = open(output, 'wb')
-    mrf_data = open(datafile, 'rb')
-    mrf_data.seek(offset)
-    image = mrf_data.read(size)
-    out.write(image)
-    
-    print("Wrote " + output)
-    mrf_data.close()
-    out.close()  
-else:
-    print("Error: Tile could not be located")
-    exit(1)
+
+    image = mrf_read_data.read_data(info['data'], offset, size, info['data_offset'])
+    with open(options.output, 'wb') as out:
+        out.write(image)
+    print("Wrote " + options.output)
+
+if __name__ == '__main__':
+    main()
@@ -34,104 +34,123 @@
 # NASA Jet Propulsion Laboratory
 # 2015
 
-from optparse import OptionParser
-import os
-import sys
+
+'''Reads a tile from an MRF data file, by offset and size or by index record
+
+ In-process use:
+   offset, size = read_record(index_file, tile)  # tile counts from 0
+   data = read_data(data_file, offset, size)
+ For an MRF packed in a tar file by mrf_tar.py, pass the offsets of the index
+ and data members as base, or use --input with the .mrf.tar file.
+ The files can also be http(s) URLs, index files with the .ix extension are
+ read as canned indexes.
+'''
+
 import struct
+try:
+    from . import mrf_profile
+    from . import mrf_source
+    from . import mrf_tar
+except ImportError:
+    import mrf_profile
+    import mrf_source
+    import mrf_tar
 
 versionNumber = '2.4.0'
-    
-#-------------------------------------------------------------------------------   
-
-print('mrf_read_data.py v' + versionNumber)
-
-usageText = 'mrf_read_data.py --input [mrf_data_file] --output [output_file] (--offset INT --size INT) OR (--index [index_file] --tile INT)'
-
-# Define command line options and args.
-parser=OptionParser(usage=usageText, version=versionNumber)
-parser.add_option('-i', '--input',
-                  action='store', type='string', dest='input',
-                  help='Full path of the MRF data file')
-parser.add_option('-f', '--offset',
-                  action='store', type='int', dest='offset',
-                  help='data offset')
-parser.add_option("-l", "--little_endian", action="store_true", dest="endian", 
-                  default=False, help="Use little endian instead of big endian (default)")
-parser.add_option('-n', '--index',
-                  action='store', type='string', dest='index',
-                  help='Full path of the MRF index file')
-parser.add_option('-o', '--output',
-                  action='store', type='string', dest='output',
-                  help='Full path of output image file')
-parser.add_option('-s', '--size',
-                  action='store', type='int', dest='size',
-                  help='data size')
-parser.add_option('-t', '--tile',
-                  action='store', type='int', dest='tile',
-                  help='tile within index file')
-parser.add_option("-v", "--verbose", action="store_true", dest="verbose", 
-                  default=False, help="Verbose mode")
-
-
-# Read command line args.
-(options, args) = parser.parse_args()
-
-if not options.input:
-    parser.error('input filename not provided. --input must be specified.')
-else:
-    input = options.input
-if not options.output:
-    parser.error('output filename not provided. --output must be specified.')
-else:
-    output = options.output
-
-if options.index:
-    index = options.index
-    if not options.tile:
-        parser.error('tile number not provided. --tile must be specified when using index file.')
-    else:
-        tile = options.tile-1
-else:
-    index=None
-    
-if index == None:    
-    if not options.offset:
-        parser.error('offset not provided. --offset must be specified.')
-    else:
-        offset = options.offset
-    if not options.size:
-        parser.error('size not provided. --size must be specified.')
-    else:
-        size = options.size
-    
-if options.endian == True:
-    data_type = '<q'
-else:
-    data_type = '>q'
-    
-if index != None:
-    if options.verbose:
-        print("Reading " + index)
-    idx = open(index, 'rb')
-    
-    idx.seek(16*tile)
-    byte = idx.read(16)
+
+#-------------------------------------------------------------------------------
+
+def read_record(index, tile, little_endian=False, base=0):
+    '''Returns the (offset, size) index record of a tile, counting from 0.
+    The index starts at base bytes in the file'''
+    data_type = '<q' if little_endian else '>q'
+    with mrf_source.open_source(index, base) as idx:
+        byte = idx.read(16 * tile, 16)
+    if len(byte) != 16:
+        raise ValueError("Tile " + str(tile + 1) + " is past the end of " + index)
     offset = struct.unpack(data_type, byte[0:8])[0]
     size = struct.unpack(data_type, byte[8:16])[0]
-    idx.close() 
-    
-    if options.verbose: 
-        print("Read from index at offset " + str(16*tile) + " for 16 bytes")
-        print("Got data file offset " + str(offset) + ", size " + str(size))
-   
-   
-out = open(output, 'wb')
-mrf_data = open(input, 'rb')
-
-mrf_data.seek(offset)
-image = mrf_data.read(size)
-out.write(image)
-
-print("Wrote " + output)
-mrf_data.close()
-out.close()  
+    return offset, size
+
+def read_data(datafile, offset, size, base=0):
+    '''Returns size bytes from offset in the data file, which starts at base bytes'''
+    with mrf_source.open_source(datafile, base) as mrf_data:
+        return mrf_data.read(offset, size)
+
+def main():
+    from optparse import OptionParser
+
+    print('mrf_read_data.py v' + versionNumber)
+
+    usageText = 'mrf_read_data.py --input [mrf_data_file] --output [output_file] (--offset INT --size INT) OR (--index [index_file] --tile INT)'
+
+    mrf_profile.start()
+
+    # Define command line options and args.
+    parser=OptionParser(usage=usageText, version=versionNumber)
+    parser.add_option('-i', '--input',
+                      action='store', type='string', dest='input',
+                      help='Full path of the MRF data file, or of an MRF tar file')
+    parser.add_option('-f', '--offset',
+                      action='store', type='int', dest='offset',
+                      help='data offset')
+    parser.add_option("-l", "--little_endian", action="store_true", dest="endian",
+                      default=False, help="Use little endian instead of big endian (default)")
+    parser.add_option('-n', '--index',
+                      action='store', type='string', dest='index',
+                      help='Full path of the MRF index file')
+    parser.add_option('-o', '--output',
+                      action='store', type='string', dest='output',
+                      help='Full path of output image file')
+    parser.add_option('-s', '--size',
+                      action='store', type='int', dest='size',
+                      help='data size')
+    parser.add_option('-t', '--tile',
+                      action='store', type='int', dest='tile',
+                      help='tile within index file')
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                      default=False, help="Verbose mode")
+
+    # Read command line args.
+    (options, args) = parser.parse_args()
+
+    if not options.input:
+        parser.error('input filename not provided. --input must be specified.')
+    if not options.output:
+        parser.error('output filename not provided. --output must be specified.')
+
+    index_base = data_base = 0
+    if mrf_tar.is_tar(options.input) and not mrf_source.is_url(options.input):
+        # Index and data are members of the tar, the index defaults to the one in the tar
+        meta, (index_base, _), (data_base, _) = mrf_tar.open_mrf(options.input)
+        index_base += meta.indexoffset
+        data_base += meta.dataoffset
+        if options.index:
+            index_base = 0
+        elif options.tile:
+            options.index = options.input
+
+    if options.index:
+        if not options.tile:
+            parser.error('tile number not provided. --tile must be specified when using index file.')
+        tile = options.tile - 1
+        if options.verbose:
+            print("Reading " + options.index)
+        offset, size = read_record(options.index, tile, options.endian, index_base)
+        if options.verbose:
+            print("Read from index at offset " + str(16*tile) + " for 16 bytes")
+            print("Got data file offset " + str(offset) + ", size " + str(size))
+    else:
+        if not options.offset:
+            parser.error('offset not provided. --offset must be specified.')
+        if not options.size:
+            parser.error('size not provided. --size must be specified.')
+        offset, size = options.offset, options.size
+
+    image = read_data(options.input, offset, size, data_base)
+    with open(options.output, 'wb') as out:
+        out.write(image)
+    print("Wrote " + options.output)
+
+if __name__ == '__main__':
+    main()
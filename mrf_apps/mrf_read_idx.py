@@ -34,69 +34,78 @@
 # NASA Jet Propulsion Laboratory
 # 2015
 
-from optparse import OptionParser
-import os
-import sys
+
+'''Lists the records of an MRF index file
+
+ In-process use:
+   for idx_offset, offset, size in read_index(index_file):
+'''
+
 import struct
+try:
+    from . import mrf_profile
+except ImportError:
+    import mrf_profile
 
 versionNumber = '2.4.0'
-    
-#-------------------------------------------------------------------------------   
-
-print('mrf_read_idx.py v' + versionNumber)
-
-usageText = 'mrf_read_idx.py --index [index_file] --output [output_file]'
-
-# Define command line options and args.
-parser=OptionParser(usage=usageText, version=versionNumber)
-parser.add_option('-i', '--index',
-                  action='store', type='string', dest='index',
-                  help='Full path of the MRF index file')
-parser.add_option("-l", "--little_endian", action="store_true", dest="endian", 
-                  default=False, help="Use little endian instead of big endian (default)")
-parser.add_option('-o', '--output',
-                  action='store', type='string', dest='output',
-                  help='Full path of output CSV file')
-parser.add_option("-v", "--verbose", action="store_true", dest="verbose", 
-                  default=False, help="Verbose mode")
-
-
-# Read command line args.
-(options, args) = parser.parse_args()
-
-if not options.index:
-    parser.error('index filename not provided. --index must be specified.')
-else:
-    index = options.index
-if not options.output:
-    parser.error('output filename not provided. --output must be specified.')
-else:
-    output = options.output
-    
-if options.endian == True:
-    data_type = '<q'
-else:
-    data_type = '>q'
-   
-out = open(output, 'w')
-idx = open(index, 'rb')
-
-out.write("idx_offset,data_offset,data_size\n")
-
-i = 0
-while i <  os.path.getsize(index):
-    idx.seek(i)
-    byte = idx.read(16)
-    offset = struct.unpack(data_type, byte[0:8])[0]
-    size = struct.unpack(data_type, byte[8:16])[0]
-    if options.verbose:
-        print(str(i) + "," + str(offset) + "," + str(size))
-    out.write(str(i) + "," + str(offset) + "," + str(size)+"\n")
-    i+=16
-    
-print(str(i) + " bytes read")
-print("Wrote " + output)
-idx.close()
-out.close()
-    
-    
+
+#-------------------------------------------------------------------------------
+
+def read_index(index, little_endian=False, chunk=1024 * 1024):
+    '''Generates the (index offset, data offset, size) of every record in the index file'''
+    record = struct.Struct('<qq' if little_endian else '>qq')
+    i = 0
+    with open(index, 'rb') as idx:
+        for buffer in iter(lambda: idx.read(chunk), b""):
+            for offset, size in record.iter_unpack(buffer[:len(buffer) - len(buffer) % 16]):
+                yield i, offset, size
+                i += 16
+
+def write_csv(index, output, little_endian=False, verbose=False):
+    '''Writes the index records to a CSV file, returns the number of bytes read'''
+    nbytes = 0
+    with open(output, 'w') as out:
+        out.write("idx_offset,data_offset,data_size\n")
+        for i, offset, size in read_index(index, little_endian):
+            if verbose:
+                print(str(i) + "," + str(offset) + "," + str(size))
+            out.write(str(i) + "," + str(offset) + "," + str(size)+"\n")
+            nbytes = i + 16
+    return nbytes
+
+def main():
+    from optparse import OptionParser
+
+    print('mrf_read_idx.py v' + versionNumber)
+
+    usageText = 'mrf_read_idx.py --index [index_file] --output [output_file]'
+
+    mrf_profile.start()
+
+    # Define command line options and args.
+    parser=OptionParser(usage=usageText, version=versionNumber)
+    parser.add_option('-i', '--index',
+                      action='store', type='string', dest='index',
+                      help='Full path of the MRF index file')
+    parser.add_option("-l", "--little_endian", action="store_true", dest="endian",
+                      default=False, help="Use little endian instead of big endian (default)")
+    parser.add_option('-o', '--output',
+                      action='store', type='string', dest='output',
+                      help='Full path of output CSV file')
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                      default=False, help="Verbose mode")
+
+    # Read command line args.
+    (options, args) = parser.parse_args()
+
+    if not options.index:
+        parser.error('index filename not provided. --index must be specified.')
+    if not options.output:
+        parser.error('output filename not provided. --output must be specified.')
+
+    nbytes = write_csv(options.index, options.output, options.endian, options.verbose)
+    print(str(nbytes) + " bytes read")
+    print("Wrote " + options.output)
+
+if __name__ == '__main__':
+    main()
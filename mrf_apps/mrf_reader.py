@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_reader
+# Purpose:
+
+'''Tile reader for long running processes, with memory caches
+
+ An MRFReader keeps the index and data files open, and keeps the recently used
+ index blocks and tiles in memory, each in a least recently used cache bounded
+ by the total size in bytes. Tiles are cached by their (offset, size) index
+ record, so tiles shared by several records are stored once.
+ The caches count hits, misses and evictions. A reader can be used from
+ multiple threads. The files are assumed not to change while the reader is
+ open, call clear() after they do.
+
+ In-process use:
+   with MRFReader(mrf_file) as reader:
+       data = reader.read(level, row, col)
+       print(reader.stats())
+ The MRF can also be a tar file written by mrf_tar.py, or an http(s) URL,
+ read with Range requests. The index can be replaced by a canned .ix index.
+
+ Many tiles can be fetched at once, with reads of neighboring tiles merged
+ into larger ones, issued from a thread pool:
+   views = await reader.fetch_many([(level, row, col), ...])
+   views = reader.read_many([(level, row, col), ...])
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import struct
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from . import mrf_source
+    from . import mrf_zdrill
+except ImportError:
+    import mrf_source
+    import mrf_zdrill
+
+# Index block size, a multiple of the 16 byte record size
+BLOCK = 4096
+# Default cache sizes, in bytes
+INDEX_CACHE = 16 * 1024 * 1024
+TILE_CACHE = 256 * 1024 * 1024
+# Default number of threads for batch reads
+WORKERS = 8
+# Largest space between tiles read together, in bytes
+GAP = mrf_zdrill.GAP
+
+RECORD = struct.Struct('>QQ')
+
+class LRUCache(object):
+    '''Least recently used cache of bytes-like values, bounded by their total size.
+    Safe to use from multiple threads'''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        'Returns the value, or None if it is not in the cache'
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        'Adds a value, values larger than the cache are not kept'
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._items[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last = False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class MRFReader(object):
+    '''Reads tiles from an MRF, with caches for index blocks and tiles.
+    block_size is the index block size, a multiple of 16 bytes.
+    workers is the number of threads used by fetch_many and read_many.
+    index replaces the index file named in the metadata, such as a canned index'''
+
+    def __init__(self, mrf, index_cache = INDEX_CACHE, tile_cache = TILE_CACHE, block_size = BLOCK,
+                 workers = WORKERS, index = None):
+        if block_size <= 0 or block_size % 16:
+            raise ValueError("Index block size has to be a multiple of 16")
+        self.name = mrf
+        self.block_size = block_size
+        self.meta, self.index, self.data = mrf_source.open_mrf(mrf, index)
+        self.index_cache = LRUCache(index_cache)
+        self.tile_cache = LRUCache(tile_cache)
+        self.workers = workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.index.close()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def clear(self):
+        'Drops the cached index blocks and tiles'
+        self.index_cache.clear()
+        self.tile_cache.clear()
+
+    def tile_record(self, level, row, col, z = 0, band = 0, version = 0):
+        '''Record number of a tile, level 0 is the full resolution.
+        For versioned MRFs, version 0 is the current one, 1 is the oldest'''
+        cols, rows = self.meta.levels()[level]
+        if not (0 <= row < rows and 0 <= col < cols):
+            raise ValueError("Tile {},{} is outside of level {}".format(row, col, level))
+        return self.meta.record(level, row, col, z, band) + version * self.meta.records
+
+    def index_block(self, block):
+        'Content of an index block, the last one is padded with zeros'
+        data = self.index_cache.get(block)
+        if data is None:
+            data = self.index.read(block * self.block_size, self.block_size).ljust(self.block_size, b'\0')
+            self.index_cache.put(block, data)
+        return data
+
+    def record(self, number):
+        'The (offset, size) index record, records past the end of the index are empty'
+        block, position = divmod(16 * number, self.block_size)
+        return RECORD.unpack_from(self.index_block(block), position)
+
+    def read_record(self, number):
+        'Content of the tile for an index record, b"" if it is empty'
+        offset, size = self.record(number)
+        if size == 0:
+            return b''
+        key = (offset, size)
+        data = self.tile_cache.get(key)
+        if data is None:
+            data = self.data.read(offset, size)
+            if len(data) != size:
+                raise ValueError("Tile at {} size {} is past the end of the data file".format(offset, size))
+            self.tile_cache.put(key, data)
+        return data
+
+    def read(self, level, row, col, z = 0, band = 0, version = 0):
+        'Content of a tile, b"" if it is empty'
+        return self.read_record(self.tile_record(level, row, col, z, band, version))
+
+    def stats(self):
+        'Counters of the index block and tile caches'
+        return {'index': self.index_cache.stats(), 'tiles': self.tile_cache.stats()}
+
+    def executor(self):
+        'Thread pool for batch reads, started on first use'
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix = "mrf_reader")
+            return self._executor
+
+    def plan(self, keys, gap = GAP):
+        '''Index records of the tiles and the data file ranges to read them, as
+        ([(offset, size)], [[start, end, [indices]]]). Keys are (level, row, col)
+        tuples, optionally followed by z, band and version.
+        Ranges are merged when the space between them is at most gap bytes'''
+        records = [self.record(self.tile_record(*key)) for key in keys]
+        return records, mrf_zdrill.coalesce(records, gap)
+
+    def read_range(self, start, end):
+        'Reads a range of the data file into a new buffer'
+        buffer = bytearray(end - start)
+        view = memoryview(buffer)
+        done = 0
+        while done < len(buffer):
+            count = self.data.readinto(view[done:], start + done)
+            if count == 0:
+                raise ValueError("Range {} to {} is past the end of the data file".format(start, end))
+            done += count
+        return view
+
+    @staticmethod
+    def slices(records, ranges, buffers):
+        'Tile views into the range buffers, empty tiles are empty views'
+        tiles = [memoryview(b'')] * len(records)
+        for (start, _, members), buffer in zip(ranges, buffers):
+            for i in members:
+                offset, size = records[i]
+                tiles[i] = buffer[offset - start: offset - start + size]
+        return tiles
+
+    async def fetch_many(self, keys, gap = GAP):
+        '''Fetches many tiles concurrently, returns a list of memoryviews in key order.
+        The index lookups and the coalesced data reads run in the thread pool.
+        The views share the range buffers, the tile cache is not used'''
+        loop = asyncio.get_running_loop()
+        records, ranges = await loop.run_in_executor(self.executor(), self.plan, list(keys), gap)
+        buffers = await asyncio.gather(*(loop.run_in_executor(self.executor(), self.read_range, start, end)
+                                         for start, end, _ in ranges))
+        return self.slices(records, ranges, buffers)
+
+    def read_many(self, keys, gap = GAP):
+        'Blocking form of fetch_many'
+        records, ranges = self.plan(list(keys), gap)
+        buffers = list(self.executor().map(lambda r: self.read_range(r[0], r[1]), ranges))
+        return self.slices(records, ranges, buffers)
@@ -37,6 +37,14 @@
 import xml.etree.ElementTree as XML
 import sys
 import os.path as path
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+    from .mrf_meta import PointXYZC, BBOX
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+    from mrf_meta import PointXYZC, BBOX
 
 def usage():
     print('Takes one argument, a MRF file name, ' + \
@@ -58,54 +66,9 @@ def XMLprettify(elem, level=0):
         if level and (not elem.tail or not elem.tail.strip()):
             elem.tail = i
 
-def attr(node, key, default):
-    return default if node is None or node.get(key) is None else node.get(key)
-
-class PointXYZC(object):
-    def __init__(self, node, defaults = (-1, -1, 1, 1)):
-        key = 'x','y','z','c'
-        self.x, self.y, self.z, self.c = (
-            int(attr(node, key[i], defaults[i])) for i in range(4))
-
-    def __str__(self):
-        f = "PointXYZC ({p.x}, {p.y}, {p.z}, {p.c})"
-        return f.format(p = self)
-
-class BBOX(object):
-    def __init__(self, node, defaults):
-        key = 'minx', 'miny', 'maxx', 'maxy'
-        self.minx, self.miny, self.maxx, self.maxy = (
-            float(attr(node, key[i], defaults[i])) for i in range(4))
-
-    def __str__(self):
-        f = "BBOX ({p.minx}, {p.miny}, {p.maxx}, {p.maxy})"
-        return f.format(p = self)
-
-class MRF(object):
+def MRF(name):
     'MRF metadata reader'
-    def __init__(self, name):
-        try:
-            root = XML.parse(name).getroot()
-        except:
-            raise "Can't parse " + name
-
-        if root.tag != 'MRF_META':
-            raise name + ' is not an MRF metadata file'
-
-        self.name = name
-        #Get the basic raster info
-        self.size = PointXYZC(root.find('Raster/Size'))
-        self.pagesize = PointXYZC(root.find('Raster/PageSize'),
-            (512, 512, 1, self.size.c))
-        self.projection = root.find('GeoTags/Projection').text
-        self.bbox = BBOX(root.find('GeoTags/BoundingBox'),
-            (0, 0, self.size.x, self.size.y))
-
-    def geotransform(self):
-        'gdal style affine geotransform as a list'
-        return [
-            self.bbox.minx, (self.bbox.maxx - self.bbox.minx)/self.size.x, 0,
-            self.bbox.maxy, 0, (self.bbox.miny - self.bbox.maxy)/self.size.y]
+    return mrf_meta.load(name)
 
 def VRT_Size(mrf):
     'Builds and returns a gdal VRT XML tree'
@@ -128,7 +91,7 @@ def VRT_Size(mrf):
             'dataType':'UInt32',
             'subClass':'VRTRawRasterBand'
             })
-        idxname = path.splitext(path.basename(mrf.name))[0] + '.idx'
+        idxname = path.relpath(mrf.indexfile, path.dirname(mrf.name) or '.')
         XML.SubElement(xband,'SourceFilename', { 'relativetoVRT':"1" }).text =\
             idxname
         XML.SubElement(xband,'ImageOffset').text = str(12 + 16 * band)
@@ -140,6 +103,7 @@ def VRT_Size(mrf):
     return XML.ElementTree(root)
 
 def main():
+    mrf_profile.start()
     if (len(sys.argv) != 2):
         usage()
         return
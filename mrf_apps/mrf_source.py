@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_source
+# Purpose:
+
+'''Byte sources for the MRF files read by the python tools
+
+ A source reads byte ranges from a local file or from an http(s) URL, using
+ Range requests, such as an MRF on S3 compatible object storage. Index files
+ in the canned format written by can, with the .ix extension, are read as if
+ they were the original index, only the index blocks holding data are read.
+
+ In-process use:
+   with open_source(name) as source:
+       data = source.read(offset, size)
+   meta, index, data = open_mrf(mrf_file_or_url)
+ Reads past the end of a source return fewer bytes, like os.pread.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import queue
+import struct
+import threading
+import http.client
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit
+try:
+    from . import mrf_meta
+    from . import mrf_tar
+except ImportError:
+    import mrf_meta
+    import mrf_tar
+
+# Reads straight into the buffers where possible
+PREADV = hasattr(os, 'preadv')
+# Idle HTTP connections kept for reuse, per source
+CONNECTIONS = 8
+TIMEOUT = 60
+
+# Canned index, see can.cpp
+CANNED_EXT = '.ix'
+CANNED_SIG = b'IDX\0'
+CANNED_BLOCK = 512
+# Index blocks per bitmap line
+LINE_BLOCKS = 96
+# Bitmap lines read at once
+LINE_CHUNK = 256
+LINE = struct.Struct('>4I')
+
+def is_url(name):
+    return name.startswith(('http://', 'https://'))
+
+class Source(object):
+    'Base of the byte sources'
+
+    def read(self, offset, size):
+        raise NotImplementedError
+
+    def readinto(self, view, offset):
+        'Reads into a writable memoryview, returns the number of bytes read'
+        data = self.read(offset, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class FileSource(Source):
+    '''Local file, or a part of one starting at base.
+    Reads are limited to size bytes when it is given'''
+
+    def __init__(self, name, base = 0, size = None):
+        self.name = name
+        self.base = base
+        self.limit = size
+        self.fd = os.open(name, os.O_RDONLY)
+
+    @property
+    def size(self):
+        if self.limit is not None:
+            return self.limit
+        return os.fstat(self.fd).st_size - self.base
+
+    def clip(self, offset, size):
+        if self.limit is None:
+            return size
+        return max(0, min(size, self.limit - offset))
+
+    def read(self, offset, size):
+        return os.pread(self.fd, self.clip(offset, size), self.base + offset)
+
+    def readinto(self, view, offset):
+        size = self.clip(offset, len(view))
+        if not PREADV:
+            return super().readinto(view[:size], offset)
+        return os.preadv(self.fd, [view[:size]], self.base + offset)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class HTTPSource(Source):
+    '''File on an http or https server which supports Range requests.
+    Connections are kept open and reused, up to connections idle ones.
+    Safe to use from multiple threads'''
+
+    def __init__(self, url, base = 0, size = None, connections = CONNECTIONS, timeout = TIMEOUT):
+        self.name = url
+        self.base = base
+        self.limit = size
+        self.timeout = timeout
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("Not an http or https URL: " + url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        self.requests = 0
+        self.opened = 0
+        self._idle = queue.LifoQueue(connections)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        'An idle connection, or a new one. Returns (connection, reused)'
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            pass
+        with self._lock:
+            self.opened += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout = self.timeout), False
+        return http.client.HTTPConnection(self.host, self.port, timeout = self.timeout), False
+
+    def release(self, conn, response):
+        'Keeps the connection for reuse, once the response is read'
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, headers, handler):
+        '''Issues a request and returns handler(response), which has to read the body.
+        A reused connection closed by the server is retried once with a new one'''
+        while True:
+            conn, reused = self.connect()
+            with self._lock:
+                self.requests += 1
+            try:
+                conn.request(method, self.path, headers = headers)
+                response = conn.getresponse()
+                result = handler(response)
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            if isinstance(result, Exception):
+                # The body may not have been read
+                conn.close()
+                raise result
+            self.release(conn, response)
+            return result
+
+    def error(self, response):
+        response.read()
+        return OSError("HTTP {} {} for {}".format(response.status, response.reason, self.name))
+
+    @property
+    def size(self):
+        if self.limit is None:
+            def handler(response):
+                response.read()
+                if response.status != 200:
+                    return self.error(response)
+                return int(response.getheader('Content-Length')) - self.base
+            self.limit = self.request('HEAD', {}, handler)
+        return self.limit
+
+    def content(self):
+        'The whole file'
+        def handler(response):
+            if response.status != 200:
+                return self.error(response)
+            return response.read()
+        return self.request('GET', {}, handler)[self.base:]
+
+    def fetch(self, offset, size, view):
+        'Range request for size bytes at offset, into view when it is not None'
+        if self.limit is not None:
+            size = max(0, min(size, self.limit - offset))
+        if size == 0:
+            return 0 if view is not None else b''
+        start = self.base + offset
+        def handler(response):
+            if response.status == 416:
+                response.read()
+                return b''
+            if response.status == 200:
+                # The whole file is being sent, for every read
+                return OSError("{} does not support Range requests".format(self.name))
+            if response.status != 206:
+                return self.error(response)
+            if view is None:
+                return response.read()
+            done = 0
+            while done < size:
+                count = response.readinto(view[done:size])
+                if count == 0:
+                    break
+                done += count
+            response.read()
+            return done
+        headers = {'Range': 'bytes={}-{}'.format(start, start + size - 1)}
+        result = self.request('GET', headers, handler)
+        if view is not None and not isinstance(result, int):
+            view[:len(result)] = result
+            return len(result)
+        return result
+
+    def read(self, offset, size):
+        return self.fetch(offset, size, None)
+
+    def readinto(self, view, offset):
+        return self.fetch(offset, len(view), view)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class CannedSource(Source):
+    '''Original index read from a canned index source.
+    The bitmap lines are read when first needed and kept'''
+
+    def __init__(self, source):
+        self.source = source
+        header = source.read(0, 16)
+        if len(header) != 16 or header[:4] != CANNED_SIG:
+            raise ValueError(source.name + " is not a canned index")
+        lines, self.size = struct.unpack('>IQ', header[4:])
+        self.header_size = 16 * lines
+        if lines != 1 + -(-self.size // (LINE_BLOCKS * CANNED_BLOCK)):
+            raise ValueError(source.name + " has a corrupt header")
+        self.name = source.name
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def line(self, number):
+        'Bitmap line of an index block group, as (count, bits)'
+        chunk = number // LINE_CHUNK
+        lines = self._chunks.get(chunk)
+        if lines is None:
+            start = 16 * (1 + chunk * LINE_CHUNK)
+            raw = self.source.read(start, min(16 * LINE_CHUNK, self.header_size - start))
+            # Empty lines before the first block with data hold a marker instead
+            # of the count, which is not used since they have no bits set
+            lines = []
+            for i in range(0, len(raw), 16):
+                count, b0, b1, b2 = LINE.unpack_from(raw, i)
+                lines.append((count, b0 | b1 << 32 | b2 << 64))
+            with self._lock:
+                self._chunks[chunk] = lines
+        return lines[number % LINE_CHUNK]
+
+    def location(self, block):
+        'Offset of an index block in the canned index, None if the block is empty'
+        count, bits = self.line(block // LINE_BLOCKS)
+        bit = block % LINE_BLOCKS
+        if not bits >> bit & 1:
+            return None
+        return self.header_size + CANNED_BLOCK * (count + bin(bits & ((1 << bit) - 1)).count('1'))
+
+    def read(self, offset, size):
+        size = max(0, min(size, self.size - offset))
+        result = bytearray(size)
+        if size == 0:
+            return bytes(result)
+        # Runs of consecutive blocks which are also consecutive in the canned index
+        runs = []
+        for block in range(offset // CANNED_BLOCK, (offset + size - 1) // CANNED_BLOCK + 1):
+            location = self.location(block)
+            if location is None:
+                continue
+            if runs and runs[-1][2] == block and runs[-1][1] + CANNED_BLOCK * (block - runs[-1][0]) == location:
+                runs[-1][2] = block + 1
+            else:
+                runs.append([block, location, block + 1])
+        for first, location, end in runs:
+            start = max(offset, first * CANNED_BLOCK)
+            stop = min(offset + size, end * CANNED_BLOCK)
+            data = self.source.read(location + start - first * CANNED_BLOCK, stop - start)
+            result[start - offset: start - offset + len(data)] = data
+        return bytes(result)
+
+    def close(self):
+        self.source.close()
+
+def open_source(name, base = 0, size = None, canned = None):
+    '''Source for a local file name or an http(s) URL, for size bytes from base.
+    canned defaults to the name having the .ix extension'''
+    source = HTTPSource(name, base, size) if is_url(name) else FileSource(name, base, size)
+    if canned is None:
+        canned = name.endswith(CANNED_EXT)
+    if canned:
+        try:
+            return CannedSource(source)
+        except Exception:
+            source.close()
+            raise
+    return source
+
+def load_meta(name):
+    'MRFMeta of a local or http(s) .mrf file'
+    if not is_url(name):
+        return mrf_meta.load(name)
+    with HTTPSource(name) as source:
+        return mrf_meta.MRFMeta(name, ET.fromstring(source.content()))
+
+def open_mrf(name, index = None):
+    '''Returns the MRFMeta and the index and data sources of an MRF, which can be
+    a local or http(s) .mrf file, or a local tar file written by mrf_tar.py.
+    index replaces the index file named in the metadata, such as a canned index.
+    The sources start at the IndexFile and DataFile offsets of the metadata'''
+    if not is_url(name) and mrf_tar.is_tar(name):
+        meta, (index_offset, index_size), (data_offset, data_size) = mrf_tar.open_mrf(name)
+        index_source = open_source(name, index_offset + meta.indexoffset, index_size - meta.indexoffset,
+                                   meta.indexfile.endswith(CANNED_EXT))
+        return meta, index_source, open_source(name, data_offset + meta.dataoffset,
+                                               data_size - meta.dataoffset)
+    meta = load_meta(name)
+    index_source = open_source(index) if index else open_source(meta.indexfile, meta.indexoffset)
+    try:
+        return meta, index_source, open_source(meta.datafile, meta.dataoffset)
+    except Exception:
+        index_source.close()
+        raise
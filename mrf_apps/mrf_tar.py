@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_tar
+# Purpose:
+
+'''Packs an MRF into a single UStar tar file, and locates its parts in one
+
+ The .mrf is the first member, followed by the index and the data file, as
+ GDAL expects. The data member can be aligned, so the tile offsets within the
+ tar file keep the same alignment they have in the data file. A padding
+ member is inserted before the data member when needed. UStar limits each
+ member to less than 8GiB. The DataFile and IndexFile names in the .mrf member
+ are changed to the member names when they are in another folder.
+ File content is copied by the kernel when possible, with copy_file_range or
+ sendfile, without passing through user space.
+
+ The tile readers use members() to find the offset of the index and data
+ members within the tar, the tiles are then read directly from the tar file.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import time
+import tarfile
+import argparse
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+
+BLOCK = tarfile.BLOCKSIZE
+PAD_NAME = '.pad'
+# Largest member size in a UStar header, 11 octal digits
+MAX_SIZE = 8 ** 11 - 1
+
+def is_tar(fname):
+    return fname.endswith('.tar')
+
+def copy_range(src_fd, dst_fd, count):
+    'Copies count bytes from the current position of src to dst, in the kernel if possible'
+    while count > 0:
+        try:
+            if hasattr(os, 'copy_file_range'):
+                n = os.copy_file_range(src_fd, dst_fd, count)
+            else:
+                n = os.sendfile(dst_fd, src_fd, None, count)
+        except OSError:
+            n = 0
+        if n == 0:  # Not supported here, copy in user space
+            while count > 0:
+                chunk = os.read(src_fd, min(count, 1024 * 1024))
+                if not chunk:
+                    raise ValueError("Input file is shorter than expected")
+                os.write(dst_fd, chunk)
+                count -= len(chunk)
+            return
+        count -= n
+
+def header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(format = tarfile.USTAR_FORMAT)
+
+def add_member(fd, name, fname, position):
+    'Writes a member for a file, returns the new position'
+    size = os.path.getsize(fname)
+    os.write(fd, header(name, size))
+    src = os.open(fname, os.O_RDONLY)
+    try:
+        copy_range(src, fd, size)
+    finally:
+        os.close(src)
+    padding = -size % BLOCK
+    os.write(fd, bytes(padding))
+    return position + BLOCK + size + padding
+
+def add_content(fd, name, content, position):
+    'Writes a member holding content, returns the new position'
+    os.write(fd, header(name, len(content)) + content + bytes(-len(content) % BLOCK))
+    return position + BLOCK + len(content) + (-len(content) % BLOCK)
+
+def member_metadata(meta):
+    '''The .mrf content with the DataFile and IndexFile names changed to
+    the member names, None if they are already plain names'''
+    import copy
+    import xml.etree.ElementTree as ET
+    root = copy.deepcopy(meta.root)
+    changed = False
+    for tag in ('DataFile', 'IndexFile'):
+        node = root.find('Raster/' + tag)
+        if node is not None and node.text and node.text.strip() != os.path.basename(node.text.strip()):
+            node.text = os.path.basename(node.text.strip())
+            changed = True
+    return ET.tostring(root) if changed else None
+
+def package(mrf, output = None, align = 0):
+    '''Writes the MRF metadata, index and data files into a tar file,
+    output defaults to the .mrf name with .tar appended.
+    With align, a multiple of 512, the data member content starts at a
+    multiple of align. Returns the output name'''
+    if align % BLOCK:
+        raise ValueError("Alignment has to be a multiple of {}".format(BLOCK))
+    meta = mrf_meta.load(mrf)
+    if output is None:
+        output = mrf + '.tar'
+    for fname in (mrf, meta.indexfile, meta.datafile):
+        if os.path.getsize(fname) > MAX_SIZE:
+            raise ValueError("{} is too large for a UStar tar member, the limit is {} bytes".format(
+                fname, MAX_SIZE))
+    content = member_metadata(meta)
+
+    fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if content is None:
+            position = add_member(fd, os.path.basename(mrf), mrf, 0)
+        else:
+            position = add_content(fd, os.path.basename(mrf), content, 0)
+        position = add_member(fd, os.path.basename(meta.indexfile), meta.indexfile, position)
+        if align and (position + BLOCK) % align:
+            # Padding member content fills the space up to the data member header
+            size = -(position + 2 * BLOCK) % align
+            position = add_content(fd, PAD_NAME, bytes(size), position)
+        position = add_member(fd, os.path.basename(meta.datafile), meta.datafile, position)
+        # End of archive, two empty blocks, then fill the record
+        end = position + 2 * BLOCK
+        os.write(fd, bytes(2 * BLOCK + (-end % tarfile.RECORDSIZE)))
+    except BaseException:
+        os.close(fd)
+        os.remove(output)
+        raise
+    os.close(fd)
+    return output
+
+def members(tarname):
+    '''Dictionary of member name to (content offset, size), in tar order'''
+    result = {}
+    with tarfile.open(tarname, 'r:') as tar:
+        for info in tar:
+            if info.isfile():
+                result[info.name] = (info.offset_data, info.size)
+    return result
+
+def open_mrf(tarname):
+    '''Parses the MRF metadata in a tar, returns the MRFMeta and the
+    (offset, size) of the index and data members'''
+    import xml.etree.ElementTree as ET
+    parts = members(tarname)
+    names = list(parts)
+    if not names or not names[0].endswith('.mrf'):
+        raise ValueError("The first member of {} is not an MRF".format(tarname))
+    offset, size = parts[names[0]]
+    with open(tarname, 'rb') as f:
+        f.seek(offset)
+        meta = mrf_meta.MRFMeta(names[0], ET.fromstring(f.read(size)))
+    index = os.path.basename(meta.indexfile)
+    data = os.path.basename(meta.datafile)
+    if index not in parts or data not in parts:
+        raise ValueError("{} does not contain {} and {}".format(tarname, index, data))
+    return meta, parts[index], parts[data]
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Pack an MRF into a single tar file')
+    parser.add_argument('source', help='MRF metadata file, or a tar file with --list')
+    parser.add_argument('-o', '--output', help='Output tar file, defaults to the source name with .tar added')
+    parser.add_argument('-a', '--align', type = int, default = 0,
+                        help='Align the data member content to this many bytes, a multiple of 512')
+    parser.add_argument('-l', '--list', action = 'store_true',
+                        help='List the members of a tar file with their offsets')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (offset, size) in members(args.source).items():
+            print("{:>16}{:>16}  {}".format(offset, size, name))
+        return 0
+    output = package(args.source, args.output, args.align)
+    print("Wrote {}".format(output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
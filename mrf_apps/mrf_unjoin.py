@@ -4,10 +4,19 @@ import argparse
 import subprocess
 import json
 import time
+import os
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from datetime import timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
+try:
+    from . import mrf_profile
+except ImportError:
+    import mrf_profile
+
+# Per worker process state for the in-process mode, see init_worker
+_worker = {}
 
 
 def parse_arguments():
@@ -34,14 +43,22 @@ def parse_arguments():
     parser.add_argument('-w', '--workers',
                         type=int, default=16,
                         help='Number of parallel processes')
+    parser.add_argument('-g', '--in_process', action='store_true',
+                        help='Use the GDAL Python bindings in worker processes instead of the command line tools')
+    parser.add_argument('--cachemax',
+                        type=int, default=256,
+                        help='GDAL_CACHEMAX for each worker process in MB, used with --in_process')
+    parser.add_argument('--report',
+                        type=str,
+                        help='Write a JSON report with per cell and per stage timing and bytes to this file')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
 
     return parser.parse_args()
 
 
-def process_cell(args, mrf_info, row, col, new_vrt):
+def cell_window(args, mrf_info, row, col):
     """
-    Processes a cell MRF
+    Computes the cell output file name and georeferenced window
 
     Parameters:
     args : argparse.Namespace:
@@ -49,24 +66,18 @@ def process_cell(args, mrf_info, row, col, new_vrt):
     mrf_info : object
         MRF metatadata info.
     row : int
-        The row index of the cell to be processed.
+        The row index of the cell.
     col : int
-        The column index of the cell to be processed.
-    new_vrt : object
-        The VRT used to created an empty MRF.
+        The column index of the cell.
 
     Returns:
     tuple
         A tuple containing:
-        - ouput_file (str): The output file name.
-        - execution_time (float): The time taken to process the cell in seconds.
-        - error_count (int): Number of errors during execution.
+        - output_file (str): The cell MRF file name.
+        - projwin (list): The cell window, as [ulx, uly, lrx, lry].
     """
 
-    error_count = 0
-    start_time = time.time()
     prefix = Path(args.input_file).stem
-    compression = mrf_info['metadata']['IMAGE_STRUCTURE']['COMPRESSION']
     x_size = mrf_info['size'][0]
     y_size = mrf_info['size'][1]
     x_block = mrf_info['bands'][0]['block'][0]
@@ -92,14 +103,112 @@ def process_cell(args, mrf_info, row, col, new_vrt):
     if args.verbose:
         print(projwin)
 
-    # create an empty MRF for inserting new cell VRT
     output_file = args.output_dir + '/' + prefix + '-c' + f'{col:02}' + 'r' + f'{row:02}' + '.mrf'
-    print(f'Creating {output_file}\n')
-    # delete any existing files
+    return output_file, projwin
+
+
+def pixel_window(projwin, geotransform, x_size, y_size):
+    """
+    Converts a cell window to source pixels, clipped to the source size
+
+    Returns:
+    tuple
+        The window as xoff, yoff, xsize, ysize, the size is 0 when the cell is outside the source.
+    """
+    gt = geotransform
+    xoff = max(int(round((projwin[0] - gt[0]) / gt[1])), 0)
+    yoff = max(int(round((projwin[1] - gt[3]) / gt[5])), 0)
+    xend = min(int(round((projwin[2] - gt[0]) / gt[1])), x_size)
+    yend = min(int(round((projwin[3] - gt[3]) / gt[5])), y_size)
+    return xoff, yoff, max(xend - xoff, 0), max(yend - yoff, 0)
+
+
+def remove_outputs(output_file, compression):
+    """
+    Deletes any existing files of a cell MRF
+    """
     Path(output_file).unlink(True)
     Path(output_file.replace('.mrf', '.idx')).unlink(True)
     Path(output_file.replace('.mrf', '.pjg' if compression == 'JPEG' else '.ppg')).unlink(True)
 
+
+def output_bytes(output_file, compression):
+    """
+    Returns the size of the cell MRF data file and the allocated size of the
+    index file, which is sparse
+    """
+    sizes = []
+    for name in (output_file.replace('.mrf', '.pjg' if compression == 'JPEG' else '.ppg'),
+                 output_file.replace('.mrf', '.idx')):
+        try:
+            st = os.stat(name)
+            sizes.append(st.st_size if not sizes else getattr(st, 'st_blocks', 0) * 512)
+        except OSError:
+            sizes.append(0)
+    return sizes
+
+
+def start_stage(name, output_file, compression):
+    """
+    Starts timing a cell processing stage, returns the stage record
+    """
+    data_bytes, index_bytes = output_bytes(output_file, compression)
+    return {'stage': name, 'start': time.time(),
+            'data_bytes': data_bytes, 'index_bytes': index_bytes}
+
+
+def end_stage(stages, stage, output_file, compression, exit_code=0, errors=0):
+    """
+    Completes a stage record with the wall time, the bytes written to the output
+    data and index files, the exit code and error count, then adds it to stages
+    """
+    data_bytes, index_bytes = output_bytes(output_file, compression)
+    stage['wall'] = time.time() - stage['start']
+    stage['data_bytes'] = data_bytes - stage['data_bytes']
+    stage['index_bytes'] = index_bytes - stage['index_bytes']
+    stage['exit_code'] = exit_code
+    stage['errors'] = errors
+    stages.append(stage)
+
+
+def process_cell(args, mrf_info, row, col, new_vrt):
+    """
+    Processes a cell MRF
+
+    Parameters:
+    args : argparse.Namespace:
+        The arguments required for processing
+    mrf_info : object
+        MRF metatadata info.
+    row : int
+        The row index of the cell to be processed.
+    col : int
+        The column index of the cell to be processed.
+    new_vrt : object
+        The VRT used to created an empty MRF.
+
+    Returns:
+    tuple
+        A tuple containing:
+        - ouput_file (str): The output file name.
+        - execution_time (float): The time taken to process the cell in seconds.
+        - error_count (int): Number of errors during execution.
+        - stages (list): Timing and output bytes for each stage.
+    """
+
+    error_count = 0
+    stages = []
+    start_time = time.time()
+    prefix = Path(args.input_file).stem
+    compression = mrf_info['metadata']['IMAGE_STRUCTURE']['COMPRESSION']
+    x_size = mrf_info['size'][0]
+    y_size = mrf_info['size'][1]
+    output_file, projwin = cell_window(args, mrf_info, row, col)
+
+    # create an empty MRF for inserting new cell VRT
+    print(f'Creating {output_file}\n')
+    remove_outputs(output_file, compression)
+
     create_mrf = ['gdal_translate', '-q',
                   '-of', 'MRF',
                   '-co', 'COMPRESS=' + compression,
@@ -116,6 +225,7 @@ def process_cell(args, mrf_info, row, col, new_vrt):
         print(' '.join(create_mrf))
 
     # Errors in GDAL MRF don't increment the exit code so we need to do it ourselves
+    stage = start_stage('create', output_file, compression)
     create_mrf_process = subprocess.Popen(create_mrf,
                                           stdout=subprocess.PIPE,
                                           stderr=subprocess.PIPE)
@@ -129,6 +239,8 @@ def process_cell(args, mrf_info, row, col, new_vrt):
             if message.lower().startswith("error"):
                 errs.append(message)
     error_count += len(errs)
+    end_stage(stages, stage, output_file, compression,
+              create_mrf_process.returncode, len(errs))
 
     if args.verbose:
         print(f'Cell MRF created {output_file}')
@@ -138,14 +250,17 @@ def process_cell(args, mrf_info, row, col, new_vrt):
     Path(output_vrt).unlink(True)
     create_vrt = ['gdal_translate', '-q',
                   '-of', 'VRT',
-                  '-projwin', str(ulx), str(uly), str(lrx), str(lry),
+                  '-projwin', *[str(v) for v in projwin],
                   '-co', 'BLOCKSIZE=512',
                   args.input_file,
                   output_vrt]
     if args.verbose:
         print(' '.join(create_vrt))
+    stage = start_stage('window', output_file, compression)
     create_vrt_result = subprocess.run(create_vrt)
     error_count += create_vrt_result.returncode
+    end_stage(stages, stage, output_file, compression,
+              create_vrt_result.returncode, int(create_vrt_result.returncode != 0))
     if args.verbose:
         print(f'Cell VRT created {output_vrt}')
 
@@ -160,6 +275,7 @@ def process_cell(args, mrf_info, row, col, new_vrt):
         print(' '.join(mrf_insert))
 
     # Errors in mrf_insert don't increment the exit code so we need to do it ourselves
+    stage = start_stage('insert', output_file, compression)
     mrf_insert_process = subprocess.Popen(mrf_insert,
                                           stdout=subprocess.PIPE,
                                           stderr=subprocess.PIPE)
@@ -173,24 +289,338 @@ def process_cell(args, mrf_info, row, col, new_vrt):
             if message.lower().startswith("error"):
                 errs.append(message)
     error_count += len(errs)
+    end_stage(stages, stage, output_file, compression,
+              mrf_insert_process.returncode, len(errs))
     if args.verbose:
         print(f'Data inserted into {output_file}')
 
     end_time = time.time()
     execution_time = end_time - start_time
-    return output_file, execution_time, error_count
+    return output_file, execution_time, error_count, stages
 
 
-def main():
+def open_dataset(name, access):
     """
-    Main function that executes unjoin processes.
+    Opens a dataset with the GDAL bindings, raises RuntimeError if it fails
+    """
+    gdal = _worker['gdal']
+    ds = gdal.Open(name, access)
+    if ds is None:
+        raise RuntimeError(f'Can\'t open {name}: {gdal.GetLastErrorMsg()}')
+    return ds
+
+
+def init_worker(input_file, new_vrt, cachemax):
+    """
+    Initializes a worker process for the in-process mode.
+    Opens the source and the template VRT once, they are shared by all the
+    cells processed by this worker. An open error is kept, and reported by
+    every cell processed by this worker.
+
+    Parameters:
+    input_file : str
+        The input MRF file name.
+    new_vrt : str
+        The VRT used to created an empty MRF.
+    cachemax : int
+        GDAL block cache size for this worker, in MB.
+    """
+    from osgeo import gdal
+    gdal.SetCacheMax(cachemax * 1024 * 1024)
+    _worker['gdal'] = gdal
+    try:
+        _worker['source'] = open_dataset(input_file, gdal.GA_ReadOnly)
+        _worker['template'] = open_dataset(new_vrt, gdal.GA_ReadOnly)
+    except RuntimeError as e:
+        _worker['error'] = str(e)
+
+
+def read_array(band, xoff, yoff, xsize, ysize):
     """
+    Reads a window of a band as an array, raises RuntimeError if it fails
+    """
+    data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+    if data is None:
+        raise RuntimeError(_worker['gdal'].GetLastErrorMsg())
+    return data
+
+
+def write_array(band, data, xoff, yoff):
+    """
+    Writes an array to a window of a band, raises RuntimeError if it fails
+    """
+    if band.WriteArray(data, xoff, yoff) != 0:
+        raise RuntimeError(_worker['gdal'].GetLastErrorMsg())
+
+
+def copy_window(src_band, dst_band, xoff, yoff, xsize, ysize, rows):
+    """
+    Copies a window from src_band to the same window of dst_band, a strip of rows at a time.
+    """
+    for line in range(yoff, yoff + ysize, rows):
+        lines = min(rows, yoff + ysize - line)
+        write_array(dst_band, read_array(src_band, xoff, line, xsize, lines), xoff, line)
+
+
+def by_four(data, average, nodata=None):
+    """
+    Reduces an array with an even size 2:1, by averaging four pixels or by picking the
+    top left one, as mrf_insert does. Pixels matching nodata are not averaged, four of
+    them are nodata
+    """
+    if not average:
+        return data[::2, ::2]
+    quads = np.stack([data[0::2, 0::2], data[0::2, 1::2], data[1::2, 0::2], data[1::2, 1::2]])
+    integer = np.issubdtype(data.dtype, np.integer)
+    values = quads.astype(np.int64 if integer else np.float64)
+    valid = np.ones(quads.shape, dtype=bool) if nodata is None else quads != nodata
+    count = valid.sum(axis=0)
+    total = np.where(valid, values, 0).sum(axis=0)
+    result = np.full(count.shape, 0 if nodata is None else nodata, dtype=values.dtype)
+    some = count > 0
+    if integer:
+        result[some] = (total[some] + count[some] // 2) // count[some]
+    else:
+        result[some] = total[some] / count[some]
+    return result.astype(data.dtype)
+
+
+def reduce_window(src_band, dst_band, x0, y0, x1, y1, average, rows):
+    """
+    Rebuilds the window x0:x1, y0:y1 of dst_band from the twice larger window of src_band,
+    a strip of rows at a time. Source pixels past the edge of src_band are nodata, or zero.
+    """
+    nodata = src_band.GetNoDataValue()
+    xsize = min(2 * (x1 - x0), src_band.XSize - 2 * x0)
+    for line in range(y0, y1, rows):
+        lines = min(rows, y1 - line)
+        ysize = min(2 * lines, src_band.YSize - 2 * line)
+        data = read_array(src_band, 2 * x0, 2 * line, xsize, ysize)
+        block = np.full((2 * lines, 2 * (x1 - x0)), 0 if nodata is None else nodata, dtype=data.dtype)
+        block[:ysize, :xsize] = data
+        write_array(dst_band, by_four(block, average, nodata), x0, line)
+
+
+def patch_cell(output_file, xoff, yoff, xsize, ysize):
+    """
+    Writes the source window into the cell MRF at the same location
+    """
+    gdal = _worker['gdal']
+    source = _worker['source']
+    ds = open_dataset(output_file, gdal.GA_Update)
+    for b in range(1, ds.RasterCount + 1):
+        dst_band = ds.GetRasterBand(b)
+        rows = dst_band.GetBlockSize()[1]
+        copy_window(source.GetRasterBand(b), dst_band, xoff, yoff, xsize, ysize, rows)
+    ds.FlushCache()
+    ds = None
+
+
+def patch_overviews(output_file, xoff, yoff, xsize, ysize, resampling):
+    """
+    Rebuilds the overview region affected by a window of the cell MRF, level by level
+    """
+    gdal = _worker['gdal']
+    ds = open_dataset(output_file, gdal.GA_Update)
+    for b in range(1, ds.RasterCount + 1):
+        dst_band = ds.GetRasterBand(b)
+        rows = dst_band.GetBlockSize()[1]
+        # Window in the level below, start from the base
+        x0, y0, x1, y1 = xoff, yoff, xoff + xsize, yoff + ysize
+        src = dst_band
+        for level in range(dst_band.GetOverviewCount()):
+            dst = dst_band.GetOverview(level)
+            x0, y0 = x0 // 2, y0 // 2
+            x1 = min(-(-x1 // 2), dst.XSize)
+            y1 = min(-(-y1 // 2), dst.YSize)
+            reduce_window(src, dst, x0, y0, x1, y1, resampling == 'Avg', rows)
+            dst.FlushCache()
+            src = dst
+    ds.FlushCache()
+    ds = None
+
+
+def process_cell_gdal(args, mrf_info, row, col):
+    """
+    Processes a cell MRF using the GDAL bindings, in a worker process
+    initialized by init_worker
+
+    Parameters:
+    args : argparse.Namespace:
+        The arguments required for processing
+    mrf_info : object
+        MRF metatadata info.
+    row : int
+        The row index of the cell to be processed.
+    col : int
+        The column index of the cell to be processed.
+
+    Returns:
+    tuple
+        A tuple containing:
+        - ouput_file (str): The output file name.
+        - execution_time (float): The time taken to process the cell in seconds.
+        - error_count (int): Number of errors during execution.
+        - stages (list): Timing and output bytes for each stage.
+    """
+
+    gdal = _worker['gdal']
     start_time = time.time()
-    args = parse_arguments()
-    print('Getting info for', args.input_file)
-    prefix = Path(args.input_file).stem
-    errors = 0
+    error_count = 0
+    stages = []
+    stage = None
+
+    def error(err_no, message):
+        nonlocal error_count
+        print(f'{output_file} {stage} error {err_no}: {message}')
+        error_count += 1
+
+    def handler(err_class, err_no, message):
+        if err_class >= gdal.CE_Failure:
+            error(err_no, message)
+        elif args.verbose:
+            print(message)
+
+    compression = mrf_info['metadata']['IMAGE_STRUCTURE']['COMPRESSION']
+    x_size = mrf_info['size'][0]
+    y_size = mrf_info['size'][1]
+    output_file, projwin = cell_window(args, mrf_info, row, col)
+
+    creation_options = ['COMPRESS=' + compression, 'BLOCKSIZE=512', 'NOCOPY=true']
+    if args.resampling != 'None':
+        creation_options.append('UNIFORM_SCALE=2')
+
+    def run_stage(name, func, *func_args):
+        nonlocal stage
+        stage = name
+        record = start_stage(name, output_file, compression)
+        count = error_count
+        exit_code = 0
+        try:
+            func(*func_args)
+        except RuntimeError as e:
+            # Unless already reported by the error handler
+            if error_count == count:
+                error(0, str(e))
+            exit_code = 1
+        end_stage(stages, record, output_file, compression, exit_code, error_count - count)
+        return exit_code == 0
+
+    def create():
+        ds = gdal.Translate(output_file, _worker['template'], format='MRF',
+                            width=x_size, height=y_size,
+                            creationOptions=creation_options)
+        if ds is None:
+            raise RuntimeError(gdal.GetLastErrorMsg())
+        ds = None
+
+    def init():
+        raise RuntimeError(_worker['error'])
+
+    if 'error' in _worker:
+        run_stage('init', init)
+        return output_file, time.time() - start_time, error_count, stages
+
+    xoff, yoff, xsize, ysize = pixel_window(projwin, _worker['source'].GetGeoTransform(), x_size, y_size)
+    print(f'Creating {output_file}\n')
+    remove_outputs(output_file, compression)
+
+    window = (output_file, xoff, yoff, xsize, ysize)
+    gdal.PushErrorHandler(handler)
+    try:
+        if run_stage('create', create):
+            if args.verbose:
+                print(f'Cell MRF created {output_file}')
+            if xsize and ysize and run_stage('insert', patch_cell, *window):
+                if args.verbose:
+                    print(f'Data inserted into {output_file}')
+                if args.resampling != 'None':
+                    run_stage('overview', patch_overviews, *window, args.resampling)
+    finally:
+        gdal.PopErrorHandler()
+
+    execution_time = time.time() - start_time
+    return output_file, execution_time, error_count, stages
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at the given fraction of the sorted values, interpolated
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    pos = (len(values) - 1) * fraction
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(cells, elapsed, workers):
+    """
+    Summarizes the cell records
+
+    Parameters:
+    cells : list
+        Cell records, each with start, wall and stages.
+    elapsed : float
+        Wall time of the whole cell processing, in seconds.
+    workers : int
+        Number of workers requested.
+
+    Returns:
+    dict
+        Per stage count, total, p50 and p95 wall time, bytes written and throughput,
+        plus the effective and peak worker concurrency.
+    """
+    stages = {}
+    for cell in cells:
+        for stage in cell['stages']:
+            stages.setdefault(stage['stage'], []).append(stage)
+
+    summary = {'cells': len(cells), 'elapsed': elapsed, 'stages': {}}
+    for name, records in stages.items():
+        walls = [r['wall'] for r in records]
+        total = sum(walls)
+        written = sum(r['data_bytes'] + r['index_bytes'] for r in records)
+        summary['stages'][name] = {
+            'count': len(records),
+            'total': total,
+            'p50': percentile(walls, 0.5),
+            'p95': percentile(walls, 0.95),
+            'data_bytes': sum(r['data_bytes'] for r in records),
+            'index_bytes': sum(r['index_bytes'] for r in records),
+            'mb_per_second': written / total / 2**20 if total > 0 else 0.0,
+            'exit_codes': sum(1 for r in records if r['exit_code']),
+            'errors': sum(r['errors'] for r in records),
+        }
+
+    # Average number of cells in flight, and the maximum
+    busy = sum(cell['wall'] for cell in cells)
+    concurrency = busy / elapsed if elapsed > 0 else 0.0
+    events = sorted([(c['start'], 1) for c in cells] + [(c['start'] + c['wall'], -1) for c in cells])
+    running = peak = 0
+    for _, step in events:
+        running += step
+        peak = max(peak, running)
+    summary['effective_concurrency'] = concurrency
+    summary['peak_concurrency'] = peak
+    summary['worker_utilization'] = concurrency / workers if workers else 0.0
+    return summary
+
+
+def get_info(args, prefix):
+    """
+    Gets the input MRF info with gdalinfo and creates the template VRT with gdal_translate
 
+    Returns:
+    tuple
+        A tuple containing:
+        - mrf_info (dict): The gdalinfo json output.
+        - new_vrt (str): The template VRT file name.
+        - errors (int): Number of errors.
+    """
+    errors = 0
     # Get size of MRF
     gdalinfo_command_list = ['gdalinfo', '-json', args.input_file]
     if args.verbose:
@@ -233,10 +663,37 @@ def main():
                   new_vrt]
     if args.verbose:
         print(' '.join(create_vrt))
-    subprocess.run(create_vrt)
     create_vrt_result = subprocess.run(create_vrt)
     errors += create_vrt_result.returncode
 
+    return mrf_info, new_vrt, errors
+
+
+def main():
+    """
+    Main function that executes unjoin processes.
+    """
+    mrf_profile.start()
+    start_time = time.time()
+    args = parse_arguments()
+    print('Getting info for', args.input_file)
+    prefix = Path(args.input_file).stem
+    errors = 0
+
+    if args.in_process:
+        from osgeo import gdal
+        mrf_info = gdal.Info(args.input_file, format='json')
+        if not mrf_info:
+            print('MRF is not valid.')
+            exit()
+        # create a VRT based on the input MRF to later create a blank cell MRF
+        new_vrt = args.output_dir + '/' + prefix + '.vrt'
+        if gdal.Translate(new_vrt, args.input_file, format='VRT') is None:
+            errors += 1
+    else:
+        mrf_info, new_vrt, info_errors = get_info(args, prefix)
+        errors += info_errors
+
     # Remove the source from the VRT to avoid referencing the original MRF
     tree = ET.parse(new_vrt)
     band = tree.getroot().find('VRTRasterBand')
@@ -245,22 +702,54 @@ def main():
     print(f'VRT created {new_vrt}')
 
     # Process each cell in parallel
-    with ThreadPoolExecutor(max_workers=int(args.workers)) as executor:
+    cells = []
+    if args.in_process:
+        executor = ProcessPoolExecutor(max_workers=int(args.workers),
+                                       initializer=init_worker,
+                                       initargs=(args.input_file, new_vrt, args.cachemax))
+    else:
+        executor = ThreadPoolExecutor(max_workers=int(args.workers))
+    cells_start = time.time()
+    with executor:
         futures = []
         for row in reversed(range(args.rows)):
             for col in range(args.columns):
-                futures.append(executor.submit(process_cell,
-                                               args, mrf_info, row, col,
-                                               new_vrt))
+                if args.in_process:
+                    futures.append(executor.submit(process_cell_gdal,
+                                                   args, mrf_info, row, col))
+                else:
+                    futures.append(executor.submit(process_cell,
+                                                   args, mrf_info, row, col,
+                                                   new_vrt))
 
         for future in as_completed(futures):
-            result, execution_time, error_count = future.result()
+            result, execution_time, error_count, stages = future.result()
+            cells.append({'cell': result,
+                          'start': stages[0]['start'] if stages else cells_start,
+                          'wall': execution_time,
+                          'errors': error_count,
+                          'stages': stages})
             print(f'Processed {result} in {str(timedelta(seconds=execution_time))} with {str(error_count)} errors.\n')
             errors += error_count
 
     end_time = time.time()
     run_time = end_time - start_time
     print(f'mrf_unjoin completed in {str(timedelta(seconds=run_time))} with {str(errors)} errors.')
+    if args.report:
+        report = {
+            'input_file': args.input_file,
+            'rows': args.rows,
+            'columns': args.columns,
+            'workers': args.workers,
+            'in_process': args.in_process,
+            'run_time': run_time,
+            'errors': errors,
+            'cells': cells,
+            'summary': summarize(cells, end_time - cells_start, args.workers),
+        }
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {args.report}')
     exit(errors)
 
 
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_versions
+# Purpose:
+
+'''Lists and compacts the versions of a versioned MRF
+
+ A versioned MRF index holds multiple copies of the index, each one the size
+ of a normal index. Version 0 is the current one, the older versions follow,
+ version 1 being the oldest. Tiles that are not modified are shared between
+ versions, the older versions keep the overwritten tiles alive.
+
+ list shows the tiles and bytes used by each version.
+ compact rewrites the data and index files, keeping only the current and the
+ most recent older versions. Tiles shared by versions are stored only once and
+ the unused parts of the data file are dropped.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import argparse
+from array import array
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+
+def read_index(fname):
+    'Reads a whole index file as an array of native 64 bit integers, offset and size pairs'
+    idx = array('Q')
+    with open(fname, "rb") as f:
+        idx.fromfile(f, os.path.getsize(fname) // idx.itemsize)
+    if sys.byteorder != 'big':
+        idx.byteswap()
+    return idx
+
+def write_index(fname, idx):
+    'Writes an array of native integers as a big endian index file, skipping empty blocks'
+    if sys.byteorder != 'big':
+        idx = array(idx.typecode, idx)
+        idx.byteswap()
+    step = 512 // idx.itemsize
+    with open(fname, "wb") as f:
+        for i in range(0, len(idx), step):
+            block = idx[i:i + step]
+            if block.count(0) == len(block):
+                f.seek(len(block) * block.itemsize, os.SEEK_CUR)
+            else:
+                block.tofile(f)
+        f.truncate()
+
+def version_count(idx, records):
+    'Number of versions in an index array'
+    if records == 0 or len(idx) % (2 * records):
+        raise ValueError("Index size is not a multiple of the index version size")
+    return len(idx) // (2 * records)
+
+def span(idx, records, version):
+    'The index records of one version'
+    return idx[2 * records * version: 2 * records * (version + 1)]
+
+def tiles(records):
+    'Set of (offset, size) of the tiles in index records'
+    return set((records[i], records[i + 1]) for i in range(0, len(records), 2) if records[i + 1])
+
+def list_versions(mrf):
+    '''Returns a list with one dictionary per version, with the number of tiles,
+    the bytes they use and the bytes used only by that version'''
+    meta = mrf_meta.load(mrf)
+    idx = read_index(meta.indexfile)
+    count = version_count(idx, meta.records)
+    sets = [tiles(span(idx, meta.records, v)) for v in range(count)]
+    result = []
+    for v, current in enumerate(sets):
+        others = set().union(*(sets[:v] + sets[v + 1:]))
+        result.append({
+            'version': v,
+            'tiles': len(current),
+            'bytes': sum(size for _, size in current),
+            'exclusive_bytes': sum(size for offset, size in current if (offset, size) not in others),
+        })
+    return result
+
+def compact_files(datafile, indexfile, records, versions, out_data, out_index, empty_file = None):
+    '''Copies the tiles used by the given list of versions to a new data and
+    index file. Shared tiles are copied once, in the source data file order.
+    Returns the size of the new data file'''
+    idx = read_index(indexfile)
+    version_count(idx, records)
+    out = array('Q', bytes(16 * records * len(versions)))
+    used = set()
+    for v in versions:
+        used |= tiles(span(idx, records, v))
+
+    moved = {}
+    with open(datafile, "rb") as sfile:
+        with open(out_data, "wb") as dfile:
+            if empty_file:
+                with open(empty_file, "rb") as f:
+                    dfile.write(f.read())
+            doffset = dfile.tell()
+            for offset, size in sorted(used):
+                sfile.seek(offset)
+                dfile.write(sfile.read(size))
+                moved[offset, size] = doffset
+                doffset += size
+
+    for n, v in enumerate(versions):
+        records_in = span(idx, records, v)
+        base = 2 * records * n
+        for i in range(0, len(records_in), 2):
+            size = records_in[i + 1]
+            if size:
+                out[base + i] = moved[records_in[i], size]
+                out[base + i + 1] = size
+    write_index(out_index, out)
+    return doffset
+
+def compact(mrf, keep, output = None):
+    '''Keeps the current version and the most recent keep - 1 older versions.
+    With an output MRF name, the result is written there, otherwise the MRF is
+    rewritten in place, which is not safe while it is being read.
+    Returns the number of bytes saved'''
+    if keep < 1:
+        raise ValueError("At least the current version has to be kept")
+    meta = mrf_meta.load(mrf)
+    count = version_count(read_index(meta.indexfile), meta.records)
+    versions = [0] + list(range(max(1, count - keep + 1), count))
+    old_size = os.path.getsize(meta.datafile)
+
+    if output is None:
+        out_data, out_index = meta.datafile + ".tmp", meta.indexfile + ".tmp"
+    else:
+        base = os.path.splitext(output)[0]
+        out_data = base + mrf_meta.EXTENSIONS.get(meta.compression, '.dat')
+        out_index = base + ".idx"
+    new_size = compact_files(meta.datafile, meta.indexfile, meta.records, versions,
+                             out_data, out_index)
+
+    if output is None:
+        os.replace(out_data, meta.datafile)
+        os.replace(out_index, meta.indexfile)
+    else:
+        # The output uses the default file names
+        import copy
+        import xml.etree.ElementTree as ET
+        root = copy.deepcopy(meta.root)
+        raster = root.find('Raster')
+        for tag in ('DataFile', 'IndexFile'):
+            node = raster.find(tag)
+            if node is not None:
+                raster.remove(node)
+        if len(versions) == 1:
+            raster.attrib.pop('versioned', None)
+        ET.ElementTree(root).write(output)
+    return old_size - new_size
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='List or compact the versions of a versioned MRF')
+    subparsers = parser.add_subparsers(dest = 'mode')
+    subparsers.required = True
+
+    parser_list = subparsers.add_parser('list', help='Show the tiles and bytes used by each version')
+    parser_list.add_argument('source', help='MRF metadata file')
+
+    parser_compact = subparsers.add_parser('compact',
+                                           help='Keep only the most recent versions, dropping unused data')
+    parser_compact.add_argument('source', help='MRF metadata file')
+    parser_compact.add_argument('-k', '--keep', type = int, default = 1,
+                                help='Number of versions to keep, including the current one. Default is 1')
+    parser_compact.add_argument('-o', '--output',
+                                help='Output MRF metadata file, otherwise the source is compacted in place')
+
+    args = parser.parse_args()
+    if args.mode == 'list':
+        print("{:>8}{:>12}{:>16}{:>16}".format("version", "tiles", "bytes", "exclusive"))
+        for v in list_versions(args.source):
+            print("{version:>8}{tiles:>12}{bytes:>16}{exclusive_bytes:>16}".format(**v))
+        meta = mrf_meta.load(args.source)
+        data_size = os.path.getsize(meta.datafile)
+        live = sum(size for _, size in tiles(read_index(meta.indexfile)))
+        print("Data file size {}, used by tiles {}, unused {}".format(data_size, live, data_size - live))
+        return 0
+
+    saved = compact(args.source, args.keep, args.output)
+    print("Compacted {}, {} bytes saved".format(args.source, saved))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
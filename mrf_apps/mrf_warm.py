@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_warm
+# Purpose:
+
+'''Pre-loads tiles into a cloning MRF, from its source MRF
+
+ A cloning MRF has a <CachedSource><Source clone="true"> node and fetches the
+ tiles from the source MRF on first read. Its index file is twice the normal
+ size, the local index is followed by a copy of the source index.
+ This tool copies the compressed tiles for a bounding box, a set of levels or
+ a list of tiles directly, without decompressing them. Tiles are read from the
+ source in data file order, close reads are merged. Tiles which are empty in
+ the source are marked as known empty in the local index, with size 0 and
+ offset 1. Tiles already in the local index are skipped.
+ The cloning MRF should not be in use while it is warmed.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import math
+import struct
+import argparse
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+    from . import mrf_zdrill
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+    import mrf_zdrill
+
+RECORD = struct.Struct('>QQ')
+
+def level_tiles(meta, level):
+    'All the tiles of a level, as (level, row, col)'
+    cols, rows = meta.levels()[level]
+    return [(level, row, col) for row in range(rows) for col in range(cols)]
+
+def bbox_tiles(meta, bbox, level):
+    'The tiles of a level that intersect a bounding box (minx, miny, maxx, maxy)'
+    cols, rows = meta.levels()[level]
+    factor = (meta.scale or 2) ** level
+    tw = (meta.bbox.maxx - meta.bbox.minx) / meta.size.x * meta.pagesize.x * factor
+    th = (meta.bbox.maxy - meta.bbox.miny) / meta.size.y * meta.pagesize.y * factor
+    minx, miny, maxx, maxy = bbox
+    col0 = max(0, int(math.floor((minx - meta.bbox.minx) / tw)))
+    col1 = min(cols - 1, int(math.ceil((maxx - meta.bbox.minx) / tw)) - 1)
+    row0 = max(0, int(math.floor((meta.bbox.maxy - maxy) / th)))
+    row1 = min(rows - 1, int(math.ceil((meta.bbox.maxy - miny) / th)) - 1)
+    return [(level, row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+def tile_records(meta, tiles, zslices = None):
+    'Sorted index record numbers for a list of (level, row, col) tiles, all bands and z slices'
+    if zslices is None:
+        zslices = range(meta.size.z)
+    records = set()
+    for level, row, col in tiles:
+        for z in zslices:
+            for band in range(meta.bandpages):
+                records.add(meta.record(level, row, col, z, band))
+    return sorted(records)
+
+def read_records(fd, records):
+    'Dictionary of record number to (offset, size)'
+    result = {}
+    for start, end, members in mrf_zdrill.coalesce([(16 * r, 16) for r in records], 512):
+        buffer = os.pread(fd, end - start, start).ljust(end - start, b'\0')
+        for i in members:
+            result[records[i]] = RECORD.unpack_from(buffer, 16 * records[i] - start)
+    return result
+
+def write_records(fd, updates):
+    'Writes a dictionary of record number to (offset, size), merging consecutive records'
+    run = []
+    for r in sorted(updates):
+        if run and r != run[0] + len(run):
+            os.pwrite(fd, b''.join(RECORD.pack(*updates[x]) for x in run), 16 * run[0])
+            run = []
+        run.append(r)
+    if run:
+        os.pwrite(fd, b''.join(RECORD.pack(*updates[x]) for x in run), 16 * run[0])
+
+def warm(mrf, records, gap = mrf_zdrill.GAP):
+    '''Copies the tiles for the given record numbers from the source of a
+    cloning MRF. Returns a dictionary with the counts of copied, empty and
+    already cached tiles and the bytes copied'''
+    meta = mrf_meta.load(mrf)
+    if meta.source is None or not meta.clone:
+        raise ValueError(mrf + " is not a cloning MRF")
+    source = mrf_meta.load(meta.source)
+    if source.records != meta.records:
+        raise ValueError("The source MRF has a different structure")
+    total = meta.records
+    stats = {'copied': 0, 'empty': 0, 'cached': 0, 'bytes': 0}
+
+    # Local index is followed by the copy of the source index
+    if not os.path.exists(meta.indexfile) or os.path.getsize(meta.indexfile) < 32 * total:
+        with open(meta.indexfile, "ab") as f:
+            f.truncate(32 * total)
+    if not os.path.exists(meta.datafile):
+        open(meta.datafile, "wb").close()
+
+    lfd = os.open(meta.indexfile, os.O_RDWR)
+    try:
+        local = read_records(lfd, records)
+        needed = [r for r in records if local[r] == (0, 0)]
+        stats['cached'] = len(records) - len(needed)
+
+        sfd = os.open(source.indexfile, os.O_RDONLY)
+        try:
+            src = read_records(sfd, needed)
+        finally:
+            os.close(sfd)
+
+        updates = {}
+        for r in needed:
+            if src[r][1] == 0:
+                updates[r] = (1, 0)  # Known empty
+                stats['empty'] += 1
+            else:
+                updates[total + r] = src[r]  # Cloned index copy
+
+        # Copy the tiles in source data order, appending to the local data
+        tiles = [src[r] if src[r][1] else (0, 0) for r in needed]
+        dfd = os.open(source.datafile, os.O_RDONLY)
+        try:
+            with open(meta.datafile, "ab") as out:
+                offset = out.seek(0, os.SEEK_END)
+                for start, end, members in mrf_zdrill.coalesce(tiles, gap):
+                    buffer = memoryview(os.pread(dfd, end - start, start))
+                    for i in members:
+                        toffset, size = tiles[i]
+                        out.write(buffer[toffset - start: toffset - start + size])
+                        updates[needed[i]] = (offset, size)
+                        offset += size
+                        stats['copied'] += 1
+                        stats['bytes'] += size
+        finally:
+            os.close(dfd)
+        # Data is written before the index points to it
+        write_records(lfd, updates)
+    finally:
+        os.close(lfd)
+    return stats
+
+def parse_tiles(fname):
+    'Reads a list of tiles, one "level row col" per line'
+    tiles = []
+    with open(fname) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                level, row, col = (int(v) for v in line.replace(',', ' ').split()[:3])
+                tiles.append((level, row, col))
+    return tiles
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Pre-load tiles into a cloning MRF from its source')
+    parser.add_argument('mrf', help='Cloning MRF metadata file')
+    parser.add_argument('-b', '--bbox',
+                        help='Bounding box as minx,miny,maxx,maxy, in the MRF coordinates')
+    parser.add_argument('-l', '--levels',
+                        help='Comma separated list of levels, 0 is the full resolution')
+    parser.add_argument('-t', '--top', type = int,
+                        help='Warm the lowest resolution levels, this many of them')
+    parser.add_argument('-f', '--tiles',
+                        help='File with a list of tiles to warm, as "level row col" lines')
+    parser.add_argument('-z', '--zslices', type = mrf_zdrill.zrange,
+                        help='Z slices as first:last, all by default')
+    args = parser.parse_args()
+
+    meta = mrf_meta.load(args.mrf)
+    nlevels = len(meta.pages)
+    levels = None
+    if args.levels:
+        levels = [int(l) for l in args.levels.split(',')]
+    if args.top:
+        levels = sorted(set((levels or []) + list(range(max(0, nlevels - args.top), nlevels))))
+
+    tiles = []
+    if args.bbox:
+        bbox = [float(v) for v in args.bbox.split(',')]
+        for level in (levels if levels is not None else range(nlevels)):
+            tiles += bbox_tiles(meta, bbox, level)
+    elif levels is not None:
+        for level in levels:
+            tiles += level_tiles(meta, level)
+    if args.tiles:
+        tiles += parse_tiles(args.tiles)
+    if not tiles:
+        parser.error('Nothing to warm, use --bbox, --levels, --top or --tiles')
+
+    stats = warm(args.mrf, tile_records(meta, tiles, args.zslices))
+    print("Copied {copied} tiles, {bytes} bytes, {empty} empty, {cached} already cached".format(**stats))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#
+# Name: mrf_zdrill
+# Purpose:
+
+'''Reads the same tile from every z slice of a 3rd dimension MRF
+
+ The index records of one tile are at a fixed stride, the size of a level
+ slice. They are read together, then the tile data reads are sorted by offset
+ and reads of close tiles are merged. The tiles are written as a tar file or
+ concatenated, with a JSON manifest of the offset and size of each slice.
+'''
+
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import argparse
+from array import array
+try:
+    from . import mrf_profile
+    from . import mrf_meta
+except ImportError:
+    import mrf_profile
+    import mrf_meta
+
+# Read the index span containing all the records at once if it is smaller than this
+SPAN_LIMIT = 1024 * 1024
+# Merge data reads separated by less than this many bytes
+GAP = 64 * 1024
+
+def z_records(meta, level, row, col, zslices = None, band = 0, version = 0):
+    'Index record numbers of a tile, for each of the z slices, all by default'
+    if zslices is None:
+        zslices = range(meta.size.z)
+    first = meta.record(level, row, col, 0, band) + version * meta.records
+    stride = meta.pages[level]
+    return [first + z * stride for z in zslices]
+
+def read_records(fd, records, base = 0):
+    'Reads the (offset, size) of the index records, which are sorted, from an index starting at base'
+    if not records:
+        return []
+    idx = array('Q')
+    lo, hi = records[0], records[-1] + 1
+    if 16 * (hi - lo) <= SPAN_LIMIT:
+        idx.frombytes(os.pread(fd, 16 * (hi - lo), base + 16 * lo).ljust(16 * (hi - lo), b'\0'))
+        positions = [r - lo for r in records]
+    else:
+        for r in records:
+            idx.frombytes(os.pread(fd, 16, base + 16 * r).ljust(16, b'\0'))
+        positions = range(len(records))
+    if sys.byteorder != 'big':
+        idx.byteswap()
+    return [(idx[2 * p], idx[2 * p + 1]) for p in positions]
+
+def coalesce(tiles, gap = GAP):
+    '''Groups (offset, size) tiles into read ranges, returns a list of
+    (start, end, [indices of the tiles in the range])'''
+    ranges = []
+    for i in sorted((i for i, (_, size) in enumerate(tiles) if size), key = lambda i: tiles[i][0]):
+        offset, size = tiles[i]
+        if ranges and offset <= ranges[-1][1] + gap:
+            ranges[-1][1] = max(ranges[-1][1], offset + size)
+            ranges[-1][2].append(i)
+        else:
+            ranges.append([offset, offset + size, [i]])
+    return ranges
+
+def drill(mrf, level, row, col, zslices = None, band = 0, version = 0, gap = GAP):
+    '''Returns a list of (z, tile content) for a tile in every z slice.
+    Level 0 is the full resolution, empty tiles are returned as b""'''
+    meta = mrf_meta.load(mrf) if isinstance(mrf, str) else mrf
+    cols, rows = meta.levels()[level]
+    if not (0 <= row < rows and 0 <= col < cols):
+        raise ValueError("Tile {},{} is outside of level {}".format(row, col, level))
+    if zslices is None:
+        zslices = range(meta.size.z)
+    zslices = list(zslices)
+    if any(z < 0 or z >= meta.size.z for z in zslices):
+        raise ValueError("Z slices have to be between 0 and {}".format(meta.size.z - 1))
+
+    order = sorted(range(len(zslices)), key = lambda i: zslices[i])
+    records = z_records(meta, level, row, col, [zslices[i] for i in order], band, version)
+    fd = os.open(meta.indexfile, os.O_RDONLY)
+    try:
+        pairs = read_records(fd, records, meta.indexoffset)
+    finally:
+        os.close(fd)
+    tiles = [None] * len(zslices)
+    for i, pair in zip(order, pairs):
+        tiles[i] = pair
+
+    content = [b''] * len(zslices)
+    fd = os.open(meta.datafile, os.O_RDONLY)
+    try:
+        for start, end, members in coalesce(tiles, gap):
+            buffer = memoryview(os.pread(fd, end - start, meta.dataoffset + start))
+            for i in members:
+                offset, size = tiles[i]
+                content[i] = bytes(buffer[offset - start: offset - start + size])
+    finally:
+        os.close(fd)
+    return list(zip(zslices, content))
+
+def write_tar(tiles, output, ext):
+    'Writes the non-empty tiles to a tar file, named by z slice'
+    import io
+    import tarfile
+    with tarfile.open(output, "w") as tar:
+        for z, data in tiles:
+            if not data:
+                continue
+            info = tarfile.TarInfo("{:05d}{}".format(z, ext))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+def write_concatenated(tiles, output, manifest):
+    'Writes the tiles one after the other, and a JSON manifest of their offsets and sizes'
+    entries = []
+    offset = 0
+    with open(output, "wb") as f:
+        for z, data in tiles:
+            f.write(data)
+            entries.append({'z': z, 'offset': offset, 'size': len(data)})
+            offset += len(data)
+    with open(manifest, "w") as f:
+        json.dump({'file': os.path.basename(output), 'tiles': entries}, f, indent=2)
+
+def zrange(text):
+    'first:last, inclusive, or a single slice'
+    if ':' in text:
+        first, last = text.split(':')
+        return range(int(first), int(last) + 1)
+    return range(int(text), int(text) + 1)
+
+def main():
+    mrf_profile.start()
+    parser = argparse.ArgumentParser(description='Read a tile from every z slice of an MRF')
+    parser.add_argument('source', help='MRF metadata file')
+    parser.add_argument('-l', '--level', type = int, default = 0,
+                        help='Level, 0 is the full resolution')
+    parser.add_argument('-r', '--row', type = int, required = True, help='Tile row')
+    parser.add_argument('-c', '--col', type = int, required = True, help='Tile column')
+    parser.add_argument('-z', '--zslices', type = zrange,
+                        help='Z slices to read as first:last, all by default')
+    parser.add_argument('-b', '--band', type = int, default = 0,
+                        help='Band, for band interleaved MRFs')
+    parser.add_argument('-t', '--tar', help='Output tar file')
+    parser.add_argument('-o', '--output', help='Output file for the concatenated tiles')
+    parser.add_argument('-m', '--manifest',
+                        help='Manifest file for the concatenated tiles, defaults to the output name with .json')
+    args = parser.parse_args()
+    if not args.tar and not args.output:
+        parser.error('Either --tar or --output is required')
+
+    meta = mrf_meta.load(args.source)
+    tiles = drill(meta, args.level, args.row, args.col, args.zslices, args.band)
+    if args.tar:
+        write_tar(tiles, args.tar, os.path.splitext(meta.datafile)[1])
+        print("Wrote {} tiles to {}".format(sum(1 for _, d in tiles if d), args.tar))
+    if args.output:
+        manifest = args.manifest or os.path.splitext(args.output)[0] + ".json"
+        write_concatenated(tiles, args.output, manifest)
+        print("Wrote {} tiles to {}".format(sum(1 for _, d in tiles if d), args.output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,6 +20,10 @@ from optparse import OptionParser
 import os
 import sys
 from functools import reduce
+try:
+    from . import mrf_profile
+except ImportError:
+    import mrf_profile
 
 prog = os.path.basename(sys.argv[0])
 
@@ -125,6 +129,7 @@ def process_tiles(options, args, fout, fidx):
         print("{0} padding tile(s)".format(pads))
 
 def main():
+    mrf_profile.start()
     usage = "Usage: %prog [options] path_template output_base"
     parser = OptionParser(usage=usage, add_help_option=False)
     parser.add_option("-b", "--blank-tile", type="string",
@@ -0,0 +1,287 @@
+# tests/benchmark.py
+#
+# Benchmarks for the mrf_apps tools, on synthetic MRFs
+#
+# Run from the project root:
+#   python3 -m tests.benchmark --grid 128x128 --sparsity 0.5 --tile-size 8192
+#
+# Each tool is timed on the same synthetic input, the best time out of --repeat runs
+# is reported as tiles/s and MB/s. When a baseline file exists, results for the same
+# configuration are compared against it and any tool slower than the baseline by more
+# than the tolerance is reported as a regression, with a non-zero exit code.
+# Use --save-baseline to store the current results as the baseline. Without a
+# baseline for the configuration the exit code is 2, unless --no-baseline is given.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import io
+
+from mrf_apps import mrf_join, mrf_clean
+from tests import mrf_fixtures
+
+APPS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mrf_apps")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# Exit codes
+REGRESSION = 1
+NO_BASELINE = 2
+TOOLS = ("join", "clean_copy", "clean_trim", "read_idx", "read_data", "read", "tiles2mrf", "can",
+         "can_update")
+
+
+def synthetic(base, width, height, sparsity, tile_size, slack=0, seed=0):
+    '''A synthetic single level MRF of width x height tiles, generated by make_mrf.
+    Tile sizes vary between half and one and a half of tile_size'''
+    return mrf_fixtures.make_mrf(base, 512 * width, 512 * height, density=1 - sparsity,
+                                 tile_size=(tile_size // 2, tile_size + tile_size // 2),
+                                 slack=slack, seed=seed)
+
+
+def records(fixture):
+    'Non-empty tile numbers, counting from 1 as the read tools do'
+    return [int(n) + 1 for n in fixture.numbers]
+
+
+def tile_tree(fixture, folder):
+    'Writes the tiles as a {z}/{x}_{y}.ppg tree, empty tiles are written as empty files'
+    template = os.path.join(folder, "{z}", "{x}_{y}.ppg")
+    os.makedirs(os.path.join(folder, "0"), exist_ok=True)
+    cols, rows = fixture.layout.levels[0]
+    tiles = dict(zip(fixture.numbers.tolist(), zip(fixture.offsets.tolist(), fixture.sizes.tolist())))
+    with open(fixture.data, "rb") as data:
+        for i in range(cols * rows):
+            offset, size = tiles.get(i, (0, 0))
+            data.seek(offset)
+            with open(template.format(z=0, x=i % cols, y=i // cols), "wb") as f:
+                f.write(data.read(size))
+    return template
+
+
+def timed(func, repeat, setup=None):
+    'Best wall time out of repeat runs of func, setup runs before each and is not timed'
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def quiet(func):
+    'Wraps func to discard what it prints'
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    return wrapper
+
+
+def cli(*args):
+    subprocess.run([sys.executable] + list(args), check=True, capture_output=True)
+
+
+def run_benchmarks(workdir, width, height, sparsity, tile_size, tools=TOOLS, repeat=3, reads=20):
+    '''Runs the selected tools on synthetic MRFs in workdir
+    Returns a dictionary of tool name to seconds, tiles, bytes, tiles/s and MB/s
+    '''
+    src = synthetic(os.path.join(workdir, "src"), width, height, sparsity, tile_size, seed=1)
+    src_bytes = int(src.sizes.sum())
+    sizes = dict(zip(records(src), src.sizes.tolist()))
+    results = {}
+
+    def record(name, seconds, tiles, nbytes):
+        results[name] = {
+            "seconds": seconds,
+            "tiles": tiles,
+            "bytes": nbytes,
+            "tiles_per_second": tiles / seconds if seconds else 0.0,
+            "mb_per_second": nbytes / seconds / 2**20 if seconds else 0.0,
+        }
+
+    def remove(*names):
+        for name in names:
+            if os.path.exists(name):
+                os.remove(name)
+
+    if "join" in tools:
+        other = synthetic(os.path.join(workdir, "other"), width, height, sparsity, tile_size, seed=2)
+        out = os.path.join(workdir, "joined")
+        seconds = timed(quiet(lambda: mrf_join.mrf_join([src.data, other.data, out + ".ppg"])),
+                        repeat, lambda: remove(out + ".ppg", out + ".idx", out + ".mrf"))
+        record("join", seconds, src.tiles + other.tiles, src_bytes + int(other.sizes.sum()))
+
+    if "clean_copy" in tools:
+        out = os.path.join(workdir, "clean.ppg")
+        seconds = timed(lambda: mrf_clean.mrf_clean(src.data, out), repeat)
+        record("clean_copy", seconds, src.tiles, src_bytes)
+
+    if "clean_trim" in tools:
+        # Trim needs slack in the data file, rebuilt before every run
+        class Args:
+            source = os.path.join(workdir, "slack.ppg")
+            empty_file = 0
+        slack = []
+        def setup():
+            slack[:] = [synthetic(os.path.join(workdir, "slack"), width, height,
+                                  sparsity, tile_size, slack=16, seed=1)]
+        seconds = timed(quiet(lambda: mrf_clean.mrf_trim(Args())), repeat, setup)
+        record("clean_trim", seconds, slack[0].tiles, int(slack[0].sizes.sum()))
+
+    if "read_idx" in tools:
+        out = os.path.join(workdir, "idx.csv")
+        seconds = timed(lambda: cli(os.path.join(APPS, "mrf_read_idx.py"),
+                                    "--index", src.index, "--output", out), repeat)
+        record("read_idx", seconds, width * height, os.path.getsize(src.index))
+
+    # Read tools take one tile per invocation, time a sample
+    sample = random.Random(3).sample(records(src), min(reads, src.tiles))
+    sample_bytes = sum(sizes[tile] for tile in sample)
+    out = os.path.join(workdir, "tile.ppg")
+    if "read_data" in tools and sample:
+        def read_data():
+            for tile in sample:
+                cli(os.path.join(APPS, "mrf_read_data.py"), "--input", src.data,
+                    "--index", src.index, "--tile", str(tile), "--output", out)
+        seconds = timed(read_data, repeat)
+        record("read_data", seconds, len(sample), sample_bytes)
+
+    if "read" in tools and sample:
+        def read():
+            for tile in sample:
+                cli(os.path.join(APPS, "mrf_read.py"), "--input", src.mrf,
+                    "--tile", str(tile), "--output", out)
+        seconds = timed(read, repeat)
+        record("read", seconds, len(sample), sample_bytes)
+
+    if "tiles2mrf" in tools:
+        template = tile_tree(src, os.path.join(workdir, "tiles"))
+        out = os.path.join(workdir, "assembled")
+        seconds = timed(lambda: cli(os.path.join(APPS, "tiles2mrf.py"), "--levels", "1",
+                                    "--width", str(width), "--height", str(height),
+                                    template, out), repeat)
+        record("tiles2mrf", seconds, width * height, src_bytes)
+
+    if "can" in tools and shutil.which("can"):
+        out = os.path.join(workdir, "src.ix")
+        seconds = timed(lambda: subprocess.run(["can", "-q", src.index, out], check=True), repeat)
+        record("can", seconds, width * height, os.path.getsize(src.index))
+
+    if "can_update" in tools and shutil.which("can"):
+        # Updates a canned index by checking every data block, from a fresh full can each run
+        full = os.path.join(workdir, "full.ix")
+        out = os.path.join(workdir, "update.ix")
+        subprocess.run(["can", "-q", src.index, full], check=True)
+        seconds = timed(lambda: subprocess.run(["can", "-q", "-i", src.index, out], check=True), repeat,
+                        lambda: shutil.copyfile(full, out))
+        record("can_update", seconds, width * height, os.path.getsize(src.index))
+
+    return results
+
+
+def config_name(width, height, sparsity, tile_size):
+    return "{}x{}-s{}-t{}".format(width, height, sparsity, tile_size)
+
+
+def compare(results, baseline, tolerance):
+    '''Returns a list of (tool, current, baseline) tiles/s for the tools slower than
+    the baseline by more than the tolerance fraction
+    '''
+    regressions = []
+    for tool, result in results.items():
+        if tool not in baseline:
+            continue
+        expected = baseline[tool]["tiles_per_second"]
+        if result["tiles_per_second"] < expected * (1 - tolerance):
+            regressions.append((tool, result["tiles_per_second"], expected))
+    return regressions
+
+
+def check_baseline(results, baselines, name, tolerance):
+    '''Compares the results with the baseline of the configuration, prints the regressions.
+    Returns the exit code, NO_BASELINE when there is no baseline for the configuration'''
+    if name not in baselines:
+        print("No baseline for configuration {}, use --save-baseline to store one "
+              "or --no-baseline to skip the comparison".format(name), file=sys.stderr)
+        return NO_BASELINE
+    regressions = compare(results, baselines[name], tolerance)
+    for tool, current, expected in regressions:
+        print("REGRESSION {}: {:.1f} tiles/s, baseline {:.1f} tiles/s".format(tool, current, expected),
+              file=sys.stderr)
+    return REGRESSION if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the mrf_apps tools on synthetic MRFs")
+    parser.add_argument("-g", "--grid", default="64x64",
+                        help="Level 0 size in tiles, as WxH")
+    parser.add_argument("-s", "--sparsity", type=float, default=0.5,
+                        help="Fraction of empty tiles")
+    parser.add_argument("-t", "--tile-size", type=int, default=4096,
+                        help="Average tile size in bytes")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Runs per tool, the best one is reported")
+    parser.add_argument("-n", "--reads", type=int, default=20,
+                        help="Number of tiles read by the single tile read tools")
+    parser.add_argument("--tools", default=",".join(TOOLS),
+                        help="Comma separated list of tools to run")
+    parser.add_argument("-b", "--baseline", default=DEFAULT_BASELINE,
+                        help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store the results in the baseline file")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="Only report the results, without comparing them to a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown before reporting a regression, as a fraction")
+    parser.add_argument("-o", "--output",
+                        help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.grid.lower().split("x"))
+    tools = args.tools.split(",")
+    name = config_name(width, height, args.sparsity, args.tile_size)
+
+    workdir = tempfile.mkdtemp(prefix="mrf_bench_")
+    try:
+        results = run_benchmarks(workdir, width, height, args.sparsity, args.tile_size,
+                                 tools, args.repeat, args.reads)
+    finally:
+        shutil.rmtree(workdir)
+
+    print("Configuration {}".format(name))
+    print("{:<12}{:>10}{:>10}{:>14}{:>10}".format("tool", "seconds", "tiles", "tiles/s", "MB/s"))
+    for tool, r in results.items():
+        print("{:<12}{:>10.3f}{:>10}{:>14.1f}{:>10.1f}".format(
+            tool, r["seconds"], r["tiles"], r["tiles_per_second"], r["mb_per_second"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({name: results}, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[name] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+
+    if args.no_baseline:
+        return 0
+    return check_baseline(results, baselines, name, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -64,6 +64,12 @@ class MRFTestCase(unittest.TestCase):
                 tiles.append(struct.unpack('>QQ', chunk))
         return tiles
 
+    def create_sparse_mrf(self, name, width, height, **kwargs):
+        """Generates a synthetic, possibly very large, MRF in the test directory.
+        See mrf_fixtures.make_mrf for the options, returns a Fixture."""
+        from tests import mrf_fixtures
+        return mrf_fixtures.make_mrf(os.path.join(self.test_dir, name), width, height, **kwargs)
+
     def create_mock_jpeg(self, path, size=(16, 16), color='black'):
         """Creates a simple, valid JPEG file using Pillow."""
         with Image.new('RGB', size, color) as img:
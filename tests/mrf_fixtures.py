@@ -0,0 +1,287 @@
+# tests/mrf_fixtures.py
+#
+# Synthetic MRF generator, for tests and benchmarks that need large or sparse MRFs
+#
+# The index file is created sparse, only the 512 byte blocks that hold tile records
+# are written. The data file either holds a payload for every tile or a few distinct
+# payloads that are shared by all the tiles, in which case it stays small regardless
+# of the number of tiles. A layout with billions of possible tiles can be generated
+# in seconds, using little disk space.
+#
+# Index layout, see the MUG Appendix B:
+#   (V; l; Z, Y, X, C), the current version first, levels in decreasing resolution
+
+import os
+import numpy as np
+from xml.etree import ElementTree as ET
+
+# Data file extension for each compression
+EXTENSIONS = {
+    "PNG": "ppg", "PPNG": "ppg", "JPEG": "pjg", "JPNG": "pjp", "NONE": "til",
+    "DEFLATE": "pzp", "ZSTD": "pzs", "TIF": "ptf", "LERC": "lrc", "QB3": "pq3",
+}
+
+# Index records per 512 byte block
+BLOCK_RECORDS = 32
+
+def rupdiv(x, y):
+    return 1 + (x - 1) // y
+
+
+class Layout(object):
+    '''Tile pyramid of an MRF
+    width, height : size in pixels
+    pagesize : tile size in pixels
+    bands : number of bands, pixel interleaved unless band_interleaved is set
+    zsize : number of Z slices
+    scale : overview scale factor, None if there are no overviews
+    '''
+    def __init__(self, width, height, pagesize=512, bands=1, band_interleaved=False,
+                 zsize=1, scale=None):
+        self.width = width
+        self.height = height
+        self.pagesize = pagesize
+        self.bands = bands
+        self.band_interleaved = band_interleaved
+        self.zsize = zsize
+        self.scale = scale
+        # Index records per tile
+        self.bandpages = bands if band_interleaved else 1
+
+        # Grid size of each level, in tiles
+        self.levels = []
+        x, y = width, height
+        while True:
+            self.levels.append((rupdiv(x, pagesize), rupdiv(y, pagesize)))
+            if scale is None or self.levels[-1] == (1, 1):
+                break
+            x, y = rupdiv(x, scale), rupdiv(y, scale)
+
+        # Records per level, for one Z slice
+        self.pages = [cols * rows * self.bandpages for cols, rows in self.levels]
+        # Start record of each level
+        self.starts = [zsize * sum(self.pages[:l]) for l in range(len(self.pages))]
+        # Records in one version of the index
+        self.records = zsize * sum(self.pages)
+
+    @property
+    def index_size(self):
+        'Size in bytes of one version of the index'
+        return 16 * self.records
+
+    def record(self, level, row, col, z=0, band=0):
+        'Record number of a tile, works on numpy arrays'
+        cols = self.levels[level][0]
+        return (self.starts[level] + z * self.pages[level]
+                + (row * cols + col) * self.bandpages + band)
+
+
+def write_index(path, numbers, offsets, sizes, total_records):
+    '''Writes a sparse index file with total_records records
+    Only the blocks that hold the given records are written, the rest are holes.
+    numbers, offsets and sizes are numpy arrays, numbers have to be unique
+    '''
+    order = np.argsort(numbers, kind="stable")
+    numbers = np.asarray(numbers, dtype=np.int64)[order]
+    offsets = np.asarray(offsets, dtype=np.uint64)[order]
+    sizes = np.asarray(sizes, dtype=np.uint64)[order]
+
+    with open(path, "wb") as f:
+        f.truncate(16 * total_records)
+        if len(numbers) == 0:
+            return
+        blocks = np.unique(numbers // BLOCK_RECORDS)
+        # Split in runs of consecutive blocks, each run is written at once
+        breaks = np.flatnonzero(np.diff(blocks) != 1) + 1
+        fd = f.fileno()
+        for run in np.split(blocks, breaks):
+            first = int(run[0]) * BLOCK_RECORDS
+            last = min((int(run[-1]) + 1) * BLOCK_RECORDS, total_records)
+            lo, hi = np.searchsorted(numbers, [first, last])
+            records = np.zeros((last - first, 2), dtype=">u8")
+            records[numbers[lo:hi] - first, 0] = offsets[lo:hi]
+            records[numbers[lo:hi] - first, 1] = sizes[lo:hi]
+            os.pwrite(fd, records.tobytes(), 16 * first)
+
+
+def write_canned(index, path):
+    '''Writes an index in the canned format, byte for byte the same as can
+    The header line is followed by a bitmap line for every 96 blocks of 512 bytes,
+    a running count of the blocks with data and 96 bits, then the blocks with data.
+    '''
+    with open(index, "rb") as f:
+        raw = np.frombuffer(f.read(), dtype=np.uint8)
+    blocks = -(-len(raw) // 512)
+    padded = np.zeros(blocks * 512, dtype=np.uint8)
+    padded[:len(raw)] = raw
+    present = padded.reshape(blocks, 512).any(axis=1)
+
+    lines = -(-blocks // 96)
+    bits = np.zeros(lines * 96, dtype=bool)
+    bits[:blocks] = present
+    header = np.zeros((lines + 1, 4), dtype=">u4")
+    words = np.packbits(bits.reshape(lines, 3, 32)[:, :, ::-1], axis=2, bitorder="big")
+    header[1:, 1:] = words.view(">u4").reshape(lines, 3)
+    counts = np.concatenate([[0], np.cumsum(bits.reshape(lines, 96).sum(axis=1))])
+    header[1:, 0] = counts[:-1]
+    # Empty leading lines are marked, except for the last line. can stores the
+    # marker in host order before swapping the header, so it reads "\0XDI"
+    header[1:lines][counts[1:lines] == 0, 0] = 0x00584449
+
+    with open(path, "wb") as f:
+        f.write(b"IDX\0" + np.array([lines + 1], ">u4").tobytes() + np.array([len(raw)], ">u8").tobytes())
+        f.write(header[1:].tobytes())
+        for block in np.flatnonzero(present):
+            f.write(raw[512 * block: 512 * block + 512].tobytes())
+
+
+def write_data(path, sizes, payload="random", distinct=16, slack=0, seed=0):
+    '''Writes a data file for tiles of the given sizes, returns the tile offsets
+    payload "random" writes every tile, in order, separated by slack bytes.
+    payload "duplicate" writes distinct random payloads of the largest size and
+    every tile points to the start of one of them.
+    '''
+    rng = np.random.default_rng(seed)
+    sizes = np.asarray(sizes, dtype=np.uint64)
+    with open(path, "wb") as f:
+        if payload == "duplicate":
+            largest = int(sizes.max()) if len(sizes) else 0
+            f.write(rng.integers(0, 256, largest * distinct, dtype=np.uint8).tobytes())
+            choice = rng.integers(0, distinct, len(sizes), dtype=np.uint64)
+            return choice * np.uint64(largest)
+
+        if payload != "random":
+            raise ValueError("Unknown payload type {}".format(payload))
+        steps = sizes + np.uint64(slack)
+        offsets = np.zeros(len(sizes), dtype=np.uint64)
+        if len(sizes):
+            np.cumsum(steps[:-1], out=offsets[1:])
+        total = int(steps.sum())
+        # The content doesn't have to be different, a random block is repeated
+        chunk = rng.integers(0, 256, 1 << 20, dtype=np.uint8).tobytes()
+        while total > 0:
+            f.write(chunk[:min(total, len(chunk))])
+            total -= len(chunk)
+        return offsets
+
+
+def write_mrf(path, layout, compression="PNG", datafile=None, indexfile=None,
+              versioned=False, bbox=(-180, -90, 180, 90),
+              projection='GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'):
+    'Writes the MRF metadata file for a layout'
+    root = ET.Element("MRF_META")
+    raster = ET.SubElement(root, "Raster")
+    if versioned:
+        raster.set("versioned", "on")
+    size = ET.SubElement(raster, "Size", x=str(layout.width), y=str(layout.height),
+                         c=str(layout.bands))
+    if layout.zsize != 1:
+        size.set("z", str(layout.zsize))
+    ET.SubElement(raster, "PageSize", x=str(layout.pagesize), y=str(layout.pagesize),
+                  c=str(1 if layout.band_interleaved else layout.bands))
+    ET.SubElement(raster, "Compression").text = compression
+    if datafile:
+        ET.SubElement(raster, "DataFile").text = datafile
+    if indexfile:
+        ET.SubElement(raster, "IndexFile").text = indexfile
+    if layout.scale is not None:
+        ET.SubElement(root, "Rsets", model="uniform", scale=str(layout.scale))
+    geotags = ET.SubElement(root, "GeoTags")
+    ET.SubElement(geotags, "BoundingBox", minx=str(bbox[0]), miny=str(bbox[1]),
+                  maxx=str(bbox[2]), maxy=str(bbox[3]))
+    ET.SubElement(geotags, "Projection").text = projection
+    ET.ElementTree(root).write(path)
+
+
+def select_tiles(layout, density, rng, overviews=True):
+    '''Picks the tiles that exist, returns their record numbers
+    A fraction of level 0 tiles is picked at random, for every Z slice and band.
+    With overviews, the parents of the level 0 tiles exist at every level.
+    '''
+    cols, rows = layout.levels[0]
+    total = cols * rows
+    count = int(round(total * density))
+    if total <= (1 << 24):
+        picked = rng.permutation(total)[:count]
+    else:
+        # Sample with replacement, duplicates are few for sparse selections
+        picked = np.unique(rng.integers(0, total, count, dtype=np.int64))
+    r, c = np.divmod(picked.astype(np.int64), cols)
+
+    numbers = []
+    levels = range(len(layout.levels)) if overviews else range(1)
+    for level in levels:
+        if level > 0:
+            r, c = np.unique(np.stack((r // layout.scale, c // layout.scale)), axis=1)
+        for z in range(layout.zsize):
+            for band in range(layout.bandpages):
+                numbers.append(layout.record(level, r, c, z, band))
+    return np.sort(np.concatenate(numbers)) if numbers else np.zeros(0, dtype=np.int64)
+
+
+class Fixture(object):
+    'The files of a generated MRF and what they contain'
+    def __init__(self, base, layout, compression):
+        self.base = base
+        self.layout = layout
+        self.mrf = base + ".mrf"
+        self.index = base + ".idx"
+        self.data = base + "." + EXTENSIONS.get(compression, "dat")
+        self.numbers = None
+        self.offsets = None
+        self.sizes = None
+        self.versions = 1
+
+    @property
+    def tiles(self):
+        return len(self.numbers)
+
+
+def make_mrf(base, width, height, pagesize=512, bands=1, band_interleaved=False,
+             zsize=1, scale=None, density=0.5, tile_size=(1024, 4096),
+             payload="random", distinct=16, slack=0, versions=1, churn=0.1,
+             compression="PNG", explicit_names=False, seed=0):
+    '''Generates a synthetic MRF, returns a Fixture
+    base : file name without extension
+    density : fraction of level 0 tiles that exist
+    tile_size : tile size in bytes, or a (min, max) range for random sizes
+    payload : "random" for a payload per tile, "duplicate" for shared payloads
+    versions : number of index versions, in older versions a churn fraction of
+        the tiles have a different payload
+    explicit_names : write the DataFile and IndexFile nodes in the metadata
+    '''
+    rng = np.random.default_rng(seed)
+    layout = Layout(width, height, pagesize, bands, band_interleaved, zsize, scale)
+    fixture = Fixture(base, layout, compression)
+
+    numbers = select_tiles(layout, density, rng, scale is not None)
+    if isinstance(tile_size, int):
+        sizes = np.full(len(numbers), tile_size, dtype=np.uint64)
+    else:
+        sizes = rng.integers(tile_size[0], tile_size[1] + 1, len(numbers), dtype=np.uint64)
+    # Older versions follow the current one, a churn fraction of their tiles
+    # have their own payload, written after the current tiles
+    changed = [rng.random(len(numbers)) < churn for _ in range(1, versions)]
+    all_sizes = np.concatenate([sizes] + [sizes[c] for c in changed])
+    all_offsets = write_data(fixture.data, all_sizes, payload, distinct, slack, seed)
+    offsets = all_offsets[:len(numbers)]
+
+    fixture.numbers, fixture.offsets, fixture.sizes = numbers, offsets, sizes
+    fixture.versions = versions
+
+    all_numbers, version_offsets = [numbers], [offsets]
+    start = len(numbers)
+    for version, c in enumerate(changed, 1):
+        old = offsets.copy()
+        old[c] = all_offsets[start:start + np.count_nonzero(c)]
+        start += np.count_nonzero(c)
+        all_numbers.append(numbers + version * layout.records)
+        version_offsets.append(old)
+    write_index(fixture.index, np.concatenate(all_numbers), np.concatenate(version_offsets),
+                np.tile(sizes, versions), versions * layout.records)
+
+    write_mrf(fixture.mrf, layout, compression,
+              os.path.basename(fixture.data) if explicit_names else None,
+              os.path.basename(fixture.index) if explicit_names else None,
+              versions > 1)
+    return fixture
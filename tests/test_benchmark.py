@@ -0,0 +1,73 @@
+# tests/test_benchmark.py
+
+import os
+import shutil
+from tests.helpers import MRFTestCase
+from tests import benchmark
+
+class TestBenchmark(MRFTestCase):
+    """
+    Tests for the benchmark suite itself, on a tiny configuration.
+    """
+
+    def test_synthetic_mrf(self):
+        """Test that the synthetic MRF index, data and tile tree agree."""
+        base = os.path.join(self.test_dir, "syn")
+        syn = benchmark.synthetic(base, 4, 3, 0.5, 100, seed=5)
+        records = self.read_idx_file(base + ".idx")
+        self.assertEqual(len(records), 12)
+        present = [r for r in records if r[1]]
+        self.assertEqual(len(present), syn.tiles)
+        self.assertTrue(all(50 <= size <= 150 for _, size in present))
+        self.assertEqual(sum(size for _, size in present), os.path.getsize(base + ".ppg"))
+        self.assertEqual(benchmark.records(syn), [i + 1 for i, r in enumerate(records) if r[1]])
+
+        template = benchmark.tile_tree(syn, os.path.join(self.test_dir, "tiles"))
+        with open(base + ".ppg", "rb") as f:
+            data = f.read()
+        for i, (offset, size) in enumerate(records):
+            with open(template.format(z=0, x=i % 4, y=i // 4), "rb") as f:
+                self.assertEqual(f.read(), data[offset:offset + size])
+
+    def test_run_benchmarks(self):
+        """Test that the python tools are timed and reported."""
+        tools = ("join", "clean_copy", "clean_trim")
+        results = benchmark.run_benchmarks(self.test_dir, 4, 4, 0.25, 64, tools, repeat=1)
+        self.assertEqual(sorted(results), sorted(tools))
+        for result in results.values():
+            self.assertGreater(result["tiles"], 0)
+            self.assertGreater(result["tiles_per_second"], 0)
+
+    def test_read_bytes(self):
+        """Test that the single tile read tools report the bytes of the tiles actually read."""
+        results = benchmark.run_benchmarks(self.test_dir, 4, 4, 0.25, 64, ("read_data",), repeat=1, reads=16)
+        src = benchmark.synthetic(os.path.join(self.test_dir, "again"), 4, 4, 0.25, 64, seed=1)
+        self.assertEqual(results["read_data"]["tiles"], src.tiles)
+        self.assertEqual(results["read_data"]["bytes"], int(src.sizes.sum()))
+
+    def test_can_update(self):
+        """Test that the canned index update is timed after a full can, when can is available."""
+        if not shutil.which(self.can_executable):
+            self.skipTest(f"'{self.can_executable}' executable not found in PATH.")
+        results = benchmark.run_benchmarks(self.test_dir, 64, 64, 0.5, 64, ("can", "can_update"), repeat=2)
+        self.assertEqual(sorted(results), ["can", "can_update"])
+        self.assertEqual(results["can_update"]["tiles"], 64 * 64)
+        self.assertEqual(results["can_update"]["bytes"], 64 * 64 * 16)
+
+    def test_compare_with_baseline(self):
+        """Test that tools slower than the baseline by more than the tolerance are reported."""
+        baseline = {"join": {"tiles_per_second": 1000.0},
+                    "read": {"tiles_per_second": 10.0}}
+        results = {"join": {"tiles_per_second": 850.0},
+                   "read": {"tiles_per_second": 7.0},
+                   "can": {"tiles_per_second": 1.0}}
+        regressions = benchmark.compare(results, baseline, 0.2)
+        self.assertEqual(regressions, [("read", 7.0, 10.0)])
+
+    def test_check_baseline(self):
+        """Test that a missing baseline and a regression give distinct non-zero exit codes."""
+        results = {"join": {"tiles_per_second": 700.0}}
+        baselines = {"4x4": {"join": {"tiles_per_second": 1000.0}}}
+        self.assertEqual(benchmark.check_baseline(results, baselines, "8x8", 0.2), benchmark.NO_BASELINE)
+        self.assertEqual(benchmark.check_baseline(results, baselines, "4x4", 0.2), benchmark.REGRESSION)
+        self.assertEqual(benchmark.check_baseline(results, baselines, "4x4", 0.5), 0)
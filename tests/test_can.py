@@ -31,3 +31,70 @@ class TestCanUtility(MRFTestCase):
         
         subprocess.run([self.can_executable, "-u", "-g", can_path, out_idx_path], check=True)
         self.assertTrue(filecmp.cmp(idx_path, out_idx_path, shallow=False))
+
+    def test_can_update(self):
+        """Test that updating a canned index after some blocks change gives the same file as canning it again."""
+        if not shutil.which(self.can_executable):
+            self.skipTest(f"'{self.can_executable}' executable not found in PATH.")
+
+        idx_path = os.path.join(self.test_dir, "test.idx")
+        can_path = os.path.join(self.test_dir, "test.ix")
+        full_path = os.path.join(self.test_dir, "full.ix")
+        list_path = os.path.join(self.test_dir, "blocks.txt")
+
+        def write_blocks(blocks):
+            # Sparse index of 300 blocks, spanning four bitmap lines
+            with open(idx_path, 'wb') as f:
+                f.truncate(300 * 512)
+                for block, value in blocks.items():
+                    f.seek(block * 512)
+                    f.write(struct.pack('>QQ', value, 512) * (512 // 16))
+
+        blocks = {3: 1, 100: 2, 150: 3, 299: 4}
+        write_blocks(blocks)
+        subprocess.run([self.can_executable, "-q", "-g", idx_path, can_path], check=True)
+
+        # Blocks change content, appear and disappear
+        blocks.update({100: 5, 120: 6, 250: 7})
+        del blocks[150]
+        write_blocks(blocks)
+        with open(list_path, 'w') as f:
+            f.write("100\n120\n150\n250\n")
+        subprocess.run([self.can_executable, "-q", "-g", "-b", list_path, idx_path, can_path], check=True)
+        subprocess.run([self.can_executable, "-q", "-g", idx_path, full_path], check=True)
+        self.assertTrue(filecmp.cmp(can_path, full_path, shallow=False))
+
+        # Without a list, the data blocks of the index are checked
+        blocks[3] = 8
+        del blocks[299]
+        write_blocks(blocks)
+        subprocess.run([self.can_executable, "-q", "-g", "-i", idx_path, can_path], check=True)
+        subprocess.run([self.can_executable, "-q", "-g", idx_path, full_path], check=True)
+        self.assertTrue(filecmp.cmp(can_path, full_path, shallow=False))
+
+    def test_can_update_every_block(self):
+        """Test that rewriting the content of every data block, then updating, gives the same file as canning again."""
+        if not shutil.which(self.can_executable):
+            self.skipTest(f"'{self.can_executable}' executable not found in PATH.")
+
+        idx_path = os.path.join(self.test_dir, "test.idx")
+        can_path = os.path.join(self.test_dir, "test.ix")
+        full_path = os.path.join(self.test_dir, "full.ix")
+
+        def write_blocks(value):
+            # Every other block present, over 32 bitmap lines
+            data_block = struct.pack('>QQ', value, 512) * (512 // 16)
+            with open(idx_path, 'wb') as f:
+                f.truncate(2**12 * 512)
+                for block in range(0, 2**12, 2):
+                    f.seek(block * 512)
+                    f.write(data_block)
+
+        write_blocks(1)
+        subprocess.run([self.can_executable, "-q", "-g", idx_path, can_path], check=True)
+
+        # The same blocks with new content, each one is rewritten in place
+        write_blocks(2)
+        subprocess.run([self.can_executable, "-q", "-g", "-i", idx_path, can_path], check=True)
+        subprocess.run([self.can_executable, "-q", "-g", idx_path, full_path], check=True)
+        self.assertTrue(filecmp.cmp(can_path, full_path, shallow=False))
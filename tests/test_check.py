@@ -0,0 +1,103 @@
+import os
+import json
+import struct
+import subprocess
+import numpy as np
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_check
+
+class TestMRFCheck(MRFTestCase):
+    """
+    Tests for mrf_check.py, which validates the index of an MRF against its metadata and data file.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 8x8 tiles at full resolution and overviews
+        self.fixture = self.create_sparse_mrf("test", 4096, 4096, scale=2, density=0.5,
+                                              tile_size=(100, 900), slack=8)
+
+    def write_record(self, record, offset, size):
+        with open(self.fixture.index, "r+b") as f:
+            f.seek(16 * record)
+            f.write(struct.pack(">QQ", offset, size))
+
+    def test_valid(self):
+        """Test a sound MRF, checked in one chunk and in several worker processes."""
+        report = mrf_check.check(self.fixture.mrf)
+        self.assertTrue(report['ok'], report)
+        self.assertEqual(report['tiles'], self.fixture.tiles)
+        self.assertEqual(report['index_records'], self.fixture.layout.records)
+        self.assertEqual(report['used_bytes'], int(self.fixture.sizes.sum()))
+
+        chunked = mrf_check.check(self.fixture.mrf, workers=2, chunk=7)
+        for key in ('ok', 'tiles', 'shared_tiles', 'used_bytes', 'checks'):
+            self.assertEqual(chunked[key], report[key])
+
+    def test_shared_tiles(self):
+        """Test that identical tiles are accepted as shared, not reported as overlapping."""
+        fixture = self.create_sparse_mrf("dup", 4096, 4096, density=1.0, tile_size=300,
+                                         payload="duplicate", distinct=4)
+        report = mrf_check.check(fixture.mrf, workers=2, chunk=16)
+        self.assertTrue(report['ok'], report)
+        self.assertEqual(report['shared_tiles'], 64 - 4)
+        self.assertEqual(report['used_bytes'], 4 * 300)
+
+    def test_merge(self):
+        """Test the block merge of sorted chunks against a sort of all the tiles."""
+        rng = np.random.default_rng(4)
+        runs = []
+        for n in (0, 1, 50, 200, 333):
+            offsets = rng.integers(0, 100, n).astype(np.uint64)
+            sizes = rng.integers(1, 4, n).astype(np.uint64)
+            order = np.lexsort((sizes, offsets))
+            runs.append((offsets[order], sizes[order], rng.integers(0, 10**6, n).astype(np.uint64)[order]))
+        merged = [np.concatenate(a) for a in zip(*mrf_check.merge_runs(runs, block=7))]
+        offsets, sizes, records = (np.concatenate(a) for a in zip(*runs))
+        order = np.lexsort((sizes, offsets))
+        self.assertTrue((merged[0] == offsets[order]).all())
+        self.assertTrue((merged[1] == sizes[order]).all())
+        self.assertEqual(sorted(merged[2].tolist()), sorted(records.tolist()))
+
+        keep = mrf_check.unique_mask(offsets[order], sizes[order])
+        overlap, shared, used = mrf_check.check_overlap(runs, block=7)
+        self.assertEqual(shared, len(keep) - int(keep.sum()))
+        self.assertEqual(used, int(sizes[order][keep].sum()))
+        self.assertEqual((overlap, shared, used), mrf_check.check_overlap(runs))
+        self.assertFalse(overlap['ok'])
+
+    def test_problems(self):
+        """Test that each kind of problem is found and reported with the record."""
+        records = [int(n) for n in self.fixture.numbers[:3]]
+        offsets = [int(o) for o in self.fixture.offsets[:3]]
+        data_size = os.path.getsize(self.fixture.data)
+        self.write_record(records[0], data_size + 10, 100)  # Past the end
+        self.write_record(records[1], offsets[2] + 10, 100)  # Inside the next tile
+        self.write_record(records[2], offsets[2], 20)  # Too small for a PNG
+        report = mrf_check.check(self.fixture.mrf, workers=2, chunk=5)
+        checks = report['checks']
+        self.assertFalse(report['ok'])
+        self.assertTrue(checks['layout']['ok'])
+        self.assertEqual(checks['bounds']['samples'], [[records[0], data_size + 10, 100]])
+        self.assertEqual(checks['size']['count'], 1)
+        self.assertEqual(checks['size']['samples'][0][0], records[2])
+        self.assertEqual(checks['overlap']['count'], 1)
+        self.assertEqual(checks['overlap']['samples'][0][0], records[1])
+
+        with open(self.fixture.index, "r+b") as f:
+            f.truncate(16 * (self.fixture.layout.records - 1))
+        self.assertFalse(mrf_check.check(self.fixture.mrf)['checks']['layout']['ok'])
+
+    def test_cli(self):
+        """Test the exit code and the JSON report written by the script."""
+        output = os.path.join(self.test_dir, "report.json")
+        cmd = ["python3", "mrf_apps/mrf_check.py", self.fixture.mrf, "-o", output]
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        with open(output) as f:
+            self.assertTrue(json.load(f)['ok'])
+
+        self.write_record(int(self.fixture.numbers[0]), os.path.getsize(self.fixture.data), 100)
+        result = subprocess.run(["python3", "mrf_apps/mrf_check.py", self.fixture.mrf],
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(json.loads(result.stdout)['checks']['bounds']['count'], 1)
@@ -0,0 +1,100 @@
+import io
+import os
+import sqlite3
+import tarfile
+import subprocess
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_export, mrf_read, mrf_reader
+
+class TestMRFExport(MRFTestCase):
+    """
+    Tests for mrf_export.py, which copies the tiles of an MRF to a tile tree, a tar or an MBTiles file.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Random payloads with slack, so that gaps between tiles matter
+        self.fixture = self.create_sparse_mrf("export", 4096, 2048, scale=2, density=0.5,
+                                              tile_size=(100, 3000), slack=200, seed=7)
+        levels = self.fixture.layout.levels
+        self.tiles = {}
+        for level, (cols, rows) in enumerate(levels):
+            for row in range(rows):
+                for col in range(cols):
+                    data = mrf_read.read_tile(self.fixture.mrf, level, row, col)
+                    if data:
+                        self.tiles[(len(levels) - 1 - level, col, row)] = data
+        self.positions = sum(cols * rows for cols, rows in levels)
+
+    def test_path_template(self):
+        """Test that the tile tree holds exactly the non-empty tiles, read in data file order."""
+        with mrf_reader.MRFReader(self.fixture.mrf) as reader:
+            offsets, sizes, zooms, columns, rows = mrf_export.scan(reader)
+        self.assertEqual(len(offsets), self.fixture.tiles)
+        self.assertTrue((offsets[1:] >= offsets[:-1]).all())
+        reads = mrf_export.batches(offsets, sizes, gap=100)
+        self.assertEqual(reads[-1][1], len(offsets))
+        self.assertEqual(len(reads), len(offsets))
+        self.assertLess(len(mrf_export.batches(offsets, sizes, gap=200)), 5)
+        self.assertGreater(len(mrf_export.batches(offsets, sizes, chunk=4096)), 10)
+
+        template = os.path.join(self.test_dir, "tree", "{z}", "{x}", "{y}.{ext}")
+        summary = mrf_export.export(self.fixture.mrf, template, workers=4)
+        self.assertEqual(summary['tiles'], self.fixture.tiles)
+        self.assertEqual(summary['bytes'], int(self.fixture.sizes.sum()))
+        written = 0
+        for _, _, files in os.walk(os.path.join(self.test_dir, "tree")):
+            written += len(files)
+        self.assertEqual(written, len(self.tiles))
+        for (z, x, y), data in self.tiles.items():
+            with open(template.format(z=z, x=x, y=y, ext="png"), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_tar_blank(self):
+        """Test the tar output with a blank tile, stored once and hard linked for every empty tile."""
+        output = os.path.join(self.test_dir, "export.tar")
+        summary = mrf_export.export(self.fixture.mrf, output, blank=b"blank tile", workers=2)
+        self.assertEqual(summary['blank'], self.positions - len(self.tiles))
+        with tarfile.open(output) as tar:
+            members = tar.getmembers()
+            self.assertEqual(len(members), self.positions)
+            links = [m for m in members if m.islnk()]
+            self.assertEqual(len(links), self.positions - len(self.tiles) - 1)
+            self.assertEqual(len({m.linkname for m in links}), 1)
+            for (z, x, y), data in self.tiles.items():
+                self.assertEqual(tar.extractfile("{}/{}/{}.png".format(z, x, y)).read(), data)
+            blank = next(m for m in members if m.isfile() and tuple(
+                int(v) for v in m.name[:-4].split("/")) not in self.tiles)
+            self.assertEqual(tar.extractfile(blank).read(), b"blank tile")
+
+    def test_mbtiles(self):
+        """Test the MBTiles output, with rows counted from the bottom and shared tiles stored once."""
+        shared = self.create_sparse_mrf("shared", 4096, 2048, scale=2, density=0.5, payload="duplicate",
+                                        distinct=4, seed=8)
+        output = os.path.join(self.test_dir, "shared.mbtiles")
+        mrf_export.export(shared.mrf, output)
+        levels = shared.layout.levels
+        db = sqlite3.connect(output)
+        try:
+            metadata = dict(db.execute("SELECT name, value FROM metadata"))
+            self.assertEqual(metadata['format'], "png")
+            self.assertEqual(metadata['maxzoom'], str(len(levels) - 1))
+            rows = db.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles").fetchall()
+            self.assertEqual(len(rows), shared.tiles)
+            for z, x, tms_y, data in rows:
+                level = len(levels) - 1 - z
+                y = levels[level][1] - 1 - tms_y
+                self.assertEqual(bytes(data), mrf_read.read_tile(shared.mrf, level, y, x))
+            images = db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            self.assertEqual(images, len(set(zip(shared.offsets, shared.sizes))))
+        finally:
+            db.close()
+
+    def test_cli_stream(self):
+        """Test the script writing a tar stream to stdout."""
+        result = subprocess.run(["python3", "mrf_apps/mrf_export.py", "-t", "{z}-{x}-{y}.{ext}", self.fixture.mrf, "-"],
+                                check=True, capture_output=True)
+        self.assertIn("Exported {} tiles".format(len(self.tiles)).encode(), result.stderr)
+        with tarfile.open(fileobj=io.BytesIO(result.stdout), mode="r|") as tar:
+            names = {m.name: tar.extractfile(m).read() for m in tar}
+        self.assertEqual(names, {"{}-{}-{}.png".format(*key): data for key, data in self.tiles.items()})
@@ -0,0 +1,78 @@
+# tests/test_fixtures.py
+
+import os
+import numpy as np
+from xml.etree import ElementTree as ET
+from tests.helpers import MRFTestCase
+from tests import mrf_fixtures
+
+class TestFixtures(MRFTestCase):
+    """
+    Tests for the synthetic MRF generator.
+    """
+
+    def read_records(self, path):
+        return np.fromfile(path, dtype=">u8").reshape(-1, 2)
+
+    def test_layout(self):
+        """Test the pyramid and record numbers of a layout with Z slices and bands."""
+        layout = mrf_fixtures.Layout(3000, 1500, 512, bands=3, band_interleaved=True,
+                                     zsize=2, scale=2)
+        self.assertEqual(layout.levels, [(6, 3), (3, 2), (2, 1), (1, 1)])
+        self.assertEqual(layout.pages, [54, 18, 6, 3])
+        self.assertEqual(layout.starts, [0, 108, 144, 156])
+        self.assertEqual(layout.records, 162)
+        # Second Z slice, row 1, column 2, band 1 of the first overview
+        self.assertEqual(layout.record(1, 1, 2, z=1, band=1), 108 + 18 + 5 * 3 + 1)
+
+    def test_index_matches_data(self):
+        """Test that every written record points to its payload and the rest are empty."""
+        fixture = self.create_sparse_mrf("small", 4096, 2048, scale=2, density=0.3,
+                                         tile_size=(10, 100))
+        records = self.read_records(fixture.index)
+        self.assertEqual(len(records), fixture.layout.records)
+        present = np.flatnonzero(records[:, 1])
+        np.testing.assert_array_equal(present, fixture.numbers)
+        np.testing.assert_array_equal(records[present, 0], fixture.offsets)
+        self.assertEqual(os.path.getsize(fixture.data), int(fixture.sizes.sum()))
+        # Overview tiles exist above the level 0 tiles
+        self.assertTrue(np.any(fixture.numbers >= fixture.layout.starts[1]))
+        self.assertIn(fixture.layout.starts[-1], fixture.numbers)
+
+    def test_metadata(self):
+        """Test the metadata of a versioned MRF with Z slices and overviews."""
+        fixture = self.create_sparse_mrf("meta", 1024, 1024, bands=3, zsize=4, scale=2,
+                                         versions=3, explicit_names=True, tile_size=64)
+        root = ET.parse(fixture.mrf).getroot()
+        raster = root.find("Raster")
+        self.assertEqual(raster.get("versioned"), "on")
+        self.assertEqual(raster.find("Size").attrib, {"x": "1024", "y": "1024", "c": "3", "z": "4"})
+        self.assertEqual(raster.find("PageSize").get("c"), "3")
+        self.assertEqual(raster.find("DataFile").text, "meta.ppg")
+        self.assertEqual(raster.find("IndexFile").text, "meta.idx")
+        self.assertEqual(root.find("Rsets").get("scale"), "2")
+        self.assertEqual(os.path.getsize(fixture.index), 3 * fixture.layout.index_size)
+        # The older versions hold the same tiles
+        records = self.read_records(fixture.index).reshape(3, -1, 2)
+        for version in (1, 2):
+            np.testing.assert_array_equal(records[version, :, 1], records[0, :, 1])
+
+    def test_duplicate_payload(self):
+        """Test that duplicated payloads keep the data file small."""
+        fixture = self.create_sparse_mrf("dup", 65536, 65536, density=1.0, tile_size=200,
+                                         payload="duplicate", distinct=4)
+        self.assertEqual(fixture.tiles, 128 * 128)
+        self.assertEqual(os.path.getsize(fixture.data), 800)
+        self.assertTrue(set(np.unique(fixture.offsets)) <= {0, 200, 400, 600})
+
+    def test_planet_scale_sparse(self):
+        """Test that a very large, very sparse layout only writes the used index blocks."""
+        # 2^19 x 2^18 tiles at level 0, a 2.7TB index if it were dense
+        fixture = self.create_sparse_mrf("planet", 512 << 19, 512 << 18, scale=2,
+                                         density=2e-9, tile_size=100, payload="duplicate")
+        self.assertEqual(os.path.getsize(fixture.index), fixture.layout.index_size)
+        self.assertLess(os.stat(fixture.index).st_blocks * 512, 32 << 20)
+        with open(fixture.index, "rb") as f:
+            for number in fixture.numbers[:50]:
+                f.seek(16 * int(number))
+                self.assertNotEqual(f.read(16)[8:], bytes(8))
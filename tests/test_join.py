@@ -2,6 +2,7 @@
 
 import os
 import shutil
+import subprocess
 from xml.etree import ElementTree as ET
 from tests.helpers import MRFTestCase
 from mrf_apps import mrf_join # Import the script to test its functions directly
@@ -206,3 +207,139 @@ class TestMRFJoin(MRFTestCase):
         self.assertEqual(final_idx[3], expected_s1_l0t1) # L0S1T1
         self.assertEqual(final_idx[4], expected_s0_l1t0) # L1S0T0
         self.assertEqual(final_idx[5], expected_s1_l1t0) # L1S1T0
+
+    def create_granule(self, name, tiles):
+        """Creates a 4 tile input from a {tile: bytes} dictionary, returns the data file name."""
+        base = os.path.join(self.test_dir, name)
+        data, index, offset = [], [(0, 0)] * 4, 0
+        for tile, content in sorted(tiles.items()):
+            data.append(content)
+            index[tile] = (offset, len(content))
+            offset += len(content)
+        self.create_mock_mrf_xml(base + ".mrf", xsize=2048)
+        self.create_mock_data(base + ".dat", data)
+        self.create_mock_idx(base + ".idx", index)
+        return base + ".dat"
+
+    def tile_contents(self, data_file):
+        """List of tile contents of an MRF, by index record."""
+        base = os.path.splitext(data_file)[0]
+        with open(data_file, "rb") as f:
+            content = f.read()
+        return [content[o:o + s] for o, s in self.read_idx_file(base + ".idx")]
+
+    def test_mrf_join_incremental(self):
+        """Test that a re-run with a late input appends only that input and matches a full join."""
+        inputs = [self.create_granule("g1", {0: b'A' * 10, 1: b'B' * 10}),
+                  self.create_granule("g2", {1: b'C' * 5}),
+                  self.create_granule("g3", {3: b'D' * 7})]
+        output = os.path.join(self.test_dir, "inc.dat")
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(self.tile_contents(output), [b'A' * 10, b'C' * 5, b'', b'D' * 7])
+        self.assertTrue(os.path.isfile(os.path.join(self.test_dir, "inc.join.json")))
+        size = os.path.getsize(output)
+
+        # Nothing changed, nothing is written
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(os.path.getsize(output), size)
+
+        # A late input only adds its own data
+        inputs.append(self.create_granule("g4", {1: b'E' * 3, 2: b'F' * 4}))
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(os.path.getsize(output), size + 7)
+        full = os.path.join(self.test_dir, "full.dat")
+        mrf_join.mrf_join(inputs + [full])
+        self.assertEqual(self.tile_contents(output), self.tile_contents(full))
+
+    def test_mrf_join_incremental_changed_removed(self):
+        """Test that the tiles of changed and removed inputs are rebuilt from the remaining inputs."""
+        inputs = [self.create_granule("g1", {0: b'A' * 10, 1: b'B' * 10}),
+                  self.create_granule("g2", {1: b'C' * 5, 2: b'D' * 5}),
+                  self.create_granule("g3", {0: b'E' * 7})]
+        output = os.path.join(self.test_dir, "inc.dat")
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(self.tile_contents(output), [b'E' * 7, b'C' * 5, b'D' * 5, b''])
+        size = os.path.getsize(output)
+
+        # g2 loses tile 2 and gains tile 3, g3 is dropped
+        self.create_granule("g2", {1: b'G' * 6, 3: b'H' * 2})
+        mrf_join.mrf_join_incremental(inputs[:2] + [output])
+        self.assertEqual(self.tile_contents(output), [b'A' * 10, b'G' * 6, b'', b'H' * 2])
+        self.assertEqual(os.path.getsize(output), size + 8)
+
+    def test_mrf_join_incremental_rewritten_data(self):
+        """Test that a data file rewritten in place, with the same size and index, is joined again."""
+        inputs = [self.create_granule("g1", {0: b'A' * 10, 1: b'B' * 10}),
+                  self.create_granule("g2", {2: b'C' * 5})]
+        output = os.path.join(self.test_dir, "inc.dat")
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(self.tile_contents(output), [b'A' * 10, b'B' * 10, b'C' * 5, b''])
+
+        with open(inputs[0], "r+b") as f:
+            f.write(b'X' * 10 + b'Y' * 10)
+        future = os.path.getmtime(inputs[0]) + 10
+        os.utime(inputs[0], (future, future))
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(self.tile_contents(output), [b'X' * 10, b'Y' * 10, b'C' * 5, b''])
+
+        # The manifest keeps the new time, the next run skips the input
+        size = os.path.getsize(output)
+        mrf_join.mrf_join_incremental(inputs + [output])
+        self.assertEqual(os.path.getsize(output), size)
+
+    def test_mrf_join_incremental_cli(self):
+        """Test the --incremental option, a touched but identical input is skipped."""
+        inputs = [self.create_granule("g1", {0: b'A' * 10}), self.create_granule("g2", {2: b'B' * 4})]
+        output = os.path.join(self.test_dir, "inc.dat")
+        cmd = ["python3", "mrf_apps/mrf_join.py", "--incremental"] + inputs + [output]
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        os.utime(os.path.join(self.test_dir, "g1.idx"))
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("Skipping", result.stdout)
+        self.assertNotIn("Processing", result.stdout)
+        self.assertEqual(self.tile_contents(output), [b'A' * 10, b'', b'B' * 4, b''])
+
+    def test_mrf_append_parallel(self):
+        """Test that the parallel append produces the same files as the sequential one."""
+        inputs = [self.create_sparse_mrf("day{}".format(i), 2048, 1024, scale=2, density=0.5,
+                                         tile_size=(10, 200), seed=i).data for i in range(12)]
+        sequential = os.path.join(self.test_dir, "seq.ppg")
+        parallel = os.path.join(self.test_dir, "par.ppg")
+        mrf_join.mrf_append(inputs, sequential, 16, 2)
+        cmd = ["python3", "mrf_apps/mrf_join.py", "-z", "16", "-s", "2", "-j", "4",
+               "-o", parallel] + inputs
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        for ext in (".ppg", ".idx"):
+            with open(os.path.join(self.test_dir, "seq" + ext), "rb") as f:
+                expected = f.read()
+            with open(os.path.join(self.test_dir, "par" + ext), "rb") as f:
+                self.assertEqual(f.read(), expected)
+        # Appending more slices to an existing output
+        mrf_join.mrf_append(inputs[:2], sequential, 16, 14)
+        mrf_join.mrf_append(inputs[:2], parallel, 16, 14, workers=2)
+        self.assertEqual(self.read_idx_file(os.path.join(self.test_dir, "par.idx")),
+                         self.read_idx_file(os.path.join(self.test_dir, "seq.idx")))
+
+        # Slices past the end of the output are rejected before anything is written
+        before = self.read_idx_file(os.path.join(self.test_dir, "par.idx"))
+        size = os.path.getsize(parallel)
+        for workers in (1, 3):
+            with self.assertRaises(AssertionError):
+                mrf_join.mrf_append(inputs[:3], parallel, 16, 14, workers=workers)
+        self.assertEqual(self.read_idx_file(os.path.join(self.test_dir, "par.idx")), before)
+        self.assertEqual(os.path.getsize(parallel), size)
+
+    def test_mrf_append_parallel_markers(self):
+        """Test that records with an offset and no size, such as the [1, 0] empty tile marker, are appended in parallel too."""
+        inputs = []
+        for i in range(4):
+            base = os.path.join(self.test_dir, "m{}".format(i))
+            self.create_append_input(base, [b'A' * (i + 1)], [(1, 0), (0, i + 1)], xsize=1024)
+            inputs.append(base + ".dat")
+        sequential = os.path.join(self.test_dir, "seq.dat")
+        parallel = os.path.join(self.test_dir, "par.dat")
+        mrf_join.mrf_append(inputs, sequential, 4)
+        mrf_join.mrf_append(inputs, parallel, 4, workers=4)
+        expected = self.read_idx_file(os.path.join(self.test_dir, "seq.idx"))
+        self.assertEqual(self.read_idx_file(os.path.join(self.test_dir, "par.idx")), expected)
+        self.assertEqual(sum(1 for offset, size in expected if offset and not size), 4)
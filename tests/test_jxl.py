@@ -72,6 +72,37 @@ class TestJXLUtility(MRFTestCase):
         # ASSERT: The final file should be identical to the original
         self.assertTrue(filecmp.cmp(jpeg_path, final_jpeg_path, shallow=False),
                         "Round-trip conversion of single JPEG file failed.")
+
+    def test_jxl_mrf_threads(self):
+        """Test that converting with several threads gives the same output as one thread."""
+        if not shutil.which(self.jxl_executable):
+            self.skipTest(f"'{self.jxl_executable}' executable not found in PATH.")
+
+        # ARRANGE: Two copies of an MRF with many tiles, some of them empty
+        tiles, index, offset = [], [], 0
+        for i, color in enumerate(['red', 'green', 'blue', 'white', 'black'] * 60):
+            if i % 7 == 3:
+                index.append((0, 0))
+                continue
+            tile_path = os.path.join(self.test_dir, "tile.jpg")
+            self.create_mock_jpeg(tile_path, size=(16 + i % 5, 16), color=color)
+            with open(tile_path, "rb") as f:
+                tiles.append(f.read())
+            index.append((offset, len(tiles[-1])))
+            offset += len(tiles[-1])
+        for name in ("one", "many"):
+            self.create_mock_data(os.path.join(self.test_dir, name + ".pjg"), tiles)
+            self.create_mock_idx(os.path.join(self.test_dir, name + ".idx"), index)
+
+        # ACT: Convert with one and with four threads
+        subprocess.run([self.jxl_executable, os.path.join(self.test_dir, "one.pjg")], check=True)
+        subprocess.run([self.jxl_executable, "-t", "4", os.path.join(self.test_dir, "many.pjg")], check=True)
+
+        # ASSERT: Data and index are the same, tile order is preserved
+        for ext in (".pjg.jxl", ".pjg.idx"):
+            self.assertTrue(filecmp.cmp(os.path.join(self.test_dir, "one" + ext),
+                                        os.path.join(self.test_dir, "many" + ext), shallow=False))
+
     def test_jxl_bundle_mode(self):
         """Placeholder test for Esri bundle conversion."""
         self.skipTest("Skipping bundle test: Creating a mock Esri bundle is not yet implemented.")
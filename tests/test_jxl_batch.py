@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import stat
+import subprocess
+from unittest import mock
+from tests.helpers import MRFTestCase
+from mrf_apps import jxl_batch
+
+# Stands in for jxl, names the outputs the same way and halves every tile.
+# Inputs with "bad" in the name lose their last tile
+FAKE_JXL = '''#!{python}
+import sys, struct
+name = sys.argv[-1]
+out = name + ".jxl"
+with open(name[:-3] + "idx", "rb") as f:
+    raw = f.read()
+index = [struct.unpack(">QQ", raw[i:i + 16]) for i in range(0, len(raw), 16)]
+if "bad" in name:
+    last = max(i for i, (o, s) in enumerate(index) if s)
+    index[last] = (0, 0)
+records, offset = [], 0
+with open(name, "rb") as fin, open(out, "wb") as fout:
+    for o, s in index:
+        if s == 0:
+            records.append((0, 0))
+            continue
+        fin.seek(o)
+        tile = fin.read(s)[:max(1, s // 2)]
+        fout.write(tile)
+        records.append((offset, len(tile)))
+        offset += len(tile)
+with open(out[:-4] + ".idx", "wb") as f:
+    for r in records:
+        f.write(struct.pack(">QQ", *r))
+'''
+
+class TestJXLBatch(MRFTestCase):
+    """
+    Tests for jxl_batch.py, which runs jxl over the MRFs in a directory tree, using a stand-in for jxl.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.jxl = os.path.join(self.test_dir, "fake_jxl")
+        with open(self.jxl, "w") as f:
+            f.write(FAKE_JXL.format(python=sys.executable))
+        os.chmod(self.jxl, os.stat(self.jxl).st_mode | stat.S_IEXEC)
+        self.tree = os.path.join(self.test_dir, "tree")
+        os.makedirs(os.path.join(self.tree, "a", "b"))
+        self.first = self.create_sparse_mrf("tree/a/first", 2048, 2048, scale=2, density=0.5,
+                                            tile_size=(100, 400), compression="JPEG", seed=1)
+        self.second = self.create_sparse_mrf("tree/a/b/second", 1024, 1024, density=0.75,
+                                             tile_size=(100, 400), compression="JPEG", seed=2)
+        # Not JPEG, not converted
+        self.create_sparse_mrf("tree/a/other", 1024, 1024, seed=3)
+
+    def test_convert_tree(self):
+        """Test that every JPEG MRF is converted once and that up to date outputs are skipped."""
+        jobs = jxl_batch.find_jobs(self.tree)
+        self.assertEqual([j['input'] for j in jobs], [self.first.data, self.second.data])
+        records = jxl_batch.run(jobs, self.jxl, workers=2)
+        self.assertFalse(any(r['error'] for r in records))
+        for fixture in (self.first, self.second):
+            self.assertEqual(jxl_batch.tile_count(fixture.data + ".idx"), fixture.tiles)
+            self.assertTrue(os.path.isfile(fixture.data + ".jxl"))
+        summary = jxl_batch.summarize(records, 1.0)
+        self.assertEqual(summary['converted'], 2)
+        self.assertEqual(summary['tiles'], self.first.tiles + self.second.tiles)
+        self.assertEqual(summary['input_bytes'], os.path.getsize(self.first.data) + os.path.getsize(self.second.data))
+        self.assertGreater(summary['bytes_saved'], 0)
+
+        # Nothing to do the second time, unless one of the inputs is newer
+        records = jxl_batch.run(jobs, self.jxl)
+        self.assertTrue(all(r['skipped'] for r in records))
+        future = os.path.getmtime(self.first.data + ".jxl") + 10
+        os.utime(self.first.index, (future, future))
+        records = jxl_batch.run(jobs, self.jxl)
+        self.assertEqual([r['input'] for r in records if not r['skipped']], [self.first.data])
+
+    def test_failed_conversion(self):
+        """Test that an output missing tiles is reported and removed."""
+        bad = self.create_sparse_mrf("tree/bad", 1024, 1024, density=1, compression="JPEG", seed=4)
+        records = jxl_batch.run(jxl_batch.find_jobs(self.tree), self.jxl)
+        failed = [r for r in records if r['error']]
+        self.assertEqual([r['input'] for r in failed], [bad.data])
+        self.assertIn("tiles", failed[0]['error'])
+        self.assertFalse(os.path.exists(bad.data + ".jxl"))
+        self.assertFalse(os.path.exists(bad.data + ".idx"))
+        self.assertEqual(jxl_batch.summarize(records, 1.0)['failed'], 1)
+
+    def test_truncated_index(self):
+        """Test that tiles are counted in chunks and that a truncated index is reported as a failed file."""
+        with mock.patch.object(jxl_batch, "CHUNK", 48):
+            self.assertEqual(jxl_batch.tile_count(self.first.index), self.first.tiles)
+        with open(self.second.index, "r+b") as f:
+            f.truncate(os.path.getsize(self.second.index) - 5)
+        records = jxl_batch.run(jxl_batch.find_jobs(self.tree), self.jxl)
+        failed = [r for r in records if r['error']]
+        self.assertEqual([r['input'] for r in failed], [self.second.data])
+        self.assertIn("multiple of 16", failed[0]['error'])
+        self.assertTrue(os.path.isfile(self.first.data + ".jxl"))
+
+    def test_removed_input(self):
+        """Test that an input removed after the jobs are found is reported as a failed file."""
+        jobs = jxl_batch.find_jobs(self.tree)
+        os.remove(self.second.data)
+        records = jxl_batch.run(jobs, self.jxl)
+        failed = [r for r in records if r['error']]
+        self.assertEqual([r['input'] for r in failed], [self.second.data])
+        self.assertTrue(os.path.isfile(self.first.data + ".jxl"))
+        self.assertEqual(jxl_batch.summarize(records, 1.0)['failed'], 1)
+
+    def test_cli_reverse(self):
+        """Test the script in both directions, with the JSON report."""
+        report = os.path.join(self.test_dir, "report.json")
+        cmd = ["python3", "mrf_apps/jxl_batch.py", "--jxl", self.jxl, "--report", report, self.tree]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("Converted 2 of 2 files", result.stdout)
+        with open(report) as f:
+            files = json.load(f)['files']
+        self.assertTrue(all(r['tiles_per_second'] > 0 for r in files))
+
+        # The reverse conversion takes the .jxl files
+        result = subprocess.run(cmd[:1] + [cmd[1], "-r"] + cmd[2:], check=True, capture_output=True, text=True)
+        self.assertIn("Converted 2 of 2 files", result.stdout)
+        self.assertEqual(jxl_batch.tile_count(self.first.data + ".jxl.idx"), self.first.tiles)
@@ -0,0 +1,77 @@
+import os
+from xml.etree import ElementTree as ET
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_meta, mrf_join
+
+class TestMRFMeta(MRFTestCase):
+    """
+    Tests for mrf_meta.py, the MRF metadata model and cache shared by the tools.
+    """
+
+    def test_parse(self):
+        """Test the metadata of a versioned MRF with z slices, bands and overviews."""
+        fixture = self.create_sparse_mrf("meta", 3000, 1500, bands=3, band_interleaved=True,
+                                         zsize=2, scale=2, versions=2, tile_size=32,
+                                         compression="JPEG", explicit_names=True)
+        meta = mrf_meta.load(fixture.mrf)
+        self.assertEqual((meta.size.x, meta.size.y, meta.size.z, meta.size.c), (3000, 1500, 2, 3))
+        self.assertEqual(meta.pagesize.c, 1)
+        self.assertEqual(meta.compression, "JPEG")
+        self.assertTrue(meta.versioned)
+        self.assertEqual(meta.scale, 2)
+        self.assertEqual(meta.datafile, fixture.data)
+        self.assertEqual(meta.indexfile, fixture.index)
+        self.assertEqual(meta.pages, fixture.layout.pages)
+        self.assertEqual(meta.records, fixture.layout.records)
+        self.assertEqual(meta.levels(), fixture.layout.levels)
+        self.assertEqual(meta.record(1, 1, 2, z=1, band=2),
+                         fixture.layout.record(1, 1, 2, z=1, band=2))
+        self.assertEqual(meta.geotransform()[0], -180)
+        self.assertIsNone(meta.source)
+
+    def test_cached_source(self):
+        """Test the default file names and a cloning cached source."""
+        path = os.path.join(self.test_dir, "clone.mrf")
+        root = ET.Element("MRF_META")
+        cached = ET.SubElement(root, "CachedSource")
+        ET.SubElement(cached, "Source", clone="true").text = "origin.mrf"
+        raster = ET.SubElement(root, "Raster")
+        ET.SubElement(raster, "Size", x="1024", y="512", c="1")
+        ET.SubElement(raster, "Compression").text = "LERC"
+        ET.ElementTree(root).write(path)
+
+        meta = mrf_meta.load(path)
+        self.assertTrue(meta.clone)
+        self.assertEqual(meta.source, os.path.join(self.test_dir, "origin.mrf"))
+        self.assertEqual(meta.datafile, os.path.join(self.test_dir, "clone.lrc"))
+        self.assertEqual(meta.indexfile, os.path.join(self.test_dir, "clone.idx"))
+        self.assertEqual(meta.pages, [2])
+        self.assertFalse(meta.versioned)
+
+    def test_cache(self):
+        """Test that the metadata is parsed once and parsed again when the file changes."""
+        path = os.path.join(self.test_dir, "test.mrf")
+        self.create_mock_mrf_xml(path, xsize=1024)
+        first = mrf_meta.load(path)
+        self.assertIs(mrf_meta.load(path), first)
+
+        self.create_mock_mrf_xml(path, xsize=2048)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        second = mrf_meta.load(path)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.size.x, 2048)
+
+    def test_getmrfinfo(self):
+        """Test that mrf_join.getmrfinfo uses the page size and returns copies."""
+        path = os.path.join(self.test_dir, "test.mrf")
+        self.create_mock_mrf_xml(path, xsize=1024, ysize=1024, pagesize=256)
+        info, tree = mrf_join.getmrfinfo(path)
+        self.assertEqual(info['pagesize'], {'x': 256, 'y': 256, 'c': 1})
+        self.assertEqual(info['pages'], [16])
+        info['pages'].append(1)
+        tree.getroot().find("Raster/Size").set("z", "4")
+
+        info, tree = mrf_join.getmrfinfo(path)
+        self.assertEqual(info['pages'], [16])
+        self.assertIsNone(tree.getroot().find("Raster/Size").get("z"))
@@ -147,3 +147,153 @@ class TestMRFInsert(MRFTestCase):
         self.assertTrue(np.all(bottom_left == 100), "Bottom-left quadrant was incorrectly modified.")
 
         result_ds = None
+
+    def test_mrf_insert_multiple_sources(self):
+        """Test inserting several sources in one run, with a single overview rebuild."""
+        target_tiff_path = os.path.join(self.test_dir, "target_multi.tif")
+        target_mrf_path = os.path.join(self.test_dir, "target_multi.mrf")
+        self._create_geotiff(target_tiff_path, 2048, 2048, 1, 0, [0, 1, 0, 2048, 0, -1])
+        gdal.Translate(target_mrf_path, target_tiff_path, options='-f MRF -co BLOCKSIZE=512 -co UNIFORM_SCALE=2')
+
+        # Two neighboring sources, both under the same first overview tile, and one far away
+        sources = []
+        for i, (x, y, value) in enumerate([(0, 2048, 255), (512, 2048, 100), (1536, 512, 50)]):
+            path = os.path.join(self.test_dir, f"source_{i}.tif")
+            self._create_geotiff(path, 512, 512, 1, value, [x, 1, 0, y, 0, -1])
+            sources.append(path)
+
+        subprocess.run([self.mrf_insert_executable, "-r", "Avg"] + sources + [target_mrf_path], check=True)
+
+        result_ds = gdal.Open(target_mrf_path)
+        base_band = result_ds.GetRasterBand(1)
+        self.assertTrue(np.all(base_band.ReadAsArray(0, 0, 512, 512) == 255))
+        self.assertTrue(np.all(base_band.ReadAsArray(512, 0, 512, 512) == 100))
+        self.assertTrue(np.all(base_band.ReadAsArray(1536, 1536, 512, 512) == 50))
+
+        ov_band = base_band.GetOverview(0)
+        self.assertTrue(np.all(ov_band.ReadAsArray(0, 0, 256, 256) == 255))
+        self.assertTrue(np.all(ov_band.ReadAsArray(256, 0, 256, 256) == 100))
+        self.assertTrue(np.all(ov_band.ReadAsArray(768, 768, 256, 256) == 50))
+        self.assertTrue(np.all(ov_band.ReadAsArray(512, 0, 256, 256) == 0))
+        result_ds = None
+
+    def test_mrf_insert_threads(self):
+        """Test that the overviews generated with several threads hold the inserted data."""
+        target_tiff_path = os.path.join(self.test_dir, "target_threads.tif")
+        source_tiff_path = os.path.join(self.test_dir, "source_threads.tif")
+        target_mrf_path = os.path.join(self.test_dir, "target_threads.mrf")
+        self._create_geotiff(target_tiff_path, 4096, 4096, 1, 0, [0, 1, 0, 4096, 0, -1])
+        gdal.Translate(target_mrf_path, target_tiff_path, options='-f MRF -co BLOCKSIZE=512 -co UNIFORM_SCALE=2')
+
+        # Covers the top half, many tiles on each overview level
+        self._create_geotiff(source_tiff_path, 4096, 2048, 1, 200, [0, 1, 0, 4096, 0, -1])
+        subprocess.run([self.mrf_insert_executable, "-r", "Avg", "-threads", "4",
+                        source_tiff_path, target_mrf_path], check=True)
+
+        result_ds = gdal.Open(target_mrf_path)
+        base_band = result_ds.GetRasterBand(1)
+        for level in range(base_band.GetOverviewCount()):
+            ov_band = base_band.GetOverview(level)
+            data = ov_band.ReadAsArray()
+            half = ov_band.YSize // 2
+            self.assertTrue(np.all(data[:half] == 200), f"Overview {level} was not updated.")
+            self.assertTrue(np.all(data[half:] == 0), f"Overview {level} was modified outside the source.")
+        result_ds = None
+
+    def test_mrf_insert_threads_random(self):
+        """Test that random data with nodata gives the same overviews with one and with four threads."""
+        target_tiff_path = os.path.join(self.test_dir, "target_random.tif")
+        source_tiff_path = os.path.join(self.test_dir, "source_random.tif")
+        self._create_geotiff(target_tiff_path, 4096, 4096, 1, 0, [0, 1, 0, 4096, 0, -1])
+
+        # Not aligned to the tiles, with about one pixel in 16 set to the nodata value
+        rng = np.random.default_rng(11)
+        data = rng.integers(1, 256, (2500, 3000), dtype=np.uint8)
+        data[rng.random(data.shape) < 1 / 16] = 0
+        dataset = gdal.GetDriverByName('GTiff').Create(source_tiff_path, 3000, 2500, 1, gdal.GDT_Byte)
+        dataset.SetGeoTransform([300, 1, 0, 3396, 0, -1])
+        dataset.GetRasterBand(1).SetNoDataValue(0)
+        dataset.GetRasterBand(1).WriteArray(data)
+        dataset = None
+
+        results = []
+        for threads in ("1", "4"):
+            target_mrf_path = os.path.join(self.test_dir, "target_random_{}.mrf".format(threads))
+            gdal.Translate(target_mrf_path, target_tiff_path,
+                           options='-f MRF -a_nodata 0 -co BLOCKSIZE=512 -co UNIFORM_SCALE=2')
+            subprocess.run([self.mrf_insert_executable, "-r", "Avg", "-threads", threads,
+                            source_tiff_path, target_mrf_path], check=True)
+            result_ds = gdal.Open(target_mrf_path)
+            base_band = result_ds.GetRasterBand(1)
+            results.append([base_band.ReadAsArray()] + [base_band.GetOverview(level).ReadAsArray()
+                                                        for level in range(base_band.GetOverviewCount())])
+            result_ds = None
+
+        single, threaded = results
+        self.assertEqual(len(single), len(threaded))
+        self.assertGreater(len(single), 3)
+        self.assertTrue(np.array_equal(single[0][700:3200, 300:3300], data))
+        for level, (expected, actual) in enumerate(zip(single, threaded)):
+            self.assertTrue(np.array_equal(expected, actual), f"Level {level} differs with four threads.")
+
+    def test_mrf_insert_threads_unsupported_type(self):
+        """Test that -threads falls back to a single thread, with a warning, for data types it can't resample."""
+        if not hasattr(gdal, 'GDT_Int8'):
+            self.skipTest("GDAL has no Int8 data type.")
+        target_tiff_path = os.path.join(self.test_dir, "target_int8.tif")
+        source_tiff_path = os.path.join(self.test_dir, "source_int8.tif")
+        target_mrf_path = os.path.join(self.test_dir, "target_int8.mrf")
+        for path, size, value in ((target_tiff_path, 2048, 0), (source_tiff_path, 1024, -5)):
+            dataset = gdal.GetDriverByName('GTiff').Create(path, size, size, 1, gdal.GDT_Int8)
+            dataset.SetGeoTransform([0, 1, 0, 2048, 0, -1])
+            dataset.GetRasterBand(1).Fill(value)
+            dataset = None
+        gdal.Translate(target_mrf_path, target_tiff_path, options='-f MRF -co BLOCKSIZE=512 -co UNIFORM_SCALE=2')
+
+        result = subprocess.run([self.mrf_insert_executable, "-r", "Avg", "-threads", "4",
+                                 source_tiff_path, target_mrf_path], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("single thread", result.stderr)
+
+        result_ds = gdal.Open(target_mrf_path)
+        base_band = result_ds.GetRasterBand(1)
+        for level in range(base_band.GetOverviewCount()):
+            data = base_band.GetOverview(level).ReadAsArray()
+            half = data.shape[0] // 2
+            self.assertTrue(np.all(data[:half, :half] == -5), f"Overview {level} was not updated.")
+            self.assertTrue(np.all(data[half:] == 0), f"Overview {level} was modified outside the source.")
+        result_ds = None
+
+    def test_mrf_insert_plan(self):
+        """Test that --plan reports the tiles which would be written and leaves the target unchanged."""
+        import json
+        target_tiff_path = os.path.join(self.test_dir, "target_plan.tif")
+        target_mrf_path = os.path.join(self.test_dir, "target_plan.mrf")
+        self._create_geotiff(target_tiff_path, 2048, 2048, 1, 0, [0, 1, 0, 2048, 0, -1])
+        gdal.Translate(target_mrf_path, target_tiff_path, options='-f MRF -co BLOCKSIZE=512 -co UNIFORM_SCALE=2')
+
+        # One source on tile boundaries, one inside a single tile
+        aligned = os.path.join(self.test_dir, "aligned.tif")
+        inside = os.path.join(self.test_dir, "inside.tif")
+        self._create_geotiff(aligned, 1024, 512, 1, 255, [0, 1, 0, 2048, 0, -1])
+        self._create_geotiff(inside, 100, 100, 1, 255, [1600, 1, 0, 400, 0, -1])
+
+        before = {name: os.path.getsize(os.path.join(self.test_dir, name))
+                  for name in os.listdir(self.test_dir) if name.startswith("target_plan")}
+        result = subprocess.run([self.mrf_insert_executable, "--plan", "-r", "Avg",
+                                 aligned, inside, target_mrf_path],
+                                check=True, capture_output=True, text=True)
+        plan = json.loads(result.stdout)
+
+        self.assertEqual([s["partial_edges"] for s in plan["sources"]], [[], ["left", "right", "top", "bottom"]])
+        self.assertEqual([s["tiles"] for s in plan["sources"]], [2, 1])
+        levels = {level["level"]: level for level in plan["levels"]}
+        self.assertEqual(sorted(levels), [0, 1, 2])
+        self.assertEqual(levels[0]["tiles"], 3)
+        self.assertEqual(levels[0]["partial_tiles"], 1)
+        self.assertEqual(levels[1]["tiles"], 2)
+        self.assertEqual(levels[2]["tiles"], 1)
+        self.assertGreater(plan["bytes"], 0)
+
+        after = {name: os.path.getsize(os.path.join(self.test_dir, name)) for name in before}
+        self.assertEqual(before, after)
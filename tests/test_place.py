@@ -0,0 +1,67 @@
+import subprocess
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_place, mrf_read, mrf_meta
+
+class TestMRFPlace(MRFTestCase):
+    """
+    Tests for mrf_place.py, which copies a smaller MRF into a larger one by remapping index records.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 4x4 tiles and 2 overview levels, into 16x8 tiles and 4 overview levels
+        self.source = self.create_sparse_mrf("region", 2048, 2048, scale=2, density=0.75,
+                                             tile_size=(100, 400), seed=1)
+        self.destination = self.create_sparse_mrf("global", 8192, 4096, scale=2, density=0.5,
+                                                  tile_size=(100, 400), seed=2)
+
+    def all_tiles(self, mrf):
+        meta = mrf_meta.load(mrf)
+        return {(level, row, col): mrf_read.read_tile(mrf, level, row, col)
+                for level, (cols, rows) in enumerate(meta.levels())
+                for row in range(rows) for col in range(cols)}
+
+    def test_place(self):
+        """Test that source tiles replace destination tiles on the placed levels only."""
+        before = self.all_tiles(self.destination.mrf)
+        source = self.all_tiles(self.source.mrf)
+        result = mrf_place.place(self.source.mrf, self.destination.mrf, (4, 2))
+        self.assertEqual(result['placed'], [0, 1])
+        self.assertEqual(result['resample'], [2, 3, 4])
+        self.assertEqual(result['bytes'], sum(int(s) for s in self.source.sizes))
+
+        after = self.all_tiles(self.destination.mrf)
+        expected = dict(before)
+        for (level, row, col), data in source.items():
+            if level in result['placed'] and data:
+                factor = 2 ** level
+                expected[(level, row + 2 // factor, col + 4 // factor)] = data
+        self.assertEqual(after, expected)
+        self.assertEqual(result['tiles'], sum(1 for k, d in source.items() if d and k[0] < 2))
+
+    def test_plan(self):
+        """Test the levels which can be placed for different origins, and invalid placements."""
+        src = mrf_meta.load(self.source.mrf)
+        dst = mrf_meta.load(self.destination.mrf)
+        self.assertEqual(mrf_place.plan(src, dst, (4, 4)), ([0, 1, 2], [3, 4]))
+        self.assertEqual(mrf_place.plan(src, dst, (3, 4)), ([0], [1, 2, 3, 4]))
+        with self.assertRaises(ValueError):
+            mrf_place.plan(src, dst, (14, 0))  # Doesn't fit
+        # Partial last tile, not at the destination edge
+        partial = mrf_meta.load(self.create_sparse_mrf("partial", 2000, 2048, scale=2).mrf)
+        with self.assertRaises(ValueError):
+            mrf_place.plan(partial, dst, (0, 0))
+        # At the right edge, the partial tile is fine
+        odd = mrf_meta.load(self.create_sparse_mrf("odd", 8000, 4096, scale=2).mrf)
+        edge = mrf_meta.load(self.create_sparse_mrf("edge", 8000 - 5 * 512, 2048, scale=2).mrf)
+        self.assertEqual(mrf_place.plan(edge, odd, (5, 0))[0], [0])
+
+    def test_cli_dry_run(self):
+        """Test that the dry run reports the levels and leaves the destination unchanged."""
+        before = self.all_tiles(self.destination.mrf)
+        cmd = ["python3", "mrf_apps/mrf_place.py", self.source.mrf, self.destination.mrf,
+               "--origin", "8,4", "--dry-run"]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("Placed levels: 0,1,2", result.stdout)
+        self.assertIn("need resampling: 3,4", result.stdout)
+        self.assertEqual(self.all_tiles(self.destination.mrf), before)
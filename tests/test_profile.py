@@ -0,0 +1,92 @@
+import os
+import json
+import pstats
+import subprocess
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_profile, mrf_clean, mrf_join
+
+class TestMRFProfile(MRFTestCase):
+    """
+    Tests for mrf_profile.py, the profiling and I/O accounting shared by the tools.
+    """
+
+    def test_flag_removed_from_argv(self):
+        """Test that the profile flag is taken out of the arguments and without it nothing starts."""
+        argv = ["tool", "a.ppg", "b.ppg"]
+        self.assertIsNone(mrf_profile.start(argv))
+        self.assertEqual(argv, ["tool", "a.ppg", "b.ppg"])
+
+        name = os.path.join(self.test_dir, "flag.prof")
+        argv = ["tool", "--profile=" + name, "a.ppg"]
+        profiler = mrf_profile.start(argv)
+        try:
+            self.assertEqual(argv, ["tool", "a.ppg"])
+            self.assertEqual(profiler.name, name)
+        finally:
+            profiler.stop()
+
+    def test_io_accounting(self):
+        """Test the per file and per kind I/O counts of an mrf_clean copy."""
+        self.create_mock_data(os.path.join(self.test_dir, "src.ppg"), [b"A" * 100, b"B" * 50])
+        self.create_mock_idx(os.path.join(self.test_dir, "src.idx"), [(0, 100), (0, 0), (100, 50)])
+
+        name = os.path.join(self.test_dir, "clean.prof")
+        profiler = mrf_profile.start(["mrf_clean.py", "--profile=" + name])
+        try:
+            mrf_clean.mrf_clean(os.path.join(self.test_dir, "src.ppg"),
+                                os.path.join(self.test_dir, "dst.ppg"))
+        finally:
+            report = profiler.stop()
+
+        self.assertEqual(report["kinds"]["index"]["read_bytes"], 48)
+        self.assertEqual(report["kinds"]["index"]["write_bytes"], 48)
+        self.assertEqual(report["kinds"]["data"]["read_bytes"], 150)
+        self.assertEqual(report["kinds"]["data"]["write_bytes"], 150)
+        self.assertEqual(report["files"][os.path.join(self.test_dir, "src.idx")]["opens"], 1)
+        self.assertTrue(os.path.exists(name + ".io.json"))
+        pstats.Stats(name)
+
+    def test_fd_accounting(self):
+        """Test that the positional reads, writes and copies on file descriptors are counted."""
+        inputs = [self.create_sparse_mrf("day{}".format(i), 1024, 1024, density=1.0, tile_size=100, seed=i).data
+                  for i in range(3)]
+        output = os.path.join(self.test_dir, "stack.ppg")
+        name = os.path.join(self.test_dir, "append.prof")
+        profiler = mrf_profile.start(["mrf_join.py", "--profile=" + name])
+        try:
+            mrf_join.mrf_append(inputs, output, 3, workers=3)
+            fd = os.open(inputs[0], os.O_RDONLY)
+            try:
+                self.assertEqual(len(os.pread(fd, 10, 20)), 10)
+            finally:
+                os.close(fd)
+        finally:
+            report = profiler.stop()
+        self.assertIs(os.pread, mrf_profile._os_calls['pread'])
+
+        files = report["files"]
+        self.assertEqual(files[output]["write_bytes"], 3 * 4 * 100)
+        self.assertEqual(files[inputs[0]]["read_bytes"], 4 * 100 + 10)
+        self.assertEqual(files[inputs[0]]["opens"], 2)
+        self.assertEqual(files[os.path.join(self.test_dir, "stack.idx")]["write_bytes"], 3 * 4 * 16)
+
+    def test_cli_profile(self):
+        """Test profiling a command line tool through the environment variable."""
+        idx_path = os.path.join(self.test_dir, "test.idx")
+        self.create_mock_idx(idx_path, [(0, 100), (100, 250)])
+        name = os.path.join(self.test_dir, "read_idx.prof")
+
+        cmd = ["python3", "mrf_apps/mrf_read_idx.py",
+               "--index", idx_path, "--output", os.path.join(self.test_dir, "out.csv")]
+        env = dict(os.environ, MRF_PROFILE=name)
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True, env=env)
+        self.assertTrue("Wrote" in result.stdout)
+        self.assertIn("Profile written to", result.stderr)
+
+        with open(name + ".io.json") as f:
+            report = json.load(f)
+        self.assertEqual(report["tool"], "mrf_read_idx")
+        self.assertEqual(report["kinds"]["index"]["read_bytes"], 32)
+        self.assertGreater(report["kinds"]["meta"]["write_bytes"], 0)
+        stats = pstats.Stats(name)
+        self.assertGreater(stats.total_calls, 0)
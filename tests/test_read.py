@@ -0,0 +1,116 @@
+import os
+import subprocess
+import xml.etree.ElementTree as ET
+from tests.helpers import MRFTestCase
+from tests import mrf_fixtures
+from mrf_apps import mrf_read, mrf_read_data, mrf_read_idx, mrf_reader, mrf_tar, mrf_zdrill
+
+class TestMRFRead(MRFTestCase):
+    """
+    Tests for mrf_read.py and the in-process API of the read tools.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 3x2 tiles at full resolution, 2x1 and 1x1 overviews, two z slices
+        self.fixture = self.create_sparse_mrf("test", 1536, 1024, scale=2, zsize=2,
+                                              density=1.0, tile_size=(10, 40))
+
+    def expected(self, level, row, col, z):
+        record = self.fixture.layout.record(level, row, col, z)
+        i = list(self.fixture.numbers).index(record)
+        with open(self.fixture.data, "rb") as f:
+            f.seek(int(self.fixture.offsets[i]))
+            return f.read(int(self.fixture.sizes[i]))
+
+    def test_read_tile(self):
+        """Test reading tiles by level, row, column and z, level 0 is the full resolution."""
+        info = mrf_read.mrf_info(self.fixture.mrf)
+        self.assertEqual(info['meta'].levels(), [(3, 2), (2, 1), (1, 1)])
+        self.assertEqual(info['z'], 2)
+        for level, row, col, z in ((0, 1, 2, 0), (0, 0, 1, 1), (1, 0, 1, 1), (2, 0, 0, 0)):
+            self.assertEqual(mrf_read.read_tile(self.fixture.mrf, level, row, col, z),
+                             self.expected(level, row, col, z))
+
+    def test_read_tile_layouts(self):
+        """Test tiles of MRFs with an overview scale of 3, band interleaved pages and no z size."""
+        for name, options in (("scale", dict(scale=3)), ("bands", dict(scale=2, bands=3, band_interleaved=True))):
+            fixture = self.create_sparse_mrf(name, 2048, 1536, density=1.0, tile_size=(10, 40), **options)
+            layout = fixture.layout
+            self.assertIsNone(mrf_read.mrf_info(fixture.mrf)['z'])
+            with open(fixture.data, "rb") as f:
+                data = f.read()
+            for level, (cols, rows) in enumerate(layout.levels):
+                for band in range(layout.bandpages):
+                    record = layout.record(level, rows - 1, cols - 1, 0, band)
+                    i = list(fixture.numbers).index(record)
+                    expected = data[int(fixture.offsets[i]):int(fixture.offsets[i] + fixture.sizes[i])]
+                    self.assertEqual(mrf_read.read_tile(fixture.mrf, level, rows - 1, cols - 1, band=band), expected)
+            with self.assertRaises(ValueError):
+                mrf_read.read_tile(fixture.mrf, len(layout.levels), 0, 0)
+            with self.assertRaises(ValueError):
+                mrf_read.read_tile(fixture.mrf, 0, 0, 0, band=layout.bandpages)
+
+    def test_read_file_offsets(self):
+        """Test that the readers start at the IndexFile and DataFile offsets of the metadata."""
+        mrf_path = os.path.join(self.test_dir, "embedded.mrf")
+        for name, source, offset in (("embedded.idx", self.fixture.index, 48), ("embedded.dat", self.fixture.data, 1000)):
+            with open(source, "rb") as f, open(os.path.join(self.test_dir, name), "wb") as out:
+                out.write(b"\xff" * offset + f.read())
+        mrf_fixtures.write_mrf(mrf_path, self.fixture.layout, "PNG", "embedded.dat", "embedded.idx")
+        tree = ET.parse(mrf_path)
+        tree.find("Raster/DataFile").set("offset", "1000")
+        tree.find("Raster/IndexFile").set("offset", "48")
+        tree.write(mrf_path)
+        tar_path = mrf_tar.package(mrf_path)
+
+        layout = self.fixture.layout
+        with mrf_reader.MRFReader(mrf_path) as reader, mrf_reader.MRFReader(tar_path) as tar_reader:
+            for level, (cols, rows) in enumerate(layout.levels):
+                for row in range(rows):
+                    for col in range(cols):
+                        drilled = mrf_zdrill.drill(mrf_path, level, row, col)
+                        for z in range(layout.zsize):
+                            expected = self.expected(level, row, col, z)
+                            self.assertEqual(mrf_read.read_tile(mrf_path, level, row, col, z), expected)
+                            self.assertEqual(mrf_read.read_tile(tar_path, level, row, col, z), expected)
+                            self.assertEqual(reader.read(level, row, col, z), expected)
+                            self.assertEqual(tar_reader.read(level, row, col, z), expected)
+                            self.assertEqual(drilled[z], (z, expected))
+
+    def test_read_tile_errors(self):
+        """Test that invalid tile addresses raise ValueError."""
+        with self.assertRaises(ValueError):
+            mrf_read.read_tile(self.fixture.mrf, 0, 0, 0)  # z is required
+        with self.assertRaises(ValueError):
+            mrf_read.read_tile(self.fixture.mrf, 0, 2, 0, 0)
+        with self.assertRaises(ValueError):
+            mrf_read.read_tile(self.fixture.mrf, 3, 0, 0, 0)
+
+    def test_read_functions(self):
+        """Test the mrf_read_data and mrf_read_idx functions."""
+        record = self.fixture.layout.record(0, 1, 1, 1)
+        offset, size = mrf_read_data.read_record(self.fixture.index, record)
+        self.assertEqual(mrf_read_data.read_data(self.fixture.data, offset, size),
+                         self.expected(0, 1, 1, 1))
+        records = list(mrf_read_idx.read_index(self.fixture.index))
+        self.assertEqual(len(records), self.fixture.layout.records)
+        self.assertEqual(records[record], (16 * record, offset, size))
+
+    def test_cli_tilematrix(self):
+        """Test the command line, where tilematrix 0 is the lowest resolution."""
+        output_path = os.path.join(self.test_dir, "output.dat")
+        cmd = ["python3", "mrf_apps/mrf_read.py", "--input", self.fixture.mrf,
+               "--output", output_path, "--tilematrix", "2", "--tilerow", "1",
+               "--tilecol", "2", "--zlevel", "1"]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertTrue("Wrote" in result.stdout)
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), self.expected(0, 1, 2, 1))
+
+    def test_import_is_quiet(self):
+        """Test that importing the read tools doesn't print or parse arguments."""
+        cmd = ["python3", "-c", "import sys; sys.argv.append('--bogus'); "
+               "from mrf_apps import mrf_read, mrf_read_data, mrf_read_idx"]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertEqual(result.stdout, "")
@@ -0,0 +1,99 @@
+import asyncio
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_reader, mrf_read, mrf_source, mrf_tar
+
+class TestMRFReader(MRFTestCase):
+    """
+    Tests for mrf_reader.py, the tile reader with index block and tile caches.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Shared tiles, so the tile cache holds fewer entries than tiles read
+        self.fixture = self.create_sparse_mrf("reader", 4096, 2048, scale=2, density=0.6,
+                                              tile_size=(100, 2000), payload="duplicate", seed=3)
+        layout = self.fixture.layout
+        self.keys = [(level, row, col) for level, (cols, rows) in enumerate(layout.levels)
+                     for row in range(rows) for col in range(cols)]
+        self.expected = {key: mrf_read.read_tile(self.fixture.mrf, *key) for key in self.keys}
+
+    def test_read(self):
+        """Test that the tiles match mrf_read and that reading them again uses the caches."""
+        with mrf_reader.MRFReader(self.fixture.mrf, block_size=512) as reader:
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+            first = reader.stats()
+            self.assertEqual(first['index']['entries'], -(-16 * self.fixture.layout.records // 512))
+            self.assertEqual(first['tiles']['misses'], len(set(zip(self.fixture.offsets, self.fixture.sizes))))
+
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+            second = reader.stats()
+            self.assertEqual(second['index']['misses'], first['index']['misses'])
+            self.assertEqual(second['tiles']['misses'], first['tiles']['misses'])
+            self.assertEqual(second['tiles']['hits'] - first['tiles']['hits'], self.fixture.tiles)
+            with self.assertRaises(ValueError):
+                reader.read(0, 4, 0)
+
+    def test_eviction(self):
+        """Test that the caches stay under their size, evicting the least recently used entries."""
+        cache = mrf_reader.LRUCache(10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        cache.get('a')
+        cache.put('c', b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1234')
+        cache.put('big', b'x' * 11)
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        with mrf_reader.MRFReader(self.fixture.mrf, index_cache=512, tile_cache=4000, block_size=512) as reader:
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+            stats = reader.stats()
+            self.assertLessEqual(stats['index']['bytes'], 512)
+            self.assertLessEqual(stats['tiles']['bytes'], 4000)
+            self.assertGreater(stats['index']['evictions'], 0)
+            self.assertGreater(stats['tiles']['evictions'], 0)
+
+    def test_threads(self):
+        """Test reading the same tiles from several threads at once."""
+        with mrf_reader.MRFReader(self.fixture.mrf, tile_cache=64 * 1024) as reader:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(lambda key: reader.read(*key), self.keys * 4))
+            self.assertEqual(results, [self.expected[key] for key in self.keys * 4])
+            tiles = reader.stats()['tiles']
+            self.assertEqual(tiles['hits'] + tiles['misses'], 4 * self.fixture.tiles)
+
+    def test_tar(self):
+        """Test reading from an MRF packed in a tar file."""
+        tar_path = mrf_tar.package(self.fixture.mrf)
+        with mrf_reader.MRFReader(tar_path) as reader:
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+
+    def test_fetch_many(self):
+        """Test the async batch fetch, with neighboring tiles read together."""
+        keys = self.keys + self.keys[:5]
+        with mrf_reader.MRFReader(self.fixture.mrf, workers=4) as reader:
+            views = asyncio.run(reader.fetch_many(keys))
+            self.assertTrue(all(isinstance(view, memoryview) for view in views))
+            self.assertEqual([bytes(view) for view in views], [self.expected[key] for key in keys])
+            records, ranges = reader.plan(keys)
+            self.assertLess(len(ranges), self.fixture.tiles)
+            # Only overlapping tiles are merged
+            _, separate = reader.plan(keys, gap=-1)
+            self.assertGreater(len(separate), len(ranges))
+            self.assertEqual([bytes(view) for view in reader.read_many(keys, gap=0)],
+                             [self.expected[key] for key in keys])
+            with self.assertRaises(ValueError):
+                asyncio.run(reader.fetch_many([(0, 4, 0)]))
+
+    def test_read_many_without_preadv(self):
+        """Test the batch read on systems without os.preadv."""
+        with mrf_reader.MRFReader(self.fixture.mrf) as reader, mock.patch.object(mrf_source, "PREADV", False):
+            views = reader.read_many(self.keys)
+        self.assertEqual([bytes(view) for view in views], [self.expected[key] for key in self.keys])
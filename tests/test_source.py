@@ -0,0 +1,141 @@
+import os
+import socket
+import threading
+import subprocess
+import http.server
+from functools import partial
+from tests.helpers import MRFTestCase
+from tests import mrf_fixtures
+from mrf_apps import mrf_reader, mrf_read, mrf_source
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file server with Range support, standing in for object storage."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are sent separately, don't wait for the ACK in between
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        value = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if value is None or self.server.ignore_range or not os.path.isfile(path):
+            return super().do_GET()
+        start, end = (int(v) for v in value[len("bytes="):].split("-"))
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(size))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        end = min(end, size - 1)
+        with open(path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class TestMRFSource(MRFTestCase):
+    """
+    Tests for mrf_source.py, the local, http and canned index byte sources, and their use by the readers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.fixture = self.create_sparse_mrf("source", 16384, 16384, scale=2, density=0.05,
+                                              tile_size=(100, 2000), payload="duplicate", seed=5)
+        self.canned = os.path.join(self.test_dir, "source.ix")
+        mrf_fixtures.write_canned(self.fixture.index, self.canned)
+        self.keys = [(level, row, col) for level, (cols, rows) in enumerate(self.fixture.layout.levels)
+                     for row in range(rows) for col in range(cols)]
+        self.expected = {key: mrf_read.read_tile(self.fixture.mrf, *key) for key in self.keys}
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeHandler, directory=self.test_dir))
+        self.server.requests = self.server.connections = 0
+        self.server.ignore_range = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_canned_index(self):
+        """Test that a canned index reads the same as the original index, with fewer bytes stored."""
+        with open(self.fixture.index, "rb") as f:
+            original = f.read()
+        with mrf_source.open_source(self.canned) as source:
+            self.assertIsInstance(source, mrf_source.CannedSource)
+            self.assertEqual(source.size, len(original))
+            for offset, size in [(0, len(original)), (100, 1000), (len(original) - 20, 100), (len(original), 16)]:
+                self.assertEqual(source.read(offset, size), original[offset:offset + size])
+        self.assertLess(os.path.getsize(self.canned), len(original))
+
+        with mrf_reader.MRFReader(self.fixture.mrf, index=self.canned, block_size=512) as reader:
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+        with self.assertRaises(ValueError):
+            mrf_source.open_source(self.fixture.index, canned=True)
+
+    def test_http_reader(self):
+        """Test reading all the tiles over http, with a canned index, pooled connections and merged reads."""
+        with mrf_reader.MRFReader(self.url + "source.mrf", index=self.url + "source.ix", workers=4) as reader:
+            self.assertIsInstance(reader.data, mrf_source.HTTPSource)
+            for key in self.keys:
+                self.assertEqual(reader.read(*key), self.expected[key])
+            # One connection serves all the reads from one thread
+            self.assertEqual(reader.data.opened, 1)
+            self.assertGreater(reader.data.requests, 1)
+
+            before = reader.data.requests
+            views = reader.read_many(self.keys)
+            self.assertEqual([bytes(view) for view in views], [self.expected[key] for key in self.keys])
+            _, ranges = reader.plan(self.keys)
+            self.assertEqual(reader.data.requests - before, len(ranges))
+            self.assertLess(len(ranges), self.fixture.tiles)
+        # The metadata, the canned index and the data file
+        self.assertLessEqual(self.server.connections, 3 + 4)
+
+    def test_http_source(self):
+        """Test short reads at the end, missing files and servers which ignore Range."""
+        size = os.path.getsize(self.fixture.data)
+        with open(self.fixture.data, "rb") as f:
+            content = f.read()
+        with mrf_source.open_source(self.url + os.path.basename(self.fixture.data)) as source:
+            # Answered by the server, the size is not known yet
+            self.assertEqual(source.read(size - 10, 100), content[-10:])
+            self.assertEqual(source.read(size + 10, 5), b"")
+            self.assertEqual(source.size, size)
+            buffer = bytearray(50)
+            self.assertEqual(source.readinto(memoryview(buffer), 7), 50)
+            self.assertEqual(bytes(buffer), content[7:57])
+            self.server.ignore_range = True
+            with self.assertRaisesRegex(OSError, "Range"):
+                source.read(100, 20)
+            self.server.ignore_range = False
+            self.assertEqual(source.read(100, 20), content[100:120])
+        with mrf_source.open_source(self.url + "missing.idx") as source:
+            with self.assertRaises(OSError):
+                source.read(0, 16)
+
+    def test_read_cli_url(self):
+        """Test mrf_read.py with an MRF and a canned index on an http server."""
+        key = next(key for key in self.keys if key[0] == 0 and self.expected[key])
+        output = os.path.join(self.test_dir, "tile.out")
+        cmd = ["python3", "mrf_apps/mrf_read.py", "--input", self.url + "source.mrf", "--index", self.url + "source.ix",
+               "--output", output, "--tilematrix", str(len(self.fixture.layout.levels) - 1),
+               "--tilerow", str(key[1]), "--tilecol", str(key[2])]
+        subprocess.run(cmd, check=True, capture_output=True)
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), self.expected[key])
@@ -0,0 +1,116 @@
+import os
+import tarfile
+import subprocess
+import xml.etree.ElementTree as ET
+from tests.helpers import MRFTestCase
+from tests import mrf_fixtures
+from mrf_apps import mrf_tar, mrf_read
+
+class TestMRFTar(MRFTestCase):
+    """
+    Tests for mrf_tar.py, which packs an MRF into a tar file, and for reading tiles from it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 4x2 tiles at full resolution and overviews
+        self.fixture = self.create_sparse_mrf("test", 2048, 1024, scale=2, density=0.5,
+                                              tile_size=(100, 900))
+
+    def check_members(self, tar_path):
+        'The tar is readable by tarfile, members match the MRF files'
+        with tarfile.open(tar_path) as tar:
+            names = [m.name for m in tar.getmembers() if m.name != mrf_tar.PAD_NAME]
+            self.assertEqual(names, ["test.mrf", "test.idx", "test.ppg"])
+            for name in names:
+                with open(os.path.join(self.test_dir, name), "rb") as f:
+                    self.assertEqual(tar.extractfile(name).read(), f.read())
+
+    def test_package_aligned(self):
+        """Test that the data member is aligned and the tiles read from the tar match."""
+        tar_path = mrf_tar.package(self.fixture.mrf, align=4096)
+        self.assertEqual(tar_path, self.fixture.mrf + ".tar")
+        self.check_members(tar_path)
+        members = mrf_tar.members(tar_path)
+        self.assertEqual(members["test.ppg"][0] % 4096, 0)
+        self.assertEqual(os.path.getsize(tar_path) % tarfile.RECORDSIZE, 0)
+
+        layout = self.fixture.layout
+        for level in range(len(layout.levels)):
+            cols, rows = layout.levels[level]
+            for row in range(rows):
+                for col in range(cols):
+                    self.assertEqual(mrf_read.read_tile(tar_path, level, row, col),
+                                     mrf_read.read_tile(self.fixture.mrf, level, row, col))
+
+    def test_package_unaligned(self):
+        """Test packing without alignment, which has no padding member."""
+        tar_path = os.path.join(self.test_dir, "plain.tar")
+        mrf_tar.package(self.fixture.mrf, tar_path)
+        self.check_members(tar_path)
+        self.assertNotIn(mrf_tar.PAD_NAME, mrf_tar.members(tar_path))
+        with self.assertRaises(ValueError):
+            mrf_tar.package(self.fixture.mrf, tar_path, align=1000)
+
+    def test_package_too_large(self):
+        """Test that a member too large for UStar is rejected before the output is written."""
+        tar_path = os.path.join(self.test_dir, "large.tar")
+        os.truncate(self.fixture.data, mrf_tar.MAX_SIZE + 1)
+        with self.assertRaises(ValueError):
+            mrf_tar.package(self.fixture.mrf, tar_path)
+        self.assertFalse(os.path.exists(tar_path))
+
+    def test_package_paths(self):
+        """Test that data and index paths in another folder are changed to the member names."""
+        mrf_path = os.path.join(self.test_dir, "paths.mrf")
+        mrf_fixtures.write_mrf(mrf_path, self.fixture.layout, "PNG",
+                               os.path.abspath(self.fixture.data), os.path.abspath(self.fixture.index))
+        tar_path = mrf_tar.package(mrf_path)
+        self.assertEqual(list(mrf_tar.members(tar_path)), ["paths.mrf", "test.idx", "test.ppg"])
+        with tarfile.open(tar_path) as tar:
+            raster = ET.fromstring(tar.extractfile("paths.mrf").read()).find("Raster")
+        self.assertEqual(raster.find("DataFile").text, "test.ppg")
+        self.assertEqual(raster.find("IndexFile").text, "test.idx")
+        i = int(self.fixture.offsets.argmax())
+        address = self.tile_address(int(self.fixture.numbers[i]))
+        self.assertEqual(mrf_read.read_tile(tar_path, *address),
+                         mrf_read.read_tile(self.fixture.mrf, *address))
+
+    def test_cli_read(self):
+        """Test packing from the command line, then reading a tile with both read tools."""
+        tar_path = os.path.join(self.test_dir, "test.mrf.tar")
+        subprocess.run(["python3", "mrf_apps/mrf_tar.py", self.fixture.mrf, "-a", "65536"],
+                       check=True, capture_output=True, text=True)
+        # The tools treat offset 0 as missing
+        i = int(self.fixture.offsets.argmax())
+        record = int(self.fixture.numbers[i])
+        expected = mrf_read.read_tile(self.fixture.mrf, *self.tile_address(record))
+
+        output_path = os.path.join(self.test_dir, "tile.dat")
+        cmd = ["python3", "mrf_apps/mrf_read_data.py", "--input", tar_path,
+               "--output", output_path, "--tile", str(record + 1)]
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+        # Offset and size are relative to the data member
+        cmd = ["python3", "mrf_apps/mrf_read_data.py", "--input", tar_path,
+               "--output", output_path, "--offset", str(int(self.fixture.offsets[i])),
+               "--size", str(int(self.fixture.sizes[i]))]
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+        cmd = ["python3", "mrf_apps/mrf_read.py", "--input", tar_path,
+               "--output", output_path, "--tile", str(record + 1)]
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def tile_address(self, record):
+        'Level, row and column of an index record'
+        layout = self.fixture.layout
+        for level, (cols, rows) in enumerate(layout.levels):
+            if record < layout.starts[level] + cols * rows:
+                row, col = divmod(record - layout.starts[level], cols)
+                return level, row, col
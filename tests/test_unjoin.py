@@ -0,0 +1,201 @@
+# tests/test_unjoin.py
+
+import os
+import json
+import subprocess
+import numpy as np
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_unjoin
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+class TestMRFUnjoinReport(MRFTestCase):
+    """
+    Tests for the mrf_unjoin.py report summary and overview resampling, which do not require GDAL.
+    """
+
+    def _stage(self, name, start, wall, data_bytes=0, index_bytes=0, exit_code=0, errors=0):
+        return {'stage': name, 'start': start, 'wall': wall,
+                'data_bytes': data_bytes, 'index_bytes': index_bytes,
+                'exit_code': exit_code, 'errors': errors}
+
+    def test_percentile(self):
+        """Test the interpolated percentile used for stage times."""
+        values = [4.0, 1.0, 3.0, 2.0, 5.0]
+        self.assertEqual(mrf_unjoin.percentile(values, 0.5), 3.0)
+        self.assertAlmostEqual(mrf_unjoin.percentile(values, 0.95), 4.8)
+        self.assertEqual(mrf_unjoin.percentile([], 0.5), 0.0)
+
+    def test_summarize(self):
+        """Test the per stage summary and the worker concurrency."""
+        # Two cells running at the same time, then a third one on its own
+        cells = [
+            {'start': 0.0, 'wall': 2.0, 'stages': [
+                self._stage('create', 0.0, 1.0, 0, 4096),
+                self._stage('insert', 1.0, 1.0, 1000, 4096)]},
+            {'start': 0.0, 'wall': 2.0, 'stages': [
+                self._stage('create', 0.0, 0.5, 0, 4096),
+                self._stage('insert', 0.5, 1.5, 2000, 0, 1, 2)]},
+            {'start': 2.0, 'wall': 2.0, 'stages': [
+                self._stage('create', 2.0, 1.5, 0, 4096),
+                self._stage('insert', 3.5, 0.5, 3000, 4096)]},
+        ]
+        summary = mrf_unjoin.summarize(cells, 4.0, 4)
+
+        self.assertEqual(summary['cells'], 3)
+        create = summary['stages']['create']
+        self.assertEqual(create['count'], 3)
+        self.assertEqual(create['p50'], 1.0)
+        self.assertEqual(create['index_bytes'], 3 * 4096)
+        insert = summary['stages']['insert']
+        self.assertEqual(insert['data_bytes'], 6000)
+        self.assertEqual(insert['exit_codes'], 1)
+        self.assertEqual(insert['errors'], 2)
+
+        # 6 seconds of cell work in 4 seconds of wall time
+        self.assertEqual(summary['effective_concurrency'], 1.5)
+        self.assertEqual(summary['peak_concurrency'], 2)
+        self.assertEqual(summary['worker_utilization'], 0.375)
+
+    def test_by_four(self):
+        """Test the 2:1 reduction, nearest is the top left pixel and nodata pixels are not averaged."""
+        data = np.array([[1, 2, 9, 9],
+                         [4, 4, 0, 9],
+                         [0, 0, 5, 6],
+                         [0, 0, 7, 0]], dtype=np.uint8)
+        self.assertEqual(mrf_unjoin.by_four(data, False).tolist(), [[1, 9], [0, 5]])
+        self.assertEqual(mrf_unjoin.by_four(data, True).tolist(), [[3, 7], [0, 5]])
+        self.assertEqual(mrf_unjoin.by_four(data, True, 0).tolist(), [[3, 9], [0, 6]])
+        floats = data.astype(np.float32)
+        self.assertEqual(mrf_unjoin.by_four(floats, True, 0).tolist(), [[2.75, 9.0], [0.0, 6.0]])
+
+
+class TestMRFUnjoinInProcess(MRFTestCase):
+    """
+    Tests for the in-process mode of mrf_unjoin.py, which uses the GDAL python bindings.
+    """
+
+    def setUp(self):
+        """Extend setUp to skip all tests if GDAL is missing."""
+        super().setUp()
+        if not gdal:
+            self.skipTest("GDAL Python bindings are not available.")
+        self.data = np.random.default_rng(3).integers(1, 256, (1024, 1024), dtype=np.uint8)
+
+    def tearDown(self):
+        mrf_unjoin._worker.clear()
+        super().tearDown()
+
+    def test_copy_window(self):
+        """Test that copying a window in strips of rows copies only that window."""
+        mrf_unjoin._worker['gdal'] = gdal
+        driver = gdal.GetDriverByName('MEM')
+        source = driver.Create('', 100, 100, 1, gdal.GDT_Byte)
+        source.GetRasterBand(1).WriteArray(self.data[:100, :100])
+        target = driver.Create('', 100, 100, 1, gdal.GDT_Byte)
+        mrf_unjoin.copy_window(source.GetRasterBand(1), target.GetRasterBand(1), 20, 10, 80, 80, 7)
+        result = target.GetRasterBand(1).ReadAsArray()
+        self.assertTrue((result[10:90, 20:] == self.data[10:90, 20:100]).all())
+        self.assertEqual(int(result[:10].sum() + result[90:].sum() + result[:, :20].sum()), 0)
+
+    def test_reduce_window_odd_edge(self):
+        """Test the overview window of the last cell of a level with an odd size, past the edge is nodata."""
+        mrf_unjoin._worker['gdal'] = gdal
+        driver = gdal.GetDriverByName('MEM')
+        data = np.random.default_rng(5).integers(1, 256, (1025, 1025), dtype=np.uint8)
+        padded = np.zeros((1026, 1026), dtype=np.int64)
+        padded[:1025, :1025] = data
+        quads = padded[0::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 0::2] + padded[1::2, 1::2]
+        for nodata in (None, 0):
+            source = driver.Create('', 1025, 1025, 1, gdal.GDT_Byte)
+            if nodata is not None:
+                source.GetRasterBand(1).SetNoDataValue(nodata)
+            source.GetRasterBand(1).WriteArray(data)
+            for average in (False, True):
+                target = driver.Create('', 513, 513, 1, gdal.GDT_Byte)
+                # The last cell covers the base from 512 to the edge
+                mrf_unjoin.reduce_window(source.GetRasterBand(1), target.GetRasterBand(1),
+                                         256, 256, 513, 513, average, 7)
+                result = target.GetRasterBand(1).ReadAsArray()
+                if not average:
+                    expected = padded[::2, ::2]
+                elif nodata is None:
+                    expected = (quads + 2) // 4
+                else:
+                    # The last row and column average the two pixels inside the level
+                    count = np.full((513, 513), 4)
+                    count[-1, :] //= 2
+                    count[:, -1] //= 2
+                    expected = (quads + count // 2) // count
+                self.assertTrue((result[256:, 256:] == expected[256:, 256:]).all())
+                self.assertEqual(int(result[:256].sum() + result[:, :256].sum()), 0)
+
+    def test_worker_open_error(self):
+        """Test that a worker which can't open the source reports an error for each cell."""
+        mrf_unjoin.init_worker(os.path.join(self.test_dir, "missing.mrf"),
+                               os.path.join(self.test_dir, "missing.vrt"), 16)
+        self.assertIn("missing.mrf", mrf_unjoin._worker['error'])
+
+        class Args:
+            input_file = os.path.join(self.test_dir, "missing.mrf")
+            output_dir = self.test_dir
+            rows = columns = 1
+            resampling = 'NNb'
+            verbose = False
+        mrf_info = {'size': [512, 512], 'bands': [{'block': [512, 512]}],
+                    'metadata': {'IMAGE_STRUCTURE': {'COMPRESSION': 'PNG'}},
+                    'cornerCoordinates': {'upperLeft': [0, 512], 'upperRight': [512, 512],
+                                          'lowerLeft': [0, 0], 'lowerRight': [512, 0]}}
+        output_file, _, error_count, stages = mrf_unjoin.process_cell_gdal(Args(), mrf_info, 0, 0)
+        self.assertEqual(output_file, os.path.join(self.test_dir, "missing-c00r00.mrf"))
+        self.assertEqual(error_count, 1)
+        self.assertEqual([(stage['stage'], stage['exit_code'], stage['errors']) for stage in stages],
+                         [('init', 1, 1)])
+
+    def test_unjoin_in_process(self):
+        """Test that each cell MRF holds its window of the input and of the first overview, and zeros elsewhere."""
+        tiff_path = os.path.join(self.test_dir, "input.tif")
+        input_path = os.path.join(self.test_dir, "input.mrf")
+        report_path = os.path.join(self.test_dir, "report.json")
+        output_dir = os.path.join(self.test_dir, "cells")
+        os.makedirs(output_dir)
+        dataset = gdal.GetDriverByName('GTiff').Create(tiff_path, 1024, 1024, 1, gdal.GDT_Byte)
+        dataset.SetGeoTransform([0, 1, 0, 1024, 0, -1])
+        dataset.GetRasterBand(1).WriteArray(self.data)
+        dataset = None
+        gdal.Translate(input_path, tiff_path, options='-of MRF -co BLOCKSIZE=512 -co COMPRESS=PNG')
+
+        subprocess.run(["python3", "mrf_apps/mrf_unjoin.py", "-r", "2", "-c", "2", "-i", input_path,
+                        "-o", output_dir, "-g", "-w", "2", "--cachemax", "16", "--report", report_path],
+                       check=True, capture_output=True)
+
+        for row in range(2):
+            for col in range(2):
+                # Row 0 is the bottom row of cells
+                x, y = 512 * col, 512 * (1 - row)
+                cell = gdal.Open(os.path.join(output_dir, "input-c{:02}r{:02}.mrf".format(col, row)))
+                band = cell.GetRasterBand(1)
+                result = band.ReadAsArray()
+                self.assertTrue((result[y:y + 512, x:x + 512] == self.data[y:y + 512, x:x + 512]).all())
+                self.assertEqual(int(result.sum(dtype=np.int64)),
+                                 int(self.data[y:y + 512, x:x + 512].sum(dtype=np.int64)))
+
+                self.assertEqual(band.GetOverviewCount(), 1)
+                overview = band.GetOverview(0).ReadAsArray()
+                # Nearest is the top left pixel, as mrf_insert picks
+                expected = self.data[y:y + 512:2, x:x + 512:2]
+                self.assertTrue((overview[y // 2:y // 2 + 256, x // 2:x // 2 + 256] == expected).all())
+                self.assertEqual(int(overview.sum(dtype=np.int64)), int(expected.sum(dtype=np.int64)))
+                cell = None
+
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(len(report['cells']), 4)
+        for cell in report['cells']:
+            self.assertEqual(cell['errors'], 0)
+            self.assertEqual([stage['stage'] for stage in cell['stages']], ['create', 'insert', 'overview'])
+        self.assertEqual(report['summary']['stages']['insert']['count'], 4)
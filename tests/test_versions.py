@@ -0,0 +1,92 @@
+import os
+import subprocess
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_versions, mrf_read, mrf_clean, mrf_meta
+
+class TestMRFVersions(MRFTestCase):
+    """
+    Tests for mrf_versions.py and the versioned MRF support in mrf_read.py and mrf_clean.py.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 4x4 tiles and overviews, the current and 3 older versions
+        self.fixture = self.create_sparse_mrf("ver", 2048, 2048, scale=2, density=0.75,
+                                              tile_size=(20, 60), versions=4, churn=0.5,
+                                              slack=8)
+        self.records = self.fixture.layout.records
+
+    def tiles_of(self, mrf, version):
+        'Tile content by record number, for one version'
+        meta = mrf_meta.load(mrf)
+        idx = mrf_versions.read_index(meta.indexfile)
+        result = {}
+        with open(meta.datafile, "rb") as f:
+            for i in range(self.records):
+                offset, size = idx[2 * (version * self.records + i)], idx[2 * (version * self.records + i) + 1]
+                if size:
+                    f.seek(offset)
+                    result[i] = f.read(size)
+        return result
+
+    def test_list_versions(self):
+        """Test the tile and byte counts of each version."""
+        versions = mrf_versions.list_versions(self.fixture.mrf)
+        self.assertEqual([v['version'] for v in versions], [0, 1, 2, 3])
+        for v in versions:
+            self.assertEqual(v['tiles'], self.fixture.tiles)
+            self.assertEqual(v['bytes'], int(self.fixture.sizes.sum()))
+        # Half of the tiles in every older version are overwritten ones
+        for v in versions[1:]:
+            self.assertGreater(v['exclusive_bytes'], 0)
+
+    def test_read_version(self):
+        """Test reading a tile from an older version."""
+        level, row, col = 0, 0, 0
+        record = self.fixture.layout.record(level, row, col)
+        while record not in self.fixture.numbers:
+            col += 1
+            record = self.fixture.layout.record(level, row, col)
+        for version in range(4):
+            self.assertEqual(mrf_read.read_tile(self.fixture.mrf, level, row, col, version=version),
+                             self.tiles_of(self.fixture.mrf, version)[record])
+
+    def test_compact_to_output(self):
+        """Test keeping the two most recent versions in a new MRF."""
+        output = os.path.join(self.test_dir, "out.mrf")
+        saved = mrf_versions.compact(self.fixture.mrf, 2, output)
+        self.assertGreater(saved, 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.test_dir, "out.idx")), 2 * 16 * self.records)
+        self.assertEqual(self.tiles_of(output, 0), self.tiles_of(self.fixture.mrf, 0))
+        self.assertEqual(self.tiles_of(output, 1), self.tiles_of(self.fixture.mrf, 3))
+        # Only the bytes used by the kept versions remain
+        idx = mrf_versions.read_index(os.path.join(self.test_dir, "out.idx"))
+        live = mrf_versions.tiles(idx)
+        self.assertEqual(os.path.getsize(os.path.join(self.test_dir, "out.ppg")),
+                         sum(size for _, size in live))
+
+    def test_compact_in_place(self):
+        """Test compacting to the current version only, in place."""
+        current = self.tiles_of(self.fixture.mrf, 0)
+        cmd = ["python3", "mrf_apps/mrf_versions.py", "compact", self.fixture.mrf]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("bytes saved", result.stdout)
+        self.assertEqual(os.path.getsize(self.fixture.index), 16 * self.records)
+        self.assertEqual(os.path.getsize(self.fixture.data), int(self.fixture.sizes.sum()))
+        self.assertEqual(self.tiles_of(self.fixture.mrf, 0), current)
+
+    def test_clean_versioned(self):
+        """Test that mrf_clean copy and trim keep all versions and store shared tiles once."""
+        before = [self.tiles_of(self.fixture.mrf, v) for v in range(4)]
+        live = sum(size for _, size in mrf_versions.tiles(mrf_versions.read_index(self.fixture.index)))
+
+        destination = os.path.join(self.test_dir, "copy.ppg")
+        mrf_clean.mrf_clean(self.fixture.data, destination)
+        self.assertEqual(os.path.getsize(destination), live)
+
+        class Args:
+            source = self.fixture.data
+            empty_file = 0
+        mrf_clean.mrf_trim(Args())
+        self.assertEqual(os.path.getsize(self.fixture.data), live)
+        self.assertEqual([self.tiles_of(self.fixture.mrf, v) for v in range(4)], before)
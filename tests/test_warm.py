@@ -0,0 +1,74 @@
+import os
+import subprocess
+from xml.etree import ElementTree as ET
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_warm, mrf_meta
+
+class TestMRFWarm(MRFTestCase):
+    """
+    Tests for mrf_warm.py, which pre-loads tiles into a cloning MRF.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # 8x4 tiles at full resolution and 4 overview levels
+        self.source = self.create_sparse_mrf("source", 4096, 2048, scale=2, density=0.5,
+                                             tile_size=(20, 80), slack=4)
+        self.clone = os.path.join(self.test_dir, "clone.mrf")
+        root = ET.parse(self.source.mrf).getroot()
+        cached = ET.Element("CachedSource")
+        ET.SubElement(cached, "Source", clone="true").text = "source.mrf"
+        root.insert(0, cached)
+        ET.ElementTree(root).write(self.clone)
+        self.records = self.source.layout.records
+
+    def local_records(self):
+        return self.read_idx_file(os.path.join(self.test_dir, "clone.idx"))
+
+    def check_tiles(self, records):
+        'The local tiles match the source, empty ones are marked, the index copy is filled'
+        local = self.local_records()
+        source = self.read_idx_file(self.source.index)
+        with open(self.source.data, "rb") as s, open(os.path.join(self.test_dir, "clone.ppg"), "rb") as c:
+            for r in records:
+                if source[r][1] == 0:
+                    self.assertEqual(local[r], (1, 0))
+                    continue
+                s.seek(source[r][0])
+                c.seek(local[r][0])
+                self.assertEqual(c.read(local[r][1]), s.read(source[r][1]))
+                self.assertEqual(local[self.records + r], source[r])
+
+    def test_warm_top_levels(self):
+        """Test warming the lowest resolution levels, then again with nothing left to do."""
+        meta = mrf_meta.load(self.clone)
+        records = mrf_warm.tile_records(meta, mrf_warm.level_tiles(meta, 2) + mrf_warm.level_tiles(meta, 3))
+        stats = mrf_warm.warm(self.clone, records)
+        self.assertEqual(stats['copied'] + stats['empty'], len(records))
+        self.assertGreater(stats['copied'], 0)
+        self.assertEqual(len(self.local_records()), 2 * self.records)
+        self.check_tiles(records)
+        # Other levels are untouched
+        self.assertEqual(self.local_records()[0], (0, 0))
+
+        stats = mrf_warm.warm(self.clone, records)
+        self.assertEqual(stats, {'copied': 0, 'empty': 0, 'cached': len(records), 'bytes': 0})
+
+    def test_bbox_tiles(self):
+        """Test the tiles selected by a bounding box at full resolution and in an overview."""
+        meta = mrf_meta.load(self.clone)
+        # Each full resolution tile covers 45 by 45 degrees
+        self.assertEqual(mrf_warm.bbox_tiles(meta, (-100, 0, -80, 10), 0),
+                         [(0, 1, 1), (0, 1, 2)])
+        self.assertEqual(mrf_warm.bbox_tiles(meta, (-100, 0, -80, 10), 1), [(1, 0, 0), (1, 0, 1)])
+        self.assertEqual(len(mrf_warm.bbox_tiles(meta, (-180, -90, 180, 90), 0)), 32)
+
+    def test_cli(self):
+        """Test warming a bounding box from the command line."""
+        cmd = ["python3", "mrf_apps/mrf_warm.py", self.clone, "--bbox=-180,0,0,90", "--levels", "0,1"]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("Copied", result.stdout)
+        meta = mrf_meta.load(self.clone)
+        tiles = mrf_warm.bbox_tiles(meta, (-180, 0, 0, 90), 0) + mrf_warm.bbox_tiles(meta, (-180, 0, 0, 90), 1)
+        self.assertEqual(len(tiles), 8 + 2)
+        self.check_tiles(mrf_warm.tile_records(meta, tiles))
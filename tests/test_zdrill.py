@@ -0,0 +1,61 @@
+import os
+import json
+import tarfile
+import subprocess
+from tests.helpers import MRFTestCase
+from mrf_apps import mrf_zdrill, mrf_read
+
+class TestMRFZDrill(MRFTestCase):
+    """
+    Tests for mrf_zdrill.py, which reads a tile from every z slice of an MRF.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # A year of daily slices, 4x2 tiles and overviews
+        self.fixture = self.create_sparse_mrf("daily", 2048, 1024, zsize=365, scale=2,
+                                              density=0.5, tile_size=(10, 30))
+        cols = self.fixture.layout.levels[0][0]
+        self.row, self.col = divmod(int(self.fixture.numbers[0]), cols)
+
+    def test_drill(self):
+        """Test that every slice matches a single tile read, including empty tiles."""
+        tiles = mrf_zdrill.drill(self.fixture.mrf, 0, self.row, self.col)
+        self.assertEqual(len(tiles), 365)
+        for z, data in tiles:
+            self.assertEqual(data, mrf_read.read_tile(self.fixture.mrf, 0, self.row, self.col, z))
+        # Every slice has the same tiles
+        self.assertTrue(all(data for _, data in tiles))
+        # A tile that doesn't exist, in a few slices
+        missing = min(set(range(8)) - set(int(n) for n in self.fixture.numbers))
+        row, col = divmod(missing, 4)
+        self.assertEqual(mrf_zdrill.drill(self.fixture.mrf, 0, row, col, [5, 0]), [(5, b""), (0, b"")])
+
+    def test_coalesce(self):
+        """Test that close reads are merged and empty tiles skipped."""
+        tiles = [(100, 10), (0, 0), (0, 50), (200, 10), (1000, 5)]
+        ranges = mrf_zdrill.coalesce(tiles, gap=100)
+        self.assertEqual(ranges, [[0, 210, [2, 0, 3]], [1000, 1005, [4]]])
+        self.assertEqual(len(mrf_zdrill.coalesce(tiles, gap=0)), 4)
+
+    def test_cli_outputs(self):
+        """Test the tar and the concatenated outputs for a range of slices."""
+        tar_path = os.path.join(self.test_dir, "stack.tar")
+        bin_path = os.path.join(self.test_dir, "stack.bin")
+        cmd = ["python3", "mrf_apps/mrf_zdrill.py", self.fixture.mrf, "-l", "1",
+               "-r", "0", "-c", "0", "-z", "10:19", "--tar", tar_path, "--output", bin_path]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        self.assertIn("Wrote", result.stdout)
+
+        expected = [mrf_read.read_tile(self.fixture.mrf, 1, 0, 0, z) for z in range(10, 20)]
+        with tarfile.open(tar_path) as tar:
+            self.assertEqual(tar.getnames(), ["{:05d}.ppg".format(z) for z in range(10, 20)])
+            self.assertEqual([tar.extractfile(m).read() for m in tar.getmembers()], expected)
+
+        with open(os.path.join(self.test_dir, "stack.json")) as f:
+            manifest = json.load(f)
+        with open(bin_path, "rb") as f:
+            content = f.read()
+        self.assertEqual([t['z'] for t in manifest['tiles']], list(range(10, 20)))
+        for entry, data in zip(manifest['tiles'], expected):
+            self.assertEqual(content[entry['offset']:entry['offset'] + entry['size']], data)